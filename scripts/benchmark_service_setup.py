@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк стоимости подготовки сервисов на одно сообщение.
+
+До: на каждое сообщение создавался новый MessageProcessor со всеми зависимостями
+(несколько firestore.Client, genai.configure, CatalogService с пустым кэшем и т.д.).
+После: MessageProcessor берется из общего ServiceContainer.
+
+Запуск: python scripts/benchmark_service_setup.py [количество_сообщений]
+"""
+import os
+import sys
+import time
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from google.cloud import firestore
+from src.services.container import ServiceContainer
+from src.services.message_processor import MessageProcessor
+
+
+class FirestoreClientCounter:
+    """Считает количество созданных firestore.Client"""
+
+    def __init__(self):
+        self.count = 0
+        self._original = firestore.Client
+
+    def __enter__(self):
+        counter = self
+
+        def counting_client(*args, **kwargs):
+            counter.count += 1
+            return counter._original(*args, **kwargs)
+
+        firestore.Client = counting_client
+        return self
+
+    def __exit__(self, *exc):
+        firestore.Client = self._original
+
+
+def measure(label: str, setup, iterations: int):
+    timings = []
+    with FirestoreClientCounter() as counter:
+        for _ in range(iterations):
+            started = time.perf_counter()
+            setup()
+            timings.append((time.perf_counter() - started) * 1000)
+    print(f"{label}:")
+    print(f"  среднее:  {statistics.mean(timings):.3f} ms")
+    print(f"  медиана:  {statistics.median(timings):.3f} ms")
+    print(f"  максимум: {max(timings):.3f} ms")
+    print(f"  firestore.Client на сообщение: {counter.count / iterations:.1f}")
+    return statistics.mean(timings)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    print(f"🔍 Стоимость подготовки сервисов на сообщение ({iterations} сообщений)\n")
+
+    before = measure("До: новый MessageProcessor() на сообщение", lambda: MessageProcessor(), iterations)
+
+    started = time.perf_counter()
+    services = ServiceContainer()
+    startup_ms = (time.perf_counter() - started) * 1000
+    print(f"\nСоздание ServiceContainer при старте: {startup_ms:.3f} ms (один раз)\n")
+
+    after = measure("После: общий ServiceContainer", lambda: services.message_processor, iterations)
+
+    if after > 0:
+        print(f"\n📊 Ускорение подготовки: x{before / after:.0f}")
+
+
+if __name__ == "__main__":
+    main()
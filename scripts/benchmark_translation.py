@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк подготовки сообщения пользователя: определение языка и перевод.
+
+До: detect_language + translate_user_message -> до 3 запросов к Gemini
+(определение языка, перевод на английский, перевод на тайский).
+После: detect_and_translate -> 1 запрос со структурированным JSON-ответом.
+
+По умолчанию Gemini заменяется заглушкой с фиксированной задержкой, чтобы
+сравнить число запросов и латентность без сети. С флагом --live запросы идут
+в настоящий Gemini (нужен GEMINI_API_KEY).
+
+Запуск: python scripts/benchmark_translation.py [--live] [--latency-ms 400] [количество_сообщений]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.ai_service import AIService
+
+MESSAGES = [
+    "Здравствуйте, хочу заказать букет роз на завтра",
+    "Hello, do you deliver to Patong?",
+    "สวัสดีค่ะ อยากสั่งดอกไม้",
+    "Buongiorno, vorrei dei fiori per mia madre",
+    "Можно оплатить картой при доставке?",
+]
+
+
+class FakeGeminiModel:
+    """Заглушка модели Gemini: отвечает с фиксированной задержкой"""
+
+    def __init__(self, latency_ms: float):
+        self.latency = latency_ms / 1000
+
+    async def generate_content_async(self, prompt):
+        await asyncio.sleep(self.latency)
+        response = MagicMock()
+        if '"text_en"' in prompt:
+            response.text = json.dumps({"language": "ru", "confidence": 0.98, "text_en": "translated", "text_thai": "แปล"})
+        elif "determine the language" in prompt:
+            response.text = json.dumps({"language": "ru", "confidence": 0.98, "should_ask_confirmation": False})
+        else:
+            response.text = "translated"
+        return response
+
+
+async def run_legacy(ai_service: AIService, text: str):
+    user_lang = await ai_service.detect_language(text)
+    return await ai_service.translate_user_message(text, user_lang)
+
+
+async def run_combined(ai_service: AIService, text: str):
+    result = await ai_service.detect_and_translate(text, 'auto')
+    return result['text'], result['text_en'], result['text_thai']
+
+
+async def measure(name: str, ai_service: AIService, runner, count: int):
+    # Запросы к Gemini считаются по метрикам общего шлюза
+    calls_before = ai_service.gemini.get_metrics()["calls"]
+    timings = []
+    for i in range(count):
+        text = MESSAGES[i % len(MESSAGES)]
+        started = time.perf_counter()
+        await runner(ai_service, text)
+        timings.append((time.perf_counter() - started) * 1000)
+    calls = (ai_service.gemini.get_metrics()["calls"] - calls_before) / count
+    print(f"{name:<28} запросов к Gemini на сообщение: {calls:.2f}  "
+          f"латентность avg {statistics.mean(timings):.1f} ms, p95 {sorted(timings)[int(0.95 * (count - 1))]:.1f} ms")
+    return statistics.mean(timings), calls
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("count", nargs="?", type=int, default=20)
+    parser.add_argument("--live", action="store_true", help="Использовать настоящий Gemini")
+    parser.add_argument("--latency-ms", type=float, default=400, help="Задержка заглушки на один запрос")
+    args = parser.parse_args()
+
+    def make_service() -> AIService:
+        # Свой экземпляр на каждый прогон: кэш переводов не переходит между ними
+        ai_service = AIService(os.getenv("GEMINI_API_KEY", "benchmark"), catalog_service=MagicMock())
+        if not args.live:
+            fake = FakeGeminiModel(args.latency_ms)
+            for task in ("detect", "translate", "detect_translate"):
+                ai_service.models.set_model(task, fake)
+        return ai_service
+
+    legacy_stats = await measure("detect + translate x2", make_service(), run_legacy, args.count)
+    combined_stats = await measure("detect_and_translate", make_service(), run_combined, args.count)
+
+    print(f"\nУскорение: {legacy_stats[0] / combined_stats[0]:.1f}x, "
+          f"запросов меньше в {legacy_stats[1] / max(combined_stats[1], 0.01):.1f} раза")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
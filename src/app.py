@@ -4,6 +4,7 @@
 
 import os
 import logging.config
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
@@ -30,8 +31,29 @@ def create_app() -> FastAPI:
     # Настраиваем шаблоны
     templates = Jinja2Templates(directory="templates")
 
+    # Создаем экземпляр WebhookHandler
+    webhook_handler = WebhookHandler()
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        """Создание общих сервисов, запуск и остановка фоновой очереди обработки webhook'ов"""
+        from src.services.container import ServiceContainer
+        services = ServiceContainer()
+        app.state.services = services
+        webhook_handler.services = services
+        await services.start()
+        await webhook_handler.queue.start()
+        try:
+            yield
+        finally:
+            await webhook_handler.queue.stop()
+            # Воркеры не ждут обработки сообщений - дожидаемся очередей отправителей отдельно
+            await webhook_handler.sender_lanes.wait_idle()
+            await services.aclose()
+
     # Создаем приложение
     app = FastAPI(
+        lifespan=lifespan,
         title="Aqua Flowers Bot API",
         description="WhatsApp Bot для цветочного магазина",
         version="1.0.0",
@@ -98,9 +120,6 @@ def create_app() -> FastAPI:
     app.include_router(crm_router)
     app.include_router(error_router)
 
-    # Создаем экземпляр WebhookHandler
-    webhook_handler = WebhookHandler()
-
     # Корневой роут для webhook (WhatsApp иногда обращается к /)
     @app.get("/")
     async def root_webhook(request: Request):
@@ -183,6 +202,27 @@ def create_app() -> FastAPI:
     async def get_webhook_metrics():
         """Возвращает метрики обработки webhook'ов"""
         metrics = WebhookHandler.get_metrics()
+        metrics["queue"] = webhook_handler.queue.get_metrics()
+        metrics["sender_lanes"] = webhook_handler.sender_lanes.get_metrics()
+        metrics["dedup"] = webhook_handler.dedup.get_metrics()
+        metrics["last_activity"] = webhook_handler.activity_index.get_metrics()
+        services = getattr(app.state, "services", None)
+        if services is not None:
+            metrics["whatsapp_http"] = services.whatsapp_client.get_metrics()
+            metrics["catalog"] = services.catalog_store.get_metrics()
+            metrics["prompt"] = services.ai_service.prompt_assembler.get_metrics()
+            metrics["gemini"] = services.gemini_client.get_metrics()
+            metrics["ai_circuits"] = services.gemini_client.breaker_states()
+            metrics["models"] = services.model_registry.get_metrics()
+            metrics["ai_replies"] = services.ai_service.get_reply_metrics()
+            metrics["translation_cache"] = services.translation_cache.get_metrics()
+            metrics["history_cache"] = services.history_cache.get_metrics()
+            metrics["reply_context"] = services.message_service.get_wamid_metrics()
+            metrics["translation_enrichment"] = services.translation_worker.get_metrics()
+            metrics["conversation_summary"] = services.conversation_summarizer.get_metrics()
+            metrics["turn_context"] = services.turn_loader.get_metrics()
+            metrics["orders"] = services.order_service.get_metrics()
+            metrics["language_detection"] = services.language_detector.get_metrics()
         return JSONResponse(content=metrics, status_code=200)
 
     # Маршрут для лог-вьювера
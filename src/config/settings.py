@@ -33,9 +33,80 @@ WHATSAPP_PHONE_NUMBER_ID = WHATSAPP_PHONE_ID  # Алиас для совмест
 WHATSAPP_CATALOG_ID = os.getenv('WHATSAPP_CATALOG_ID')
 VERIFY_TOKEN = os.getenv('VERIFY_TOKEN')
 
+# Пул соединений HTTP-клиента WhatsApp Graph API
+WHATSAPP_HTTP2 = os.getenv('WHATSAPP_HTTP2', 'true').lower() == 'true'
+WHATSAPP_MAX_CONNECTIONS = int(os.getenv('WHATSAPP_MAX_CONNECTIONS', 20))
+WHATSAPP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('WHATSAPP_MAX_KEEPALIVE_CONNECTIONS', 10))
+WHATSAPP_KEEPALIVE_EXPIRY = float(os.getenv('WHATSAPP_KEEPALIVE_EXPIRY', 60))
+WHATSAPP_TIMEOUT = float(os.getenv('WHATSAPP_TIMEOUT', 15))
+WHATSAPP_CONNECT_TIMEOUT = float(os.getenv('WHATSAPP_CONNECT_TIMEOUT', 5))
+# Ограничение скорости отправки сообщений с номера (token bucket)
+WHATSAPP_SEND_RATE_PER_SEC = float(os.getenv('WHATSAPP_SEND_RATE_PER_SEC', 20))
+WHATSAPP_SEND_BURST = float(os.getenv('WHATSAPP_SEND_BURST', 10))
+# Сколько товаров каталога отправляется одновременно (1 - последовательная отправка)
+CATALOG_SEND_CONCURRENCY = int(os.getenv('CATALOG_SEND_CONCURRENCY', 5))
+# Кэш каталога: TTL снимка, размер страницы Graph API и таймауты загрузки
+CATALOG_TTL_SECONDS = float(os.getenv('CATALOG_TTL_SECONDS', 300))
+CATALOG_PAGE_LIMIT = int(os.getenv('CATALOG_PAGE_LIMIT', 100))
+CATALOG_REFRESH_TIMEOUT = float(os.getenv('CATALOG_REFRESH_TIMEOUT', 30))
+CATALOG_WARMUP_TIMEOUT = float(os.getenv('CATALOG_WARMUP_TIMEOUT', 10))
+
 # --- AI API ---
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+# Модели по задачам: диалог - основная, перевод и определение языка - быстрый дешевый уровень
+CHAT_MODEL = os.getenv('CHAT_MODEL', 'gemini-2.5-flash')
 TRANSLATION_MODEL = os.getenv('TRANSLATION_MODEL', 'gemini-2.0-flash-exp')
+LANGUAGE_DETECT_MODEL = os.getenv('LANGUAGE_DETECT_MODEL', TRANSLATION_MODEL)
+SUMMARY_MODEL = os.getenv('SUMMARY_MODEL', TRANSLATION_MODEL)
+HEALTH_MODEL = os.getenv('HEALTH_MODEL', TRANSLATION_MODEL)
+# Шлюз Gemini: максимум одновременных запросов и таймауты (ответ бота / вспомогательные вызовы)
+GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', 8))
+GEMINI_AUX_CONCURRENCY = int(os.getenv('GEMINI_AUX_CONCURRENCY', 4))
+GEMINI_TIMEOUT = float(os.getenv('GEMINI_TIMEOUT', 60))
+GEMINI_AUX_TIMEOUT = float(os.getenv('GEMINI_AUX_TIMEOUT', 15))
+# Предохранитель пулов Gemini: доля ошибок за окно, минимум вызовов в окне, окно и время разомкнутого состояния
+GEMINI_BREAKER_ERROR_RATE = float(os.getenv('GEMINI_BREAKER_ERROR_RATE', 0.5))
+GEMINI_BREAKER_MIN_CALLS = int(os.getenv('GEMINI_BREAKER_MIN_CALLS', 10))
+GEMINI_BREAKER_WINDOW_SECONDS = float(os.getenv('GEMINI_BREAKER_WINDOW_SECONDS', 30))
+GEMINI_BREAKER_OPEN_SECONDS = float(os.getenv('GEMINI_BREAKER_OPEN_SECONDS', 20))
+# Общий бюджет повторов Gemini: доля от обычных вызовов за 10 секунд и минимум повторов в окне
+GEMINI_RETRY_BUDGET_RATIO = float(os.getenv('GEMINI_RETRY_BUDGET_RATIO', 0.2))
+GEMINI_RETRY_BUDGET_MIN = int(os.getenv('GEMINI_RETRY_BUDGET_MIN', 3))
+# Сколько раз запрашивать ответ бота, если он не прошел проверку схемы (верхняя граница вызовов на сообщение)
+AI_REPLY_MAX_ATTEMPTS = int(os.getenv('AI_REPLY_MAX_ATTEMPTS', 2))
+# Порог уверенности локального определения языка, ниже которого спрашиваем Gemini
+LANGUAGE_DETECT_THRESHOLD = float(os.getenv('LANGUAGE_DETECT_THRESHOLD', 0.8))
+# Кэш переводов: LRU в памяти + коллекция translation_cache в Firestore
+TRANSLATION_CACHE_SIZE = int(os.getenv('TRANSLATION_CACHE_SIZE', 5000))
+TRANSLATION_CACHE_TTL_SECONDS = float(os.getenv('TRANSLATION_CACHE_TTL_SECONDS', 24 * 3600))
+TRANSLATION_CACHE_STORE_TTL_DAYS = int(os.getenv('TRANSLATION_CACHE_STORE_TTL_DAYS', 90))
+TRANSLATION_CACHE_MAX_TEXT_LENGTH = int(os.getenv('TRANSLATION_CACHE_MAX_TEXT_LENGTH', 300))
+# Кэш истории диалога в памяти: число сессий, сообщений в сессии и время жизни записи
+HISTORY_CACHE_SESSIONS = int(os.getenv('HISTORY_CACHE_SESSIONS', 2000))
+HISTORY_CACHE_MAX_MESSAGES = int(os.getenv('HISTORY_CACHE_MAX_MESSAGES', 200))
+HISTORY_CACHE_TTL_SECONDS = float(os.getenv('HISTORY_CACHE_TTL_SECONDS', 900))
+# Отложенный перевод сообщений пользователя (после ответа бота)
+TRANSLATION_ENRICH_WORKERS = int(os.getenv('TRANSLATION_ENRICH_WORKERS', 2))
+TRANSLATION_ENRICH_MAXSIZE = int(os.getenv('TRANSLATION_ENRICH_MAXSIZE', 1000))
+# Сжатие длинного диалога: порог несжатой истории в токенах и сколько последних сообщений оставлять как есть
+SUMMARY_THRESHOLD_TOKENS = int(os.getenv('SUMMARY_THRESHOLD_TOKENS', 3000))
+SUMMARY_KEEP_MESSAGES = int(os.getenv('SUMMARY_KEEP_MESSAGES', 12))
+# Бюджет промпта ответа бота в токенах (оценка) и минимум последних сообщений истории, которые не урезаются
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', 24000))
+PROMPT_MIN_HISTORY_MESSAGES = int(os.getenv('PROMPT_MIN_HISTORY_MESSAGES', 6))
+# Защита от повторной доставки webhook'ов: окно и размер фильтра wamid в памяти, срок хранения отметок в processed_wamids
+DEDUP_WINDOW_SECONDS = float(os.getenv('DEDUP_WINDOW_SECONDS', 600))
+DEDUP_MAX_IDS = int(os.getenv('DEDUP_MAX_IDS', 5000))
+DEDUP_STORE_TTL_HOURS = float(os.getenv('DEDUP_STORE_TTL_HOURS', 48))
+# Как часто проверять, не изменился ли файл шаблона системного промпта
+PROMPT_RELOAD_CHECK_SECONDS = float(os.getenv('PROMPT_RELOAD_CHECK_SECONDS', 5))
+
+# --- Очередь обработки webhook'ов ---
+WEBHOOK_QUEUE_MAXSIZE = int(os.getenv('WEBHOOK_QUEUE_MAXSIZE', 500))
+WEBHOOK_QUEUE_WORKERS = int(os.getenv('WEBHOOK_QUEUE_WORKERS', 8))
+# Окно склейки быстрых сообщений одного отправителя в один вызов AI (ждем только при всплеске)
+SENDER_COALESCE_WINDOW_MS = int(os.getenv('SENDER_COALESCE_WINDOW_MS', 800))
+SENDER_MAX_BATCH_SIZE = int(os.getenv('SENDER_MAX_BATCH_SIZE', 10))
 
 # --- LINE API ---
 LINE_ACCESS_TOKEN = os.getenv('LINE_ACCESS_TOKEN')
@@ -3,12 +3,15 @@
 """
 
 from .webhook_handler import WebhookHandler
+from .webhook_queue import WebhookQueue, WebhookJob
 # MessageHandler удален - функциональность перенесена в MessageProcessor
 from .interactive_handler import InteractiveHandler
 from .command_handler import CommandHandler
 
 __all__ = [
     'WebhookHandler',
+    'WebhookQueue',
+    'WebhookJob',
     'InteractiveHandler',
     'CommandHandler'
 ] 
\ No newline at end of file
@@ -239,12 +239,13 @@ def extract_full_message_text(body: dict) -> Optional[str]:
     except (KeyError, IndexError):
         return None
 
-async def extract_message_text_with_reply_context(body: dict) -> Optional[str]:
+async def extract_message_text_with_reply_context(body: dict, message_service=None) -> Optional[str]:
     """
     Извлекает текст сообщения с добавлением контекста reply, если он есть.
     
     Args:
         body: Тело webhook от WhatsApp
+        message_service: Общий MessageService (если не передан, создается новый)
         
     Returns:
         str: Текст сообщения с контекстом reply или без него
@@ -261,7 +262,7 @@ async def extract_message_text_with_reply_context(body: dict) -> Optional[str]:
             return message_text
         
         # Получаем контекст из БД
-        reply_context = await get_reply_context_from_db(body, reply_to_message_id)
+        reply_context = await get_reply_context_from_db(body, reply_to_message_id, message_service)
         if reply_context:
             enhanced_message = f"{message_text} (ответ на: {reply_context})"
             print(f"[WEBHOOK_EXTRACTORS] Контекст добавлен: {enhanced_message}")
@@ -273,13 +274,14 @@ async def extract_message_text_with_reply_context(body: dict) -> Optional[str]:
         print(f"[WEBHOOK_EXTRACTORS] Ошибка извлечения текста с контекстом: {e}")
         return None
 
-async def get_reply_context_from_db(body: dict, reply_to_message_id: str) -> Optional[str]:
+async def get_reply_context_from_db(body: dict, reply_to_message_id: str, message_service=None) -> Optional[str]:
     """
     Получает контекст сообщения из БД по reply_to_message_id.
     
     Args:
         body: Тело webhook от WhatsApp
         reply_to_message_id: ID сообщения, на которое отвечает пользователь
+        message_service: Общий MessageService (если не передан, создается новый)
         
     Returns:
         str: Контекст сообщения или None
@@ -289,9 +291,10 @@ async def get_reply_context_from_db(body: dict, reply_to_message_id: str) -> Opt
         if not sender_id:
             return None
         
-        # Импортируем здесь, чтобы избежать циклических импортов
-        from src.services.message_service import MessageService
-        message_service = MessageService()
+        if message_service is None:
+            # Импортируем здесь, чтобы избежать циклических импортов
+            from src.services.message_service import MessageService
+            message_service = MessageService()
         
         # Ищем сообщение во всех сессиях пользователя
         replied_message = await message_service.get_message_by_wa_id(sender_id, None, reply_to_message_id)
@@ -4,20 +4,59 @@
 
 import json
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List
 from src.utils.logging_decorator import log_function
 from src.utils.whatsapp_client import WhatsAppClient
 from src.utils.waba_logger import waba_logger
 from .webhook_extractors import *
+from .webhook_queue import WebhookQueue, WebhookJob
+from src.services.sender_lanes import SenderLaneScheduler, LaneTicket
+from src.services.dedup_store import DedupStore
+from src.services.activity_index import LastActivityIndex
 
 class WebhookHandler:
     """Обработчик webhook'ов от WhatsApp Business API"""
     
-    # Кэш обработанных сообщений для предотвращения дублей
-    _processed_messages = set()
+    def __init__(self, services=None, whatsapp_client: Optional[WhatsAppClient] = None):
+        # Общий контейнер сервисов (ServiceContainer), задается при старте приложения
+        self.services = services
+        # Клиент WhatsApp передается явно или берется из контейнера (один пул соединений на процесс)
+        self._whatsapp_client = whatsapp_client
+        # Очередь фоновой обработки сообщений (воркеры запускаются при старте приложения)
+        self.queue = WebhookQueue(self._process_job)
+        # Последовательная обработка сообщений одного отправителя со склейкой пачек;
+        # одновременно обрабатывается не больше пачек, чем воркеров очереди
+        self.sender_lanes = SenderLaneScheduler(
+            self._run_message_batch, max_concurrent_batches=self.queue.workers_count
+        )
+        # Защита от дублей, пока контейнер сервисов не задан (только память процесса)
+        self._local_dedup = DedupStore()
+        self._local_activity = LastActivityIndex()
     
-    def __init__(self):
-        self.whatsapp_client = WhatsAppClient()
+    @property
+    def whatsapp_client(self) -> WhatsAppClient:
+        """Клиент WhatsApp API (общий экземпляр из контейнера сервисов)"""
+        if self._whatsapp_client is not None:
+            return self._whatsapp_client
+        if self.services is not None:
+            return self.services.whatsapp_client
+        # Без контейнера (тесты, отдельный запуск) создаем собственный клиент один раз
+        self._whatsapp_client = WhatsAppClient()
+        return self._whatsapp_client
+    
+    @property
+    def dedup(self) -> DedupStore:
+        """Хранилище обработанных wamid (общее для инстансов через Firestore, если есть контейнер)"""
+        if self.services is not None:
+            return self.services.dedup_store
+        return self._local_dedup
+    
+    @property
+    def activity_index(self) -> LastActivityIndex:
+        """Индекс последней активности пользователей (для отложенных сообщений)"""
+        if self.services is not None:
+            return self.services.activity_index
+        return self._local_activity
     
     # Метрики для мониторинга
     _metrics = {
@@ -78,22 +117,8 @@ class WebhookHandler:
             if 'messages' in value:
                 for message in value['messages']:
                     message_type = message.get('type')
-                    message_id = message.get('id')
-                    
-                    # Проверяем дубликаты сообщений
-                    if message_id in WebhookHandler._processed_messages:
-                        WebhookHandler._increment_metric("duplicate_messages")
-                        waba_logger.log_duplicate_message(wamid or "unknown", message_type, message_id)
-                        return {"valid": False, "error": "Duplicate message"}
                     
-                    # Добавляем в кэш обработанных сообщений
-                    if message_id:
-                        WebhookHandler._processed_messages.add(message_id)
-                        # Ограничиваем размер кэша
-                        if len(WebhookHandler._processed_messages) > 1000:
-                            WebhookHandler._processed_messages.clear()
-                    
-                    # Проверяем тип сообщения
+                    # Проверяем тип сообщения (дубли отсекаются в process_webhook)
                     if message_type in ['text', 'interactive', 'image', 'document', 'audio', 'video']:
                         waba_logger.log_webhook_validation(wamid or "unknown", {"valid": True, "type": "message", "message_type": message_type})
                         return {"valid": True, "type": "message", "message_type": message_type}
@@ -124,7 +149,37 @@ class WebhookHandler:
             
             # Обрабатываем только сообщения
             if validation_result.get('type') == 'message':
-                return await self._process_message(body)
+                # Повторная доставка того же сообщения (в т.ч. на другой инстанс) не обрабатывается
+                message_id = extract_message_id(body)
+                if not await self.dedup.claim(message_id):
+                    WebhookHandler._increment_metric("duplicate_messages")
+                    waba_logger.log_duplicate_message(message_id or "unknown", validation_result.get('message_type'), message_id)
+                    return {"status": "ignored", "reason": "Duplicate message"}
+                
+                if not self.queue.is_running:
+                    # Очередь не запущена (например, вне приложения) - обрабатываем синхронно
+                    return await self._process_message(body)
+                
+                # Ставим сообщение в очередь и сразу отвечаем WhatsApp.
+                # Место в очереди отправителя резервируется здесь, чтобы сохранить порядок поступления
+                sender_id = extract_sender_id(body)
+                ticket = None
+                try:
+                    ticket = self.sender_lanes.reserve(sender_id) if sender_id else None
+                    job = WebhookJob(
+                        body=body,
+                        sender_id=sender_id,
+                        wa_message_id=message_id,
+                        ticket=ticket
+                    )
+                    await self.queue.enqueue(job)
+                except BaseException:
+                    # Сообщение не попало в очередь - повтор от Meta должен быть обработан
+                    if ticket:
+                        self.sender_lanes.cancel(ticket)
+                    await self.dedup.release(message_id)
+                    raise
+                return {"status": "ok", "message": "queued"}
             
             # Если ничего не подошло
             return {"status": "ignored", "reason": "Unknown content type"}
@@ -133,21 +188,78 @@ class WebhookHandler:
             waba_logger.log_error("unknown", str(e), "process_webhook")
             return {"status": "error", "message": "Internal server error"}
 
+    async def _process_job(self, job: WebhookJob) -> Dict[str, Any]:
+        """Обрабатывает задачу из очереди с замером этапов"""
+        processed_message = None
+        try:
+            with self.queue.stage("extract"):
+                processed_message = await self.extract_and_process_message(job.body)
+        except BaseException:
+            await self.dedup.release(job.wa_message_id)
+            raise
+        finally:
+            if not processed_message and job.ticket:
+                # Освобождаем место, иначе очередь отправителя остановится
+                self.sender_lanes.cancel(job.ticket)
+        if not processed_message:
+            return {"status": "ignored", "reason": "Invalid message"}
+        
+        # Воркер не ждет обработки: сообщение уходит в очередь отправителя, воркер берет следующую задачу
+        with self.queue.stage("dispatch"):
+            success = await self._dispatch_message(processed_message, job.ticket, wait=False)
+        return {"status": "ok" if success else "error"}
+
+    async def _dispatch_message(self, processed_message: Dict[str, Any], ticket: Optional[LaneTicket],
+                                wait: bool = True) -> bool:
+        """
+        Передает сообщение в очередь отправителя.
+        wait=False - не ждать обработки (время обработки пачек - в метриках sender_lanes).
+        """
+        # Логирование извлеченных данных
+        print(f"[WEBHOOK] Извлечены данные: {processed_message.get('sender_id')} -> {processed_message.get('message_text', '')[:50]}...")
+        
+        if ticket is None:
+            return await self._run_message_batch([processed_message])
+        if not wait:
+            self.sender_lanes.dispatch(ticket, processed_message)
+            return True
+        return await self.sender_lanes.submit(ticket, processed_message)
+
+    async def _run_message_batch(self, messages: List[Dict[str, Any]]) -> bool:
+        """Обрабатывает пачку сообщений одного отправителя через MessageProcessor"""
+        if self.services is not None:
+            message_processor = self.services.message_processor
+        else:
+            from src.services.message_processor import MessageProcessor
+            message_processor = MessageProcessor()
+        success = False
+        try:
+            success = await message_processor.process_user_messages(messages)
+            return success
+        finally:
+            if not success:
+                # Ход не завершился - снимаем отметки, чтобы повторная доставка не отсеклась как дубль
+                for message in messages:
+                    await self.dedup.release(message.get('wa_message_id'))
+
     async def _process_message(self, body: Dict[str, Any]) -> Dict[str, Any]:
         """Обрабатывает сообщение от пользователя"""
         try:
+            sender_id = extract_sender_id(body)
+            ticket = self.sender_lanes.reserve(sender_id) if sender_id else None
+            
             # Извлекаем и предобрабатываем данные сообщения
-            processed_message = await self.extract_and_process_message(body)
+            processed_message = None
+            try:
+                processed_message = await self.extract_and_process_message(body)
+            finally:
+                if not processed_message and ticket:
+                    self.sender_lanes.cancel(ticket)
             if not processed_message:
                 return {"status": "ignored", "reason": "Invalid message"}
             
-            # Логирование извлеченных данных
-            print(f"[WEBHOOK] Извлечены данные: {processed_message.get('sender_id')} -> {processed_message.get('message_text', '')[:50]}...")
-            
             # Обрабатываем сообщение через MessageProcessor
-            from src.services.message_processor import MessageProcessor
-            message_processor = MessageProcessor()
-            success = await message_processor.process_user_message(processed_message)
+            success = await self._dispatch_message(processed_message, ticket)
             
             if success:
                 return {"status": "ok", "message": "processed"}
@@ -183,27 +295,13 @@ class WebhookHandler:
                 if time_diff > 120:  # 2 минуты
                     print(f"[WEBHOOK_HANDLER] Отложенное сообщение: {time_diff} секунд назад")
                     
-                    # Проверяем, есть ли более поздние сообщения от этого пользователя
-                    from src.repositories.message_repository import MessageRepository
-                    message_repo = MessageRepository()
-                    
-                    # Получаем последнее сообщение пользователя
-                    last_message = await message_repo.get_last_message_by_sender(sender_id)
-                    
-                    if last_message and last_message.get('timestamp'):
-                        last_message_time = int(last_message['timestamp'])
-                        
-                        # Если последнее сообщение новее текущего, игнорируем отложенное
-                        if last_message_time > message_time:
-                            print(f"[WEBHOOK_HANDLER] Игнорируем отложенное сообщение - есть более новое от {sender_id}")
-                            return None
-                        else:
-                            print(f"[WEBHOOK_HANDLER] Обрабатываем отложенное сообщение - это самое новое от {sender_id}")
-                    else:
-                        print(f"[WEBHOOK_HANDLER] Обрабатываем отложенное сообщение - первое от {sender_id}")
-            
-            # Обрабатываем разные типы сообщений
-            message_text = await self.process_message_by_type(body, message_type)
+                    # Последняя активность пользователя - из памяти или одним чтением users
+                    if await self.activity_index.is_superseded(sender_id, message_time):
+                        print(f"[WEBHOOK_HANDLER] Игнорируем отложенное сообщение - есть более новое от {sender_id}")
+                        return None
+                    print(f"[WEBHOOK_HANDLER] Обрабатываем отложенное сообщение - это самое новое от {sender_id}")
+                
+                self.activity_index.observe(sender_id, message_time, message_id)
             
             # Извлекаем дополнительные данные для изображений и аудио
             image_url = None
@@ -211,14 +309,20 @@ class WebhookHandler:
             audio_duration = None
             transcription = None
             
+            # Обрабатываем разные типы сообщений
+            if message_type == 'audio':
+                # Данные аудио возвращаются явно: обработчик общий для всех воркеров очереди
+                audio_data = await self._extract_audio_data(body)
+                message_text = audio_data['text']
+                audio_url = audio_data['audio_url']
+                audio_duration = audio_data['audio_duration']
+                transcription = audio_data['transcription']
+            else:
+                message_text = await self.process_message_by_type(body, message_type)
+            
             if message_type == 'image':
                 from src.handlers.webhook_extractors import extract_image_url
                 image_url = extract_image_url(body)
-            elif message_type == 'audio':
-                # Используем значения, полученные в extract_audio_message
-                audio_url = getattr(self, '_last_audio_url', None)
-                audio_duration = getattr(self, '_last_audio_duration', None)
-                transcription = getattr(self, '_last_audio_transcription', None)
 
             # Извлекаем reply_to_message_id
             reply_to_message_id = extract_reply_to_message_id(body)
@@ -240,6 +344,8 @@ class WebhookHandler:
             
         except Exception as e:
             print(f"[WEBHOOK_HANDLER] Ошибка извлечения данных сообщения: {e}")
+            # Сообщение не обработано из-за ошибки - повторная доставка должна пройти
+            await self.dedup.release(extract_message_id(body))
             return None
 
     async def process_message_by_type(self, body: Dict[str, Any], message_type: str) -> str:
@@ -265,7 +371,8 @@ class WebhookHandler:
         """Извлекает текст из текстового сообщения с контекстом reply"""
         try:
             from src.handlers.webhook_extractors import extract_message_text_with_reply_context
-            message_text = await extract_message_text_with_reply_context(body)
+            message_service = self.services.message_service if self.services is not None else None
+            message_text = await extract_message_text_with_reply_context(body, message_service)
             return message_text or ""
         except Exception as e:
             print(f"[WEBHOOK_HANDLER] Ошибка извлечения текста: {e}")
@@ -329,6 +436,12 @@ class WebhookHandler:
 
     async def extract_audio_message(self, body: Dict[str, Any]) -> str:
         """Извлекает данные аудиосообщения из webhook и транскрибирует его, сохраняя файл локально"""
+        audio_data = await self._extract_audio_data(body)
+        return audio_data['text']
+
+    async def _extract_audio_data(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Скачивает и транскрибирует аудио, возвращает текст, ссылку, длительность и транскрипцию"""
+        audio_data = {'text': "[AUDIO]", 'audio_url': None, 'audio_duration': None, 'transcription': None}
         try:
             from src.handlers.webhook_extractors import extract_audio_id, extract_audio_duration
             from src.services.whatsapp_media_service import WhatsAppMediaService
@@ -348,7 +461,8 @@ class WebhookHandler:
             
             if not audio_id:
                 print(f"[WEBHOOK_HANDLER] ❌ ID аудио не найден в webhook'е")
-                return "[AUDIO: нет ID]"
+                audio_data['text'] = "[AUDIO: нет ID]"
+                return audio_data
             
             # Скачиваем аудиофайл через WhatsApp Media API
             media_service = WhatsAppMediaService()
@@ -356,7 +470,8 @@ class WebhookHandler:
             
             if not media_result:
                 print(f"[WEBHOOK_HANDLER] ❌ Не удалось скачать аудиофайл {audio_id}")
-                return "[AUDIO: ошибка скачивания]"
+                audio_data['text'] = "[AUDIO: ошибка скачивания]"
+                return audio_data
             
             gcs_url = media_result["gcs_url"]
             print(f"[WEBHOOK_HANDLER] ✅ Аудиофайл скачан: {gcs_url}")
@@ -380,20 +495,21 @@ class WebhookHandler:
             transcription = result["transcription"] if result else None
             
             # Сохраняем ссылку и транскрипцию в processed_message
-            self._last_audio_url = gcs_url
-            self._last_audio_transcription = transcription
-            self._last_audio_duration = audio_duration
+            audio_data['audio_url'] = gcs_url
+            audio_data['transcription'] = transcription
+            audio_data['audio_duration'] = audio_duration
             
             if transcription:
                 print(f"[WEBHOOK_HANDLER] ✅ Успешная транскрипция: {transcription[:50]}...")
-                return f"[AUDIO: {gcs_url}] {transcription}"
+                audio_data['text'] = f"[AUDIO: {gcs_url}] {transcription}"
             else:
                 print(f"[WEBHOOK_HANDLER] ⚠️ Транскрипция не удалась для {gcs_url}")
-                return f"[AUDIO: {gcs_url}]"
+                audio_data['text'] = f"[AUDIO: {gcs_url}]"
+            return audio_data
                 
         except Exception as e:
             print(f"[WEBHOOK_HANDLER] ❌ Ошибка обработки аудиосообщения: {e}")
-            return "[AUDIO]"
+            return audio_data
 
     async def verify_webhook(self, mode: str, challenge: str, verify_token: str) -> str:
         """Верифицирует webhook для WhatsApp"""
@@ -0,0 +1,131 @@
+"""
+Фоновая очередь обработки webhook'ов.
+
+Webhook принимается и валидируется в HTTP-обработчике, после чего сообщение
+кладется в очередь и сразу возвращается 200. Дальнейшая обработка (Firestore,
+Gemini, отправка в WhatsApp) выполняется пулом воркеров.
+"""
+
+import asyncio
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional, Callable, Awaitable, List, Iterator
+from src.config.settings import WEBHOOK_QUEUE_MAXSIZE, WEBHOOK_QUEUE_WORKERS
+from src.utils.metrics import LatencyRegistry
+
+
+@dataclass
+class WebhookJob:
+    """Задача на обработку одного сообщения из webhook'а"""
+    body: Dict[str, Any]
+    sender_id: Optional[str] = None
+    wa_message_id: Optional[str] = None
+    # Место в очереди отправителя (см. SenderLaneScheduler)
+    ticket: Optional[Any] = None
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class WebhookQueue:
+    """Ограниченная очередь с пулом воркеров"""
+
+    def __init__(self, handler: Callable[[WebhookJob], Awaitable[Any]],
+                 maxsize: int = WEBHOOK_QUEUE_MAXSIZE, workers: int = WEBHOOK_QUEUE_WORKERS):
+        self.handler = handler
+        self.maxsize = maxsize
+        self.workers_count = max(1, workers)
+        self.latency = LatencyRegistry()
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._busy_workers = 0
+        self._metrics = {
+            "enqueued": 0,
+            "processed": 0,
+            "failed": 0,
+            "backpressure_waits": 0,
+            "max_depth": 0
+        }
+
+    @property
+    def is_running(self) -> bool:
+        """Запущены ли воркеры очереди"""
+        return bool(self._workers)
+
+    def depth(self) -> int:
+        """Текущее количество задач в очереди"""
+        return self._queue.qsize() if self._queue else 0
+
+    async def start(self):
+        """Запускает воркеры (вызывается при старте приложения)"""
+        if self.is_running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._workers = [
+            asyncio.create_task(self._worker(i), name=f"webhook-worker-{i}")
+            for i in range(self.workers_count)
+        ]
+        print(f"[WEBHOOK_QUEUE] Запущено воркеров: {self.workers_count}, размер очереди: {self.maxsize}")
+
+    async def stop(self, timeout: float = 10.0):
+        """Дожидается обработки очереди и останавливает воркеры"""
+        if not self.is_running:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"[WEBHOOK_QUEUE] Не дождались обработки очереди, осталось задач: {self.depth()}")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        print("[WEBHOOK_QUEUE] Воркеры остановлены")
+
+    async def enqueue(self, job: WebhookJob):
+        """
+        Кладет задачу в очередь. Если очередь заполнена, ждет свободного места
+        (backpressure на HTTP-обработчик), чтобы не терять сообщения.
+        """
+        if self._queue.full():
+            self._metrics["backpressure_waits"] += 1
+            print(f"[WEBHOOK_QUEUE] Очередь заполнена ({self.maxsize}), ожидаем свободного места")
+        await self._queue.put(job)
+        self._metrics["enqueued"] += 1
+        self._metrics["max_depth"] = max(self._metrics["max_depth"], self.depth())
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Замеряет длительность этапа обработки задачи"""
+        with self.latency.time(name):
+            yield
+
+    async def _worker(self, index: int):
+        """Воркер: берет задачи из очереди и передает их обработчику"""
+        while True:
+            job = await self._queue.get()
+            self._busy_workers += 1
+            started = time.perf_counter()
+            self.latency.record("queue_wait", (started - job.enqueued_at) * 1000)
+            try:
+                await self.handler(job)
+                self._metrics["processed"] += 1
+            except Exception as e:
+                self._metrics["failed"] += 1
+                print(f"[WEBHOOK_QUEUE] Ошибка обработки {job.wa_message_id} в воркере {index}: {e}")
+            finally:
+                finished = time.perf_counter()
+                self.latency.record("handle", (finished - started) * 1000)
+                self.latency.record("total", (finished - job.enqueued_at) * 1000)
+                self._busy_workers -= 1
+                self._queue.task_done()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Возвращает метрики очереди и тайминги этапов"""
+        return {
+            "running": self.is_running,
+            "depth": self.depth(),
+            "maxsize": self.maxsize,
+            "workers": self.workers_count,
+            "busy_workers": self._busy_workers,
+            **self._metrics,
+            "stages": self.latency.snapshot()
+        }
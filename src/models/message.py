@@ -38,6 +38,7 @@ class Message:
     audio_url: Optional[str] = None  # URL аудиофайла
     audio_duration: Optional[str] = None  # Длительность аудио в секундах
     transcription: Optional[str] = None  # Транскрибированный текст
+    translation_status: Optional[str] = None  # pending / done / failed для отложенного перевода
     
     def __post_init__(self):
         """Валидация после инициализации"""
@@ -63,7 +64,8 @@ class Message:
             'image_url': self.image_url,
             'audio_url': self.audio_url,
             'audio_duration': self.audio_duration,
-            'transcription': self.transcription
+            'transcription': self.transcription,
+            'translation_status': self.translation_status
         }
     
     @classmethod
@@ -90,7 +92,8 @@ class Message:
             image_url=data.get('image_url'),
             audio_url=data.get('audio_url'),
             audio_duration=data.get('audio_duration'),
-            transcription=data.get('transcription')
+            transcription=data.get('transcription'),
+            translation_status=data.get('translation_status')
         )
     
     def is_from_user(self) -> bool:
@@ -7,11 +7,13 @@ from .session_repository import SessionRepository
 from .message_repository import MessageRepository
 from .order_repository import OrderRepository
 from .user_repository import UserRepository
+from .translation_cache_repository import TranslationCacheRepository
 
 __all__ = [
     'BaseRepository',
     'SessionRepository', 
     'MessageRepository',
     'OrderRepository',
-    'UserRepository'
+    'UserRepository',
+    'TranslationCacheRepository'
 ] 
\ No newline at end of file
@@ -16,15 +16,16 @@ class BaseRepository(ABC, Generic[T]):
     Generic T - тип модели данных
     """
     
-    def __init__(self, collection_name: str):
+    def __init__(self, collection_name: str, db: Optional[firestore.Client] = None):
         """
         Инициализирует репозиторий.
         
         Args:
             collection_name: Имя коллекции в Firestore
+            db: Общий клиент Firestore (если не передан, создается новый)
         """
         self.collection_name = collection_name
-        self.db = self._get_firestore_client()
+        self.db = db if db is not None else self._get_firestore_client()
     
     def _get_firestore_client(self) -> Optional[firestore.Client]:
         """
@@ -8,8 +8,8 @@ from src.models.error import Error, ErrorSeverity, ErrorStatus
 class ErrorRepository(BaseRepository[Error]):
     """Репозиторий для работы с ошибками"""
     
-    def __init__(self):
-        super().__init__("errors")
+    def __init__(self, db=None):
+        super().__init__("errors", db)
     
     def _model_to_dict(self, model: Error) -> Dict[str, Any]:
         """Преобразует модель в словарь для сохранения"""
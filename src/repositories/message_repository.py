@@ -3,15 +3,65 @@
 """
 
 from src.repositories.base_repository import BaseRepository
+from src.repositories.processed_wamid_repository import wamid_doc_id
 from src.models.message import Message
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Dict, Any, List, Optional, Tuple, NamedTuple
 from google.cloud import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
 from datetime import datetime
 
+# Индекс wa_message_id -> путь сообщения (ищется одним чтением, без обхода сессий)
+WAMID_INDEX_COLLECTION = 'wamid_index'
+
+
+class HistoryCursor(NamedTuple):
+    """
+    Курсор страницы истории: время и ID документа самого старого сообщения страницы.
+    ID нужен, чтобы не пропускать сообщения с одинаковым временем на границе страниц.
+    """
+    timestamp: Any
+    doc_id: Optional[str] = None
+
+    def encode(self) -> str:
+        """Курсор для URL: '<ISO-время>|<ID документа>'"""
+        value = self.timestamp.isoformat() if isinstance(self.timestamp, datetime) else str(self.timestamp)
+        return f"{value}|{self.doc_id}" if self.doc_id else value
+
+    @classmethod
+    def decode(cls, value: Optional[str]) -> Optional["HistoryCursor"]:
+        """Курсор из URL; некорректный курсор игнорируется (None). Без ID - только по времени"""
+        if not value:
+            return None
+        timestamp, _, doc_id = value.partition('|')
+        try:
+            return cls(datetime.fromisoformat(timestamp.replace('Z', '+00:00')), doc_id or None)
+        except ValueError:
+            return None
+
+
 class MessageRepository(BaseRepository[Message]):
-    def __init__(self):
-        super().__init__('messages')
-        self.db = self._get_firestore_client()
+    def __init__(self, db=None):
+        super().__init__('messages', db)
+
+    def _wamid_index_ref(self, wa_message_id: str):
+        return self.db.collection(WAMID_INDEX_COLLECTION).document(wamid_doc_id(wa_message_id))
+
+    def _index_wamid(self, writer, message: Message, message_ref):
+        """
+        Добавляет запись wamid_index в ту же пакетную запись или транзакцию (writer), что и сообщение.
+        Запись хранит текст, чтобы контекст ответа получался одним чтением.
+        """
+        if not message.wa_message_id:
+            return
+        writer.set(self._wamid_index_ref(message.wa_message_id), {
+            'wa_message_id': message.wa_message_id,
+            'sender_id': message.sender_id,
+            'session_id': message.session_id,
+            'message_path': message_ref.path,
+            'role': message.role.value,
+            'content': message.content,
+            'timestamp': message.timestamp
+        })
 
     def _model_to_dict(self, model: Message) -> Dict[str, Any]:
         return model.to_dict()
@@ -22,6 +72,65 @@ class MessageRepository(BaseRepository[Message]):
             data['id'] = doc_id
         return Message.from_dict(data)
 
+    @staticmethod
+    def _history_item(msg_data: Dict[str, Any], doc_id: Optional[str] = None) -> Dict[str, Any]:
+        """Сообщение из Firestore в формате истории диалога (id - ID документа сообщения)"""
+        return {
+            'id': doc_id,
+            'role': msg_data.get('role', 'user'),
+            'content': msg_data.get('content', ''),
+            'timestamp': msg_data.get('timestamp'),
+            'content_en': msg_data.get('content_en'),
+            'content_thai': msg_data.get('content_thai'),
+            'wa_message_id': msg_data.get('wa_message_id'),
+            'image_url': msg_data.get('image_url'),
+            'audio_url': msg_data.get('audio_url'),
+            'audio_duration': msg_data.get('audio_duration'),
+            'transcription': msg_data.get('transcription'),
+            'translation_status': msg_data.get('translation_status')
+        }
+
+    def _read_history_window(self, messages_ref, limit: int, before: Optional[HistoryCursor] = None,
+                             transaction=None) -> Tuple[List[Dict[str, Any]], Optional[HistoryCursor]]:
+        """
+        Читает последние limit сообщений (от новых к старым, затем разворачивает).
+        Порядок - по времени, при равном времени - по ID документа, поэтому
+        before - курсор (время, ID документа): читать сообщения строго до него.
+        Возвращает (история по возрастанию времени, курсор для следующей страницы или None).
+        """
+        query = (messages_ref.order_by('timestamp', direction=firestore.Query.DESCENDING)
+                 .order_by(FieldPath.document_id(), direction=firestore.Query.DESCENDING))
+        if before is not None:
+            if before.doc_id:
+                query = query.start_after({'timestamp': before.timestamp, '__name__': before.doc_id})
+            else:
+                query = query.start_after({'timestamp': before.timestamp})
+        # Одно лишнее сообщение - чтобы понять, есть ли страница раньше
+        query = query.limit(limit + 1)
+        docs = list(query.stream(transaction=transaction) if transaction is not None else query.stream())
+        has_more = len(docs) > limit
+        page = docs[:limit]
+        history = [self._history_item(doc.to_dict(), doc.id) for doc in reversed(page)]
+        cursor = HistoryCursor(history[0]['timestamp'], page[-1].id) if has_more and history else None
+        return history, cursor
+
+    async def get_history_window(self, sender_id: str, session_id: str, limit: int = 100,
+                                 before: Optional[HistoryCursor] = None) -> Tuple[List[Dict[str, Any]], Optional[HistoryCursor]]:
+        """
+        Последние limit сообщений сессии и курсор для листания назад.
+        Возвращает ([], None), если Firestore недоступен или произошла ошибка.
+        """
+        if not self.db:
+            return [], None
+        try:
+            messages_ref = self.db.collection('conversations').document(sender_id).collection('sessions').document(session_id).collection('messages')
+            import asyncio
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self._read_history_window, messages_ref, limit, before)
+        except Exception as e:
+            print(f"Error getting history window: {e}")
+            return [], None
+
     async def add_message_with_transaction(self, message: Message, limit: int = 10) -> Tuple[bool, List[Dict[str, Any]]]:
         """
         Добавляет сообщение в структуру conversations с использованием транзакции
@@ -86,37 +195,20 @@ class MessageRepository(BaseRepository[Message]):
                 if message.wa_message_id:
                     message_ref = doc_ref.collection('messages').document(message.wa_message_id)
                     transaction.set(message_ref, message_data)
+                    self._index_wamid(transaction, message, message_ref)
                 else:
                     # Если нет wa_message_id, создаем новый документ
                     message_ref = doc_ref.collection('messages').document()
                     transaction.set(message_ref, message_data)
                 
-                # Получаем обновленную историю диалога в рамках той же транзакции
-                messages_ref = doc_ref.collection('messages')
-                query = messages_ref.order_by('timestamp', direction=firestore.Query.ASCENDING).limit(limit)
-                messages = query.stream(transaction=transaction)
-                
-                history = []
-                for msg_doc in messages:
-                    msg_data = msg_doc.to_dict()
-                    history.append({
-                        'role': msg_data.get('role', 'user'),
-                        'content': msg_data.get('content', ''),
-                        'timestamp': msg_data.get('timestamp'),
-                        'content_en': msg_data.get('content_en'),
-                        'content_thai': msg_data.get('content_thai'),
-                        'wa_message_id': msg_data.get('wa_message_id'),
-                        'image_url': msg_data.get('image_url'),
-                        'audio_url': msg_data.get('audio_url'),
-                        'audio_duration': msg_data.get('audio_duration'),
-                        'transcription': msg_data.get('transcription')
-                    })
+                # Получаем обновленную историю диалога (последние limit сообщений) в рамках той же транзакции
+                history, _ = self._read_history_window(doc_ref.collection('messages'), limit, transaction=transaction)
                 
                 return history
             
             # Выполняем транзакцию синхронно
             import asyncio
-            loop = asyncio.get_event_loop()
+            loop = asyncio.get_running_loop()
             history = await loop.run_in_executor(None, lambda: self.db.run_in_transaction(transaction_callback))
             
             print(f"Message saved to {message.sender_id}/{message.session_id} with wa_id: {message.wa_message_id}")
@@ -152,17 +244,21 @@ class MessageRepository(BaseRepository[Message]):
             if message.wa_message_id:
                 message_data['wa_message_id'] = message.wa_message_id
             
-            # Сохраняем с нужным id
+            # Сообщение, запись wamid_index и счетчик сессии - одной пакетной записью
+            batch = self.db.batch()
             if message.wa_message_id:
-                doc_ref.collection('messages').document(message.wa_message_id).set(message_data)
+                message_ref = doc_ref.collection('messages').document(message.wa_message_id)
             else:
-                doc_ref.collection('messages').add(message_data)
+                message_ref = doc_ref.collection('messages').document()
+            batch.set(message_ref, message_data)
+            self._index_wamid(batch, message, message_ref)
             
             # Обновляем счетчик сообщений в документе сессии
-            doc_ref.update({
+            batch.set(doc_ref, {
                 'message_count': firestore.Increment(1),
                 'last_activity': message.timestamp
-            })
+            }, merge=True)
+            batch.commit()
             
             print(f"Message saved to {message.sender_id}/{message.session_id} with wa_id: {message.wa_message_id}")
             return True
@@ -171,43 +267,65 @@ class MessageRepository(BaseRepository[Message]):
             print(f"Error adding message to conversation: {e}")
             return False
 
-    async def get_conversation_history_by_sender(self, sender_id: str, session_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+    async def add_messages_batch(self, messages: List[Message]) -> bool:
         """
-        Получает историю диалога по sender_id и session_id из структуры conversations.
-        Возвращает список словарей с полями role и content.
+        Сохраняет несколько сообщений одной сессии одной пакетной записью (WriteBatch)
+        и одним обновлением счетчика сессии.
         """
         if not self.db:
-            return []
+            return False
+        if not messages:
+            return True
         
         try:
-            # Прямой путь к сообщениям (не проверяем существование документа сессии)
-            messages_ref = self.db.collection('conversations').document(sender_id).collection('sessions').document(session_id).collection('messages')
+            first = messages[0]
+            doc_ref = self.db.collection('conversations').document(first.sender_id).collection('sessions').document(first.session_id)
             
-            # Получаем сообщения, отсортированные по времени
-            query = messages_ref.order_by('timestamp', direction=firestore.Query.ASCENDING).limit(limit)
-            messages = query.stream()
+            batch = self.db.batch()
+            for message in messages:
+                message_data = {
+                    'role': message.role.value,
+                    'content': message.content,
+                    'timestamp': message.timestamp,
+                    'content_en': message.content_en,
+                    'content_thai': message.content_thai,
+                    'image_url': message.image_url,
+                    'audio_url': message.audio_url,
+                    'audio_duration': message.audio_duration,
+                    'transcription': message.transcription
+                }
+                if message.wa_message_id:
+                    message_data['wa_message_id'] = message.wa_message_id
+                    message_ref = doc_ref.collection('messages').document(message.wa_message_id)
+                else:
+                    message_ref = doc_ref.collection('messages').document()
+                batch.set(message_ref, message_data)
+                self._index_wamid(batch, message, message_ref)
             
-            history = []
-            for msg_doc in messages:
-                msg_data = msg_doc.to_dict()
-                history.append({
-                    'role': msg_data.get('role', 'user'),
-                    'content': msg_data.get('content', ''),
-                    'timestamp': msg_data.get('timestamp'),
-                    'content_en': msg_data.get('content_en'),
-                    'content_thai': msg_data.get('content_thai'),
-                    'wa_message_id': msg_data.get('wa_message_id'),
-                    'image_url': msg_data.get('image_url'),
-                    'audio_url': msg_data.get('audio_url'),
-                    'audio_duration': msg_data.get('audio_duration'),
-                    'transcription': msg_data.get('transcription')
-                })
+            # Обновляем счетчик сообщений в документе сессии
+            batch.set(doc_ref, {
+                'message_count': firestore.Increment(len(messages)),
+                'last_activity': messages[-1].timestamp
+            }, merge=True)
             
-            return history
+            import asyncio
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, batch.commit)
             
+            print(f"Batch of {len(messages)} messages saved to {first.sender_id}/{first.session_id}")
+            return True
+        
         except Exception as e:
-            print(f"Error getting conversation history: {e}")
-            return []
+            print(f"Error saving messages batch: {e}")
+            return False
+
+    async def get_conversation_history_by_sender(self, sender_id: str, session_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        Получает последние limit сообщений диалога по sender_id и session_id из структуры conversations.
+        Возвращает список словарей в порядке возрастания времени.
+        """
+        history, _ = await self.get_history_window(sender_id, session_id, limit)
+        return history
 
     async def find_session_owner(self, session_id: str, known_users: List[str] = None) -> str:
         """
@@ -234,6 +352,52 @@ class MessageRepository(BaseRepository[Message]):
             print(f"Error finding session owner: {e}")
             return None
 
+    async def get_message_by_wa_id_indexed(self, sender_id: str, wa_message_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Ищет сообщение одним чтением wamid_index.
+        None - записи в индексе нет (сообщение сохранено до появления индекса или не найдено).
+        """
+        if not self.db:
+            return None
+        import asyncio
+        loop = asyncio.get_running_loop()
+        doc = await loop.run_in_executor(None, self._wamid_index_ref(wa_message_id).get)
+        if not doc.exists:
+            return None
+        entry = doc.to_dict()
+        if entry.get('sender_id') != sender_id:
+            return None
+        return {
+            'session_id': entry.get('session_id'),
+            'role': entry.get('role', 'user'),
+            'content': entry.get('content', ''),
+            'timestamp': entry.get('timestamp'),
+            'content_en': entry.get('content_en'),
+            'content_thai': entry.get('content_thai'),
+            'wa_message_id': wa_message_id
+        }
+
+    async def backfill_wamid_index(self, sender_id: str, message: Dict[str, Any]):
+        """Дописывает в wamid_index сообщение, найденное обходом сессий"""
+        if not self.db:
+            return
+        wa_message_id = message['wa_message_id']
+        message_ref = (self.db.collection('conversations').document(sender_id)
+                       .collection('sessions').document(message['session_id'])
+                       .collection('messages').document(wa_message_id))
+        data = {
+            'wa_message_id': wa_message_id,
+            'sender_id': sender_id,
+            'session_id': message['session_id'],
+            'message_path': message_ref.path,
+            'role': message.get('role', 'user'),
+            'content': message.get('content', ''),
+            'timestamp': message.get('timestamp')
+        }
+        import asyncio
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._wamid_index_ref(wa_message_id).set, data)
+
     async def get_message_by_wa_id(self, sender_id: str, wa_message_id: str, session_service) -> Optional[Dict[str, Any]]:
         """
         Ищет сообщение по wa_message_id во всех сессиях пользователя.
@@ -284,25 +448,10 @@ class MessageRepository(BaseRepository[Message]):
             @firestore.transactional
             def transaction_callback(transaction, message, limit):
                 doc_ref = self.db.collection('conversations').document(message.sender_id).collection('sessions').document(message.session_id)
-                # 1. Сначала читаем историю сообщений
-                messages_ref = doc_ref.collection('messages')
-                query = messages_ref.order_by('timestamp', direction=firestore.Query.ASCENDING).limit(limit)
+                # 1. Сначала читаем историю сообщений (limit=0 - история не нужна)
                 history = []
-                messages = query.stream(transaction=transaction)
-                for msg_doc in messages:
-                    msg_data = msg_doc.to_dict()
-                    history.append({
-                        'role': msg_data.get('role', 'user'),
-                        'content': msg_data.get('content', ''),
-                        'timestamp': msg_data.get('timestamp'),
-                        'content_en': msg_data.get('content_en'),
-                        'content_thai': msg_data.get('content_thai'),
-                        'wa_message_id': msg_data.get('wa_message_id'),
-                        'image_url': msg_data.get('image_url'),
-                        'audio_url': msg_data.get('audio_url'),
-                        'audio_duration': msg_data.get('audio_duration'),
-                        'transcription': msg_data.get('transcription')
-                    })
+                if limit > 0:
+                    history, _ = self._read_history_window(doc_ref.collection('messages'), limit, transaction=transaction)
                 
                 # 2. Добавляем текущее сообщение в историю (если его там еще нет)
                 current_message_data = {
@@ -317,6 +466,8 @@ class MessageRepository(BaseRepository[Message]):
                     'audio_duration': message.audio_duration,
                     'transcription': message.transcription
                 }
+                if message.translation_status:
+                    current_message_data['translation_status'] = message.translation_status
                 
                 # Проверяем, есть ли уже такое сообщение в истории
                 message_exists = any(
@@ -343,13 +494,15 @@ class MessageRepository(BaseRepository[Message]):
                         'last_activity': message.timestamp
                     })
                 
-                # Сохраняем сообщение
-                if message.wa_message_id:
-                    message_ref = doc_ref.collection('messages').document(message.wa_message_id)
+                # Сохраняем сообщение (ID документа - wa_message_id или заранее выданный id)
+                message_doc_id = message.wa_message_id or message.id
+                if message_doc_id:
+                    message_ref = doc_ref.collection('messages').document(message_doc_id)
                     transaction.set(message_ref, current_message_data)
                 else:
                     message_ref = doc_ref.collection('messages').document()
                     transaction.set(message_ref, current_message_data)
+                self._index_wamid(transaction, message, message_ref)
                 
                 return history
             transaction = self.db.transaction()
@@ -361,6 +514,27 @@ class MessageRepository(BaseRepository[Message]):
             print(f"[SYNC] Error in transaction: {e}")
             return False, []
 
+    async def update_message_translations(self, sender_id: str, session_id: str, message_id: str,
+                                          content_en: Optional[str], content_thai: Optional[str],
+                                          status: str) -> bool:
+        """
+        Дописывает переводы в уже сохраненное сообщение и обновляет статус перевода.
+        """
+        if not self.db:
+            return False
+        message_ref = (self.db.collection('conversations').document(sender_id)
+                       .collection('sessions').document(session_id)
+                       .collection('messages').document(message_id))
+        update = {'translation_status': status}
+        if content_en is not None:
+            update['content_en'] = content_en
+        if content_thai is not None:
+            update['content_thai'] = content_thai
+        import asyncio
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, message_ref.update, update)
+        return True
+
     def add_user_and_ai_messages_with_transaction_sync(self, user_message: Message, ai_message: Message, limit: int = 10):
         """
         Сохраняет сообщение пользователя и AI в одной транзакции Firestore.
@@ -376,18 +550,7 @@ class MessageRepository(BaseRepository[Message]):
                 
                 # 1. Сначала читаем существующую историю
                 messages_ref = doc_ref.collection('messages')
-                query = messages_ref.order_by('timestamp', direction=firestore.Query.ASCENDING).limit(limit)
-                history = []
-                messages = query.stream(transaction=transaction)
-                for msg_doc in messages:
-                    msg_data = msg_doc.to_dict()
-                    history.append({
-                        'role': msg_data.get('role', 'user'),
-                        'content': msg_data.get('content', ''),
-                        'timestamp': msg_data.get('timestamp'),
-                        'content_en': msg_data.get('content_en'),
-                        'content_thai': msg_data.get('content_thai')
-                    })
+                history, _ = self._read_history_window(messages_ref, limit, transaction=transaction)
                 
                 # 2. Обновляем сессию
                 session_doc = doc_ref.get(transaction=transaction)
@@ -416,6 +579,7 @@ class MessageRepository(BaseRepository[Message]):
                     'timestamp': user_message.timestamp,
                     'created_at': user_message.timestamp
                 })
+                self._index_wamid(transaction, user_message, user_doc_ref)
                 
                 # 4. Сохраняем сообщение AI
                 ai_doc_ref = messages_ref.document()
@@ -430,6 +594,7 @@ class MessageRepository(BaseRepository[Message]):
                     'timestamp': ai_message.timestamp,
                     'created_at': ai_message.timestamp
                 })
+                self._index_wamid(transaction, ai_message, ai_doc_ref)
                 
                 # 5. Добавляем оба сообщения в историю
                 history.append({
@@ -8,8 +8,8 @@ from typing import Dict, Any, Optional, List
 from google.cloud import firestore
 
 class OrderRepository(BaseRepository[Order]):
-    def __init__(self):
-        super().__init__('orders')
+    def __init__(self, db=None):
+        super().__init__('orders', db)
 
     def _model_to_dict(self, model: Order) -> Dict[str, Any]:
         return model.to_dict()
@@ -93,6 +93,54 @@ class OrderRepository(BaseRepository[Order]):
             print(f"Error updating order {sender_id}/{session_id}: {e}")
             return False
     
+    async def update_order_fields(self, sender_id: str, session_id: str, fields: Dict[str, Any]) -> bool:
+        """
+        Обновляет только переданные поля заказа (значения могут быть
+        серверными преобразованиями: ArrayUnion, ArrayRemove, SERVER_TIMESTAMP).
+        """
+        try:
+            doc_ref = self._get_user_session_collection_ref(sender_id, session_id)
+            doc_ref.update(fields)
+            
+            print(f"Updated order fields {sorted(fields)}: orders/{sender_id}/sessions/{session_id}")
+            return True
+            
+        except Exception as e:
+            print(f"Error updating order fields {sender_id}/{session_id}: {e}")
+            return False
+    
+    async def remove_items_by_product_id(self, sender_id: str, session_id: str, product_id: str,
+                                         updated_at: str) -> int:
+        """
+        Удаляет из заказа товары с product_id в транзакции. Элементы сравниваются
+        по product_id, а не целиком (как ArrayRemove), поэтому удаляются и записи
+        старого формата с лишними или недостающими ключами.
+        Возвращает число удаленных товаров, -1 - ошибка.
+        """
+        try:
+            doc_ref = self._get_user_session_collection_ref(sender_id, session_id)
+
+            @firestore.transactional
+            def remove_in_transaction(transaction):
+                snapshot = doc_ref.get(transaction=transaction)
+                if not snapshot.exists:
+                    return 0
+                items = (snapshot.to_dict() or {}).get('items') or []
+                kept = [item for item in items
+                        if not (isinstance(item, dict) and item.get('product_id') == product_id)]
+                removed = len(items) - len(kept)
+                if removed:
+                    transaction.update(doc_ref, {'items': kept, 'updated_at': updated_at})
+                return removed
+
+            removed = remove_in_transaction(self.db.transaction())
+            print(f"Removed {removed} item(s) {product_id}: orders/{sender_id}/sessions/{session_id}")
+            return removed
+
+        except Exception as e:
+            print(f"Error removing order item {product_id} {sender_id}/{session_id}: {e}")
+            return -1
+    
     async def get_user_orders(self, sender_id: str, limit: Optional[int] = None) -> List[Order]:
         """
         Получает все заказы пользователя.
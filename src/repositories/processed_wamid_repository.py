@@ -0,0 +1,59 @@
+"""
+Репозиторий обработанных входящих сообщений (коллекция processed_wamids)
+"""
+
+import asyncio
+import hashlib
+from datetime import datetime
+from typing import Dict, Any
+from google.api_core.exceptions import AlreadyExists
+from google.cloud import firestore
+from src.repositories.base_repository import BaseRepository
+
+
+def wamid_doc_id(wamid: str) -> str:
+    """ID документа: wamid может содержать '/', поэтому используется хэш"""
+    return hashlib.sha256(wamid.encode("utf-8")).hexdigest()[:40]
+
+
+class ProcessedWamidRepository(BaseRepository[Dict[str, Any]]):
+    """
+    Отметки об обработанных wamid. Документ создается атомарно (create),
+    поэтому из нескольких инстансов сообщение забирает ровно один.
+    Старые отметки удаляет TTL-политика Firestore по полю expires_at.
+    """
+
+    def __init__(self, db=None):
+        super().__init__("processed_wamids", db)
+
+    def _model_to_dict(self, model: Dict[str, Any]) -> Dict[str, Any]:
+        return dict(model)
+
+    def _dict_to_model(self, data: Dict[str, Any], doc_id: str) -> Dict[str, Any]:
+        return data
+
+    async def claim(self, wamid: str, expires_at: datetime) -> bool:
+        """Создает отметку; False - wamid уже обработан (этим или другим инстансом)"""
+        if not self.db:
+            return True
+        doc_ref = self._get_collection_ref().document(wamid_doc_id(wamid))
+        data = {
+            'wamid': wamid,
+            'created_at': firestore.SERVER_TIMESTAMP,
+            'expires_at': expires_at
+        }
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, doc_ref.create, data)
+        except AlreadyExists:
+            return False
+        return True
+
+    async def release(self, wamid: str) -> bool:
+        """Удаляет отметку, чтобы повторная доставка сообщения была обработана"""
+        if not self.db:
+            return False
+        doc_ref = self._get_collection_ref().document(wamid_doc_id(wamid))
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, doc_ref.delete)
+        return True
@@ -7,8 +7,8 @@ from src.models.session import Session
 from typing import Dict, Any
 
 class SessionRepository(BaseRepository[Session]):
-    def __init__(self):
-        super().__init__('users')  # Используем коллекцию users вместо user_sessions
+    def __init__(self, db=None):
+        super().__init__('users', db)  # Используем коллекцию users вместо user_sessions
 
     def _model_to_dict(self, model: Session) -> Dict[str, Any]:
         return model.to_dict()
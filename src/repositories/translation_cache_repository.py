@@ -0,0 +1,48 @@
+"""
+Репозиторий постоянного кэша переводов (коллекция translation_cache)
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any
+from src.repositories.base_repository import BaseRepository
+
+
+class TranslationCacheRepository(BaseRepository[Dict[str, Any]]):
+    """Хранит переводы по ключу (нормализованный текст, исходный язык, целевой язык)"""
+
+    def __init__(self, db=None):
+        super().__init__("translation_cache", db)
+
+    def _model_to_dict(self, model: Dict[str, Any]) -> Dict[str, Any]:
+        return dict(model)
+
+    def _dict_to_model(self, data: Dict[str, Any], doc_id: str) -> Dict[str, Any]:
+        return data
+
+    async def get_translation(self, key: str) -> Optional[Dict[str, Any]]:
+        """Возвращает запись кэша или None, если ее нет или срок хранения истек"""
+        if not self.db:
+            return None
+        doc_ref = self._get_collection_ref().document(key)
+        loop = asyncio.get_event_loop()
+        doc = await loop.run_in_executor(None, doc_ref.get)
+        if not doc.exists:
+            return None
+        data = doc.to_dict()
+        expires_at = data.get('expires_at')
+        if expires_at is not None:
+            if expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=timezone.utc)
+            if expires_at <= datetime.now(timezone.utc):
+                return None
+        return data
+
+    async def save_translation(self, key: str, data: Dict[str, Any]) -> bool:
+        """Сохраняет запись кэша (перезаписывая существующую)"""
+        if not self.db:
+            return False
+        doc_ref = self._get_collection_ref().document(key)
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, doc_ref.set, self._model_to_dict(data))
+        return True
@@ -7,8 +7,8 @@ from src.models.user import User
 from typing import Dict, Any, List, Optional
 
 class UserRepository(BaseRepository[User]):
-    def __init__(self):
-        super().__init__('users')
+    def __init__(self, db=None):
+        super().__init__('users', db)
 
     def _model_to_dict(self, model: User) -> Dict[str, Any]:
         return model.to_dict()
@@ -2,12 +2,17 @@
 Роуты для просмотра истории чата
 """
 
-from fastapi import APIRouter, Request, HTTPException
+from fastapi import APIRouter, Request, HTTPException, Depends
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from src.services.message_service import MessageService
+from src.repositories.message_repository import HistoryCursor
 from src.services.session_service import SessionService
+from src.services.container import ServiceContainer, get_services
+from datetime import datetime
+from typing import Optional
+from urllib.parse import quote
 import os
 import html
 import re
@@ -21,6 +26,18 @@ session_service = SessionService()
 # Настраиваем шаблоны
 templates = Jinja2Templates(directory="templates")
 
+# Сколько сообщений показывать на странице истории
+HISTORY_PAGE_SIZE = 50
+
+def parse_history_cursor(before: Optional[str]) -> Optional[HistoryCursor]:
+    """Курсор страницы истории ('<ISO-время>|<ID документа>') -> HistoryCursor; некорректный курсор игнорируется"""
+    return HistoryCursor.decode(before)
+
+def earlier_messages_link(path: str, cursor: HistoryCursor) -> str:
+    """Ссылка на страницу с более ранними сообщениями"""
+    href = html.escape(f"{path}?before={quote(cursor.encode())}")
+    return f'<div style="text-align: center; margin: 12px 0;"><a href="{href}">← Более ранние сообщения</a></div>'
+
 def detect_original_language(text: str) -> tuple[str, str, str]:
     """
     Определяет оригинальный язык текста и возвращает (код_языка, название_языка, флаг)
@@ -120,6 +137,11 @@ def format_messages_for_language(messages: list, target_lang: str) -> str:
             content = msg['content_thai']
         else:
             content = msg.get('content', '')
+        # Перевод еще дописывается фоновым воркером - показываем оригинал с пометкой
+        translation_pending = (
+            target_lang in ('en', 'th') and msg.get('translation_status') == 'pending'
+            and not msg.get('content_en' if target_lang == 'en' else 'content_thai')
+        )
         
         # Определяем класс сообщения
         message_class = "user" if role == "user" else "model"
@@ -141,6 +163,8 @@ def format_messages_for_language(messages: list, target_lang: str) -> str:
         # Сначала экранируем HTML, потом заменяем \n на <br>
         content_escaped = html.escape(content)
         content_with_breaks = content_escaped.replace('\\n', '<br>').replace('\n', '<br>')
+        if translation_pending:
+            content_with_breaks += ' <span style="font-size: 11px; opacity: 0.6;">⏳ перевод готовится</span>'
         
         # Добавляем изображение если есть
         image_html = ""
@@ -224,13 +248,14 @@ def format_messages_for_language(messages: list, target_lang: str) -> str:
     return messages_html
 
 @router.get("/history/{sender_id}", response_class=HTMLResponse)
-async def get_chat_history(request: Request, sender_id: str):
+async def get_chat_history(request: Request, sender_id: str, before: Optional[str] = None):
     """
     Показывает историю чата для конкретного пользователя.
     
     Args:
         request: FastAPI request
         sender_id: ID пользователя WhatsApp
+        before: курсор - показать сообщения до него (ISO-время и ID документа)
         
     Returns:
         HTML страница с историей чата
@@ -239,7 +264,9 @@ async def get_chat_history(request: Request, sender_id: str):
         print(f"[CHAT_HISTORY] Запрос истории чата для {sender_id}")
         
         # Получаем историю сообщений - используем заглушку для session_id
-        messages = await message_service.get_conversation_history_for_ai_by_sender(sender_id, "default_session", limit=100)
+        messages, next_cursor = await message_service.get_history_page(
+            sender_id, "default_session", limit=HISTORY_PAGE_SIZE, before=parse_history_cursor(before)
+        )
         
         if not messages:
             print(f"[CHAT_HISTORY] История не найдена для {sender_id}")
@@ -261,7 +288,8 @@ async def get_chat_history(request: Request, sender_id: str):
                 "image_url": msg.get("image_url", ""),
                 "audio_url": msg.get("audio_url", ""),
                 "audio_duration": msg.get("audio_duration", ""),
-                "transcription": msg.get("transcription", "")
+                "transcription": msg.get("transcription", ""),
+                "translation_status": msg.get("translation_status", "")
             }
             formatted_messages.append(formatted_msg)
         
@@ -301,6 +329,8 @@ async def get_chat_history(request: Request, sender_id: str):
         
         # Формируем HTML для сообщений на активном языке
         messages_html = format_messages_for_language(formatted_messages, active_lang)
+        if next_cursor:
+            messages_html = earlier_messages_link(request.url.path, next_cursor) + messages_html
         
         return templates.TemplateResponse(
             "chat_history.html",
@@ -319,7 +349,7 @@ async def get_chat_history(request: Request, sender_id: str):
         raise HTTPException(status_code=500, detail="Error loading chat history")
 
 @router.get("/history/{sender_id}/{session_id}", response_class=HTMLResponse)
-async def get_session_history(request: Request, sender_id: str, session_id: str):
+async def get_session_history(request: Request, sender_id: str, session_id: str, before: Optional[str] = None):
     """
     Показывает историю конкретной сессии.
     
@@ -327,6 +357,7 @@ async def get_session_history(request: Request, sender_id: str, session_id: str)
         request: FastAPI request
         sender_id: ID пользователя WhatsApp
         session_id: ID сессии
+        before: курсор - показать сообщения до него (ISO-время и ID документа)
         
     Returns:
         HTML страница с историей сессии
@@ -334,9 +365,9 @@ async def get_session_history(request: Request, sender_id: str, session_id: str)
     try:
         print(f"[SESSION_HISTORY] Запрос истории сессии {session_id} для {sender_id}")
         
-        # Получаем историю сообщений для конкретной сессии
-        messages = await message_service.get_conversation_history_for_ai_by_sender(
-            sender_id, session_id, limit=50
+        # Последние сообщения сессии (или страница старше курсора)
+        messages, next_cursor = await message_service.get_history_page(
+            sender_id, session_id, limit=HISTORY_PAGE_SIZE, before=parse_history_cursor(before)
         )
         
         if not messages:
@@ -359,7 +390,8 @@ async def get_session_history(request: Request, sender_id: str, session_id: str)
                 "image_url": msg.get("image_url", ""),
                 "audio_url": msg.get("audio_url", ""),
                 "audio_duration": msg.get("audio_duration", ""),
-                "transcription": msg.get("transcription", "")
+                "transcription": msg.get("transcription", ""),
+                "translation_status": msg.get("translation_status", "")
             }
             formatted_messages.append(formatted_msg)
         
@@ -397,6 +429,8 @@ async def get_session_history(request: Request, sender_id: str, session_id: str)
         
         # Формируем HTML для сообщений на активном языке
         messages_html = format_messages_for_language(formatted_messages, active_lang)
+        if next_cursor:
+            messages_html = earlier_messages_link(request.url.path, next_cursor) + messages_html
         
         return templates.TemplateResponse(
             "chat_history.html",
@@ -416,17 +450,19 @@ async def get_session_history(request: Request, sender_id: str, session_id: str)
         raise HTTPException(status_code=500, detail="Error loading session history")
 
 @router.get("/api/messages/{sender_id}/{session_id}/{language}")
-async def get_messages_by_language(request: Request, sender_id: str, session_id: str, language: str):
+async def get_messages_by_language(request: Request, sender_id: str, session_id: str, language: str,
+                                   before: Optional[str] = None,
+                                   services: ServiceContainer = Depends(get_services)):
     """
     API endpoint для получения сообщений на определенном языке
     """
     try:
         print(f"[API_MESSAGES] Запрос сообщений для {sender_id}/{session_id} на языке {language}")
         
-        # Получаем историю сообщений напрямую из репозитория
-        from src.repositories.message_repository import MessageRepository
-        message_repo = MessageRepository()
-        messages = await message_repo.get_conversation_history_by_sender(sender_id, session_id, limit=100)
+        # Последние сообщения сессии напрямую из Firestore (или страница старше курсора)
+        messages, next_cursor = await services.message_service.repo.get_history_window(
+            sender_id, session_id, limit=HISTORY_PAGE_SIZE, before=parse_history_cursor(before)
+        )
         
         print(f"[API_MESSAGES] Получено {len(messages)} сообщений")
         
@@ -436,7 +472,7 @@ async def get_messages_by_language(request: Request, sender_id: str, session_id:
         # Форматируем сообщения для указанного языка
         messages_html = format_messages_for_language(messages, language)
         
-        return {"messages": messages_html}
+        return {"messages": messages_html, "next_cursor": next_cursor.encode() if next_cursor else None}
         
     except Exception as e:
         print(f"[API_MESSAGES_ERROR] Error getting messages: {e}")
@@ -2,51 +2,68 @@
 Роуты для healthcheck API
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends, Request
 from fastapi.responses import JSONResponse
-from src.services.ai_service import AIService
-from src.services.catalog_service import CatalogService
-from src.config.settings import GEMINI_API_KEY, WHATSAPP_CATALOG_ID, WHATSAPP_TOKEN
+from src.services.container import ServiceContainer, get_services
+from src.config.settings import WHATSAPP_CATALOG_ID, WHATSAPP_TOKEN
 from src.utils.logging_decorator import log_function
 import asyncio
 import os
+import time
 
 router = APIRouter(prefix="/health", tags=["health"])
 
 @router.get("/")
-async def health_check():
+async def health_check(request: Request):
     """
     Базовый healthcheck - проверяет доступность сервиса.
+    Показывает состояние предохранителей Gemini; разомкнутый предохранитель
+    означает деградацию (бот не отвечает через AI), но не падение сервиса.
     """
-    return {"status": "healthy", "service": "auraflora-bot"}
+    result = {"status": "healthy", "service": "auraflora-bot"}
+    services = getattr(request.app.state, "services", None)
+    if services is not None:
+        circuits = services.gemini_client.breaker_states()
+        result["ai_circuits"] = circuits
+        if any(state != "closed" for state in circuits.values()):
+            result["status"] = "degraded"
+    return result
 
 @router.get("/ai")
-async def ai_health_check():
+async def ai_health_check(services: ServiceContainer = Depends(get_services)):
     """
     Проверяет доступность AI сервиса (Google Gemini).
     """
     try:
-        ai_service = AIService(GEMINI_API_KEY)
+        ai_service = services.ai_service
+        chat_circuit = services.gemini_client.breaker(ai_service.models.pool("chat")).get_metrics()
+        if chat_circuit["state"] == "open":
+            return {
+                "status": "unhealthy",
+                "service": "ai",
+                "error": "Circuit breaker is open",
+                "circuit": chat_circuit
+            }
         
-        # Тестируем простой запрос к AI
-        test_response = await ai_service.generate_response(
-            messages=[],
-            user_lang="ru",
-            sender_name="Test User"
-        )
+        # Короткий запрос к модели проверки здоровья (не нагружает модель диалога)
+        started = time.perf_counter()
+        test_response = await ai_service.ping()
         
-        if test_response and len(test_response) >= 3:
+        if test_response:
             return {
                 "status": "healthy",
                 "service": "ai",
                 "provider": "google-gemini",
-                "response_length": len(test_response[0]) if test_response[0] else 0
+                "model": ai_service.models.spec("health").model_name,
+                "response_length": len(test_response),
+                "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+                "circuit": chat_circuit
             }
         else:
             return {
                 "status": "unhealthy",
                 "service": "ai",
-                "error": "Invalid AI response format"
+                "error": "Empty AI response"
             }
             
     except Exception as e:
@@ -58,7 +75,7 @@ async def ai_health_check():
         }
 
 @router.get("/catalog")
-async def catalog_health_check():
+async def catalog_health_check(services: ServiceContainer = Depends(get_services)):
     """
     Проверяет доступность каталога товаров.
     """
@@ -84,11 +101,11 @@ async def catalog_health_check():
                 "error": "WHATSAPP_TOKEN not set"
             }
         
-        catalog_service = CatalogService(WHATSAPP_CATALOG_ID, WHATSAPP_TOKEN)
+        catalog_service = services.catalog_service
         
-        # Получаем список товаров (синхронный метод)
-        print(f"[HEALTH_CATALOG] Вызываем get_products()...")
-        products = catalog_service.get_products()
+        # Текущий снимок каталога (Graph API ждем только при холодном кэше)
+        print(f"[HEALTH_CATALOG] Вызываем ensure_loaded()...")
+        products = await catalog_service.ensure_loaded()
         print(f"[HEALTH_CATALOG] Получено товаров: {len(products) if products else 0}")
         
         if products and len(products) > 0:
@@ -97,14 +114,17 @@ async def catalog_health_check():
                 "status": "healthy",
                 "service": "catalog",
                 "products_count": len(products),
-                "catalog_id": WHATSAPP_CATALOG_ID
+                "catalog_id": WHATSAPP_CATALOG_ID,
+                "catalog_version": catalog_service.version,
+                "cache": catalog_service.get_metrics()
             }
         else:
             print(f"[HEALTH_CATALOG] ❌ Каталог пуст или не работает")
             return {
                 "status": "unhealthy",
                 "service": "catalog",
-                "error": "No products found"
+                "error": "No products found",
+                "cache": catalog_service.get_metrics()
             }
             
     except Exception as e:
@@ -212,14 +232,14 @@ async def files_health_check():
         }
 
 @router.get("/full")
-async def full_health_check():
+async def full_health_check(services: ServiceContainer = Depends(get_services)):
     """
     Полная проверка всех сервисов.
     """
     try:
         # Запускаем проверки (все асинхронные)
-        ai_result = await ai_health_check()
-        catalog_result = await catalog_health_check()
+        ai_result = await ai_health_check(services)
+        catalog_result = await catalog_health_check(services)
         files_result = await files_health_check()
         
         # Определяем общий статус
@@ -0,0 +1,85 @@
+"""
+Индекс последней активности пользователя.
+
+В документе users/{sender_id} хранятся last_message_ts (время отправки
+последнего принятого входящего сообщения по данным WhatsApp, секунды) и
+last_wamid. Поля пишутся вместе с остальными изменениями хода
+(TurnContext), last_message_ts - через Maximum, поэтому значение только
+растет даже при параллельной записи с разных инстансов.
+
+Проверка отложенного сообщения ("есть ли от пользователя сообщение
+новее") берет значение из памяти, а при промахе делает одно чтение
+документа users вместо обхода всех сессий пользователя.
+"""
+
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+from src.config.settings import HISTORY_CACHE_SESSIONS
+
+
+class LastActivityIndex:
+    """Кэш last_message_ts/last_wamid по отправителю поверх документа users"""
+
+    def __init__(self, db=None, max_senders: int = HISTORY_CACHE_SESSIONS):
+        self.db = db
+        self.max_senders = max_senders
+        self._entries: "OrderedDict[str, Tuple[int, Optional[str]]]" = OrderedDict()
+        self._metrics = {
+            "lookups": 0,
+            "memory_hits": 0,
+            "store_reads": 0,
+            "store_errors": 0,
+            "superseded": 0
+        }
+
+    def observe(self, sender_id: str, message_ts: Optional[int], wamid: Optional[str] = None):
+        """Запоминает сообщение, если оно новее известного"""
+        if not sender_id or message_ts is None:
+            return
+        current = self._entries.get(sender_id)
+        if current is None or message_ts >= current[0]:
+            self._entries[sender_id] = (int(message_ts), wamid or (current[1] if current else None))
+        self._entries.move_to_end(sender_id)
+        while len(self._entries) > self.max_senders:
+            self._entries.popitem(last=False)
+
+    def prime(self, sender_id: str, user_data: Optional[Dict[str, Any]]):
+        """Заполняет кэш из уже прочитанного документа users"""
+        ts = (user_data or {}).get('last_message_ts')
+        self.observe(sender_id, ts if ts is not None else 0, (user_data or {}).get('last_wamid'))
+
+    async def get_last(self, sender_id: str) -> Tuple[int, Optional[str]]:
+        """(last_message_ts, last_wamid); (0, None) - сообщений еще не было"""
+        self._metrics["lookups"] += 1
+        entry = self._entries.get(sender_id)
+        if entry is not None:
+            self._metrics["memory_hits"] += 1
+            self._entries.move_to_end(sender_id)
+            return entry
+        if self.db is None:
+            return 0, None
+
+        doc_ref = self.db.collection('users').document(sender_id)
+        loop = asyncio.get_running_loop()
+        try:
+            doc = await loop.run_in_executor(None, doc_ref.get)
+            self._metrics["store_reads"] += 1
+        except Exception as e:
+            self._metrics["store_errors"] += 1
+            print(f"[ACTIVITY] Ошибка чтения последней активности {sender_id}: {e}")
+            return 0, None
+        self.prime(sender_id, doc.to_dict() if doc.exists else None)
+        return self._entries.get(sender_id, (0, None))
+
+    async def is_superseded(self, sender_id: str, message_ts: int) -> bool:
+        """Есть ли от пользователя сообщение новее message_ts"""
+        last_ts, _ = await self.get_last(sender_id)
+        if last_ts > message_ts:
+            self._metrics["superseded"] += 1
+            return True
+        return False
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Попадания в кэш и чтения users для проверки отложенных сообщений"""
+        return {"cached_senders": len(self._entries), **self._metrics}
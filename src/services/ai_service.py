@@ -3,55 +3,92 @@
 """
 
 import google.generativeai as genai
-from google.generativeai import GenerationConfig
-from google.generativeai.types import HarmCategory, HarmBlockThreshold
 from src.utils.logging_decorator import log_function
 from src.models.message import Message, MessageRole
 from typing import List, Optional, Dict, Any, Tuple, Union
+import asyncio
 import re
 import json
 import uuid
-from datetime import datetime
-import pytz
 from src.services.catalog_service import CatalogService
-from src.config.settings import GEMINI_API_KEY, WHATSAPP_CATALOG_ID, WHATSAPP_TOKEN
+from src.services.prompt_assembler import PromptAssembler
+from src.services.gemini_client import GeminiClient
+from src.services.model_registry import ModelRegistry
+from src.services.translation_cache import TranslationCache
+from src.services.language_detector import LanguageDetector
+from src.utils.resilience import CircuitOpenError
+from src.config.settings import GEMINI_API_KEY, WHATSAPP_CATALOG_ID, WHATSAPP_TOKEN, AI_REPLY_MAX_ATTEMPTS
 import os
-from src.utils.ai_utils import format_conversation_for_ai, parse_ai_response, get_fallback_text, format_catalog_for_ai
+from src.utils.ai_utils import format_conversation_for_ai, parse_ai_response, decode_ai_response, get_fallback_text
+
+# Коды языков, которые умеет определять бот
+SUPPORTED_LANGUAGES = ['ru', 'en', 'th', 'it', 'fr', 'es', 'de', 'pt', 'nl', 'pl', 'cs', 'sk', 'hu', 'ro', 'bg', 'hr', 'sr', 'sl', 'et', 'lv', 'lt', 'fi', 'sv', 'no', 'da', 'is', 'zh', 'ja', 'ko', 'vi', 'id', 'ms', 'tl', 'hi', 'bn', 'ur', 'ar', 'he', 'fa', 'tr', 'ka', 'hy', 'az', 'sw', 'am', 'yo', 'zu', 'xh', 'af']
 
 class AIService:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, catalog_service: Optional[CatalogService] = None, error_service=None,
+                 gemini_client: Optional[GeminiClient] = None, translation_cache: Optional[TranslationCache] = None,
+                 language_detector: Optional[LanguageDetector] = None,
+                 model_registry: Optional[ModelRegistry] = None):
         self.api_key = api_key
         genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel(
-            model_name="gemini-2.5-flash",
-            generation_config=GenerationConfig(
-                temperature=0.7,
-                top_p=0.9,
-                top_k=40,
-                max_output_tokens=8192
-            ),
-            safety_settings={
-                HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-            }
+        # Модели, таймауты и пулы запросов по задачам (chat, translate, detect, ...)
+        self.models = model_registry or ModelRegistry()
+        self.model = self.models.model("chat")
+        self.catalog_service = catalog_service or CatalogService(WHATSAPP_CATALOG_ID, WHATSAPP_TOKEN)
+        self.error_service = error_service
+        self.prompt_assembler = PromptAssembler(self.catalog_service)
+        # Все запросы к Gemini идут через общий асинхронный шлюз
+        self.gemini = gemini_client or GeminiClient(pool_limits=self.models.pool_limits())
+        # Без контейнера кэш переводов живет только в памяти процесса
+        self.translation_cache = translation_cache or TranslationCache()
+        # Локальное определение языка; Gemini - только при низкой уверенности
+        self.language_detector = language_detector or LanguageDetector()
+        # Попытки получить валидный ответ бота (по схеме) на одно сообщение
+        self.reply_max_attempts = max(1, AI_REPLY_MAX_ATTEMPTS)
+        self._reply_metrics = {
+            "replies": 0,
+            "calls": 0,
+            "retries": 0,
+            "failed": 0,
+            "repaired": 0,
+            "by_attempts": {},
+            "retries_denied": 0,
+            "invalid": {"request_failed": 0, "circuit_open": 0}
+        }
+
+    async def _generate_text(self, task: str, prompt: str, retry: bool = False) -> str:
+        """Запрос к модели задачи через общий шлюз с ее таймаутом и пулом"""
+        spec = self.models.spec(task)
+        return await self.gemini.generate_text(
+            self.models.model(task), prompt, task=task, timeout=spec.timeout, pool=self.models.pool(task), retry=retry
         )
-        self.catalog_service = CatalogService(WHATSAPP_CATALOG_ID, WHATSAPP_TOKEN)
+
+    async def ping(self) -> str:
+        """Короткий запрос к модели проверки здоровья (без каталога и истории)"""
+        return await self._generate_text("health", "Reply with the single word OK.")
 
     @log_function("ai_service")
-    def detect_language(self, text: str) -> str:
+    async def detect_language(self, text: str) -> str:
         """Определяет язык пользователя по тексту сообщения с помощью AI и fallback логики"""
-        result = self.detect_language_with_confidence(text)
+        result = await self.detect_language_with_confidence(text)
         return result['language']
 
     @log_function("ai_service")
-    def detect_language_with_confidence(self, text: str) -> dict:
+    async def detect_language_with_confidence(self, text: str) -> dict:
         """Определяет язык пользователя с оценкой уверенности"""
         if not text:
             return {'language': 'auto', 'confidence': 0.0, 'should_ask': True}
         
-        # Сначала пробуем AI определение с оценкой уверенности
+        # Сначала локально: письменность и триграммы
+        local = self.language_detector.detect(text)
+        if not local.escalate:
+            return {
+                'language': local.language,
+                'confidence': local.confidence,
+                'should_ask': local.language == 'auto'
+            }
+        
+        # Уверенности не хватило - AI определение с оценкой уверенности
         try:
             # Создаем промпт для определения языка с уверенностью
             language_detection_prompt = f"""Analyze this text and determine the language with confidence level.
@@ -72,25 +109,7 @@ Set should_ask_confirmation to false if you're very confident about the language
 
 Response:"""
 
-            # Используем отдельную модель для определения языка
-            detection_model = genai.GenerativeModel(
-                model_name="gemini-2.5-flash",
-                generation_config=GenerationConfig(
-                    temperature=0.1,
-                    top_p=1,
-                    top_k=1,
-                    max_output_tokens=200
-                ),
-                safety_settings={
-                    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-                }
-            )
-            
-            response = detection_model.generate_content(language_detection_prompt)
-            response_text = response.text.strip()
+            response_text = await self._generate_text("detect", language_detection_prompt)
             
             # Парсим JSON ответ
             try:
@@ -101,9 +120,7 @@ Response:"""
                 should_ask = result.get('should_ask_confirmation', True)
                 
                 # Проверяем, что полученный код языка поддерживается
-                supported_languages = ['ru', 'en', 'th', 'it', 'fr', 'es', 'de', 'pt', 'nl', 'pl', 'cs', 'sk', 'hu', 'ro', 'bg', 'hr', 'sr', 'sl', 'et', 'lv', 'lt', 'fi', 'sv', 'no', 'da', 'is', 'zh', 'ja', 'ko', 'vi', 'id', 'ms', 'tl', 'hi', 'bn', 'ur', 'ar', 'he', 'fa', 'tr', 'ka', 'hy', 'az', 'sw', 'am', 'yo', 'zu', 'xh', 'af']
-                
-                if detected_lang in supported_languages:
+                if detected_lang in SUPPORTED_LANGUAGES:
                     return {
                         'language': detected_lang,
                         'confidence': confidence,
@@ -117,7 +134,9 @@ Response:"""
         except Exception as e:
             print(f"AI language detection failed: {e}")
         
-        # Fallback на старую логику определения языка
+        # Fallback: локальный результат с низкой уверенностью, затем старая логика
+        if local.language != 'auto':
+            return {'language': local.language, 'confidence': local.confidence, 'should_ask': True}
         fallback_lang = self._detect_language_fallback(text)
         return {
             'language': fallback_lang,
@@ -460,11 +479,15 @@ Response:"""
         return "I couldn't determine your language. Please write in English, Russian, Thai, or another supported language."
 
     @log_function("ai_service")
-    def translate_text(self, text: str, source_lang: str, target_lang: str) -> str:
+    async def translate_text(self, text: str, source_lang: str, target_lang: str) -> str:
         """Переводит текст с одного языка на другой используя Gemini"""
         if not text or source_lang == target_lang:
             return text
         
+        cached = await self.translation_cache.get(text, source_lang, target_lang)
+        if cached is not None:
+            return cached
+        
         try:
             lang_names = {
                 'ru': 'Russian', 
@@ -483,18 +506,8 @@ Response:"""
             
             Text: {text}"""
             
-            translation_model = genai.GenerativeModel(
-                model_name="gemini-2.5-flash",
-                generation_config=GenerationConfig(
-                    temperature=0.1,
-                    top_p=1,
-                    top_k=1,
-                    max_output_tokens=4096
-                )
-            )
-            
-            response = translation_model.generate_content(translation_prompt)
-            translated_text = response.text.strip()
+            translated_text = await self._generate_text("translate", translation_prompt)
+            self.translation_cache.put(text, source_lang, target_lang, translated_text)
             
             # print(f"[TRANSLATE] {source_lang} -> {target_lang}: '{text[:50]}...' -> '{translated_text[:50]}...'")
             return translated_text
@@ -503,15 +516,38 @@ Response:"""
             print(f"Translation error {source_lang} -> {target_lang}: {e}")
             return text
 
+    async def summarize_conversation(self, previous_summary: Optional[str], messages: List[Dict]) -> str:
+        """Сворачивает сообщения (и прежнее краткое содержание) в новое краткое содержание"""
+        lines = []
+        for msg in messages:
+            content = msg.get('content') or ''
+            if content:
+                lines.append(f"{msg.get('role', 'user')}: {content}")
+        if not lines:
+            return previous_summary or ''
+
+        prompt = f"""You maintain a running summary of a WhatsApp conversation between a flower shop assistant and a customer.
+Merge the previous summary and the new messages into one updated summary in Russian.
+Keep every fact needed to continue the conversation: customer name and language, chosen bouquets and their ids,
+order details (date, time, address, recipient, card text), open questions and promises made by the assistant.
+Drop greetings and small talk. Return ONLY the summary text, at most 15 short lines.
+
+Previous summary:
+{previous_summary or '(none)'}
+
+New messages:
+""" + "\n".join(lines)
+        return (await self._generate_text("summarize", prompt)).strip()
+
     @log_function("ai_service")
-    def translate_user_message(self, text: str, user_lang: str) -> Tuple[str, str, str]:
+    async def translate_user_message(self, text: str, user_lang: str) -> Tuple[str, str, str]:
         """Переводит сообщение пользователя на все три языка"""
         if not text:
             return "", "", ""
         
         # Определяем язык если не задан
         if user_lang == 'auto':
-            user_lang = self.detect_language(text)
+            user_lang = await self.detect_language(text)
         
         # Если язык не определен, считаем английским
         if user_lang not in ['ru', 'en', 'th', 'it', 'fr', 'es', 'de']:
@@ -520,17 +556,12 @@ Response:"""
         # Исходный текст
         original_text = text
         
-        # Переводим на английский
-        if user_lang == 'en':
-            text_en = original_text
-        else:
-            text_en = self.translate_text(original_text, user_lang, 'en')
-        
-        # Переводим на тайский
-        if user_lang == 'th':
-            text_thai = original_text
-        else:
-            text_thai = self.translate_text(original_text, user_lang, 'th')
+        # Переводим на английский и тайский параллельно (кроме языка оригинала)
+        targets = [lang for lang in ('en', 'th') if lang != user_lang]
+        translations = await asyncio.gather(*(self.translate_text(original_text, user_lang, lang) for lang in targets))
+        translated = dict(zip(targets, translations))
+        text_en = translated.get('en', original_text)
+        text_thai = translated.get('th', original_text)
         
         # Возвращаем в правильном порядке: (content, content_en, content_thai)
         if user_lang == 'ru':
@@ -542,52 +573,96 @@ Response:"""
         else:  # it, fr, es, de - используем оригинальный язык как основной
             return original_text, text_en, text_thai
 
-    def get_system_prompt(self, user_lang: str = 'auto', sender_name: str = None, is_first_message: bool = False) -> str:
-        """Генерирует полный системный промпт"""
-        try:
-            phuket_tz = pytz.timezone('Asia/Bangkok')
-            phuket_time = datetime.now(phuket_tz)
-            phuket_time_str = phuket_time.strftime('%d %B %Y, %H:%M')
-        except Exception:
-            phuket_time_str = 'Error determining Phuket time'
-        
-        name_context = f"User name: {sender_name}" if sender_name else "User name unknown"
-        
-        if sender_name and is_first_message:
-            name_instruction = f"""
-GREETING WITH NAME: This is the first message in conversation, use the user's name '{sender_name}' in greeting.
-IMPORTANT: The name '{sender_name}' is from WhatsApp profile. If the user writes in Russian, use Russian name format.
-If the user writes in English, use English name format. If the user writes in Thai, use Thai name format.
-Example: 'Hello {sender_name}! Would you like to see our flower catalog?'"""
-        else:
-            name_instruction = ""
-        
-        if user_lang == 'auto':
-            language_instruction = "IMPORTANT: Respond in English by default! If user writes in another language, respond in the same language."
-        elif user_lang in ['it', 'fr', 'es', 'de']:
-            # Для европейских языков отвечаем на английском, но понимаем их
-            language_instruction = f"IMPORTANT: User writes in {user_lang.upper()} language, but respond in English! User understands English."
+    @log_function("ai_service")
+    async def detect_and_translate(self, text: str, user_lang: str = 'auto') -> dict:
+        """
+        Определяет язык сообщения и переводит его на английский и тайский одним запросом к Gemini.
+        Возвращает {'language', 'confidence', 'text', 'text_en', 'text_thai'}.
+        Если язык уже известен (user_lang != 'auto'), он не переопределяется.
+        """
+        known_lang = user_lang if user_lang and user_lang != 'auto' else None
+        result = {
+            'language': known_lang or 'auto',
+            'confidence': 1.0 if known_lang else 0.0,
+            'text': text or "",
+            'text_en': text or "",
+            'text_thai': text or ""
+        }
+        # Нечего переводить: пустое сообщение, цифры, эмодзи
+        if not text or not re.search(r'[^\W\d_]', text):
+            return result
+
+        # Язык определяем локально; ответ Gemini для неоднозначных текстов
+        # запоминаем только в LRU процесса, не в Firestore
+        escalated = False
+        if not known_lang:
+            local = self.language_detector.detect(text)
+            if not local.escalate:
+                result['language'], result['confidence'] = local.language, local.confidence
+            else:
+                escalated = True
+                cached_lang = await self.translation_cache.get(text, 'auto', 'lang', persist=False)
+                if cached_lang:
+                    result['language'], result['confidence'] = cached_lang, 0.9
+        lang = result['language']
+        if lang != 'auto':
+            async def cached(target: str) -> Optional[str]:
+                return text if lang == target else await self.translation_cache.get(text, lang, target)
+
+            cached_en, cached_th = await asyncio.gather(cached('en'), cached('th'))
+            if cached_en is not None and cached_th is not None:
+                result['text_en'], result['text_thai'] = cached_en, cached_th
+                return result
+
+        if lang != 'auto':
+            language_task = f'The text is written in language "{lang}". Return "language": "{lang}".'
         else:
-            language_instruction = f"IMPORTANT: Respond in user's language! User writes in language code '{user_lang}'. Respond in the same language."
-        
-        # Загружаем ТОЛЬКО основной промпт
-        prompt_path = os.path.join(os.path.dirname(__file__), "prompts", "ai_system_prompt.prompt")
+            language_task = f'Detect the language of the text (one of: {", ".join(SUPPORTED_LANGUAGES)}).'
+
+        prompt = f"""You translate customer messages for a flower shop chat. Do not answer the message, only translate it.
+{language_task}
+Translate the text to English and to Thai. If the text is already in English, text_en must be the text unchanged; the same for Thai and text_thai.
+
+Text: {json.dumps(text, ensure_ascii=False)}
+
+Respond with JSON only:
+{{"language": "language_code", "confidence": 0.95, "text_en": "English translation", "text_thai": "Thai translation"}}"""
+
         try:
-            with open(prompt_path, encoding="utf-8") as f:
-                prompt_template = f.read()
-                print(f"[PROMPT_LOAD] Successfully loaded structured prompt from: {prompt_path}")
-        except FileNotFoundError:
-            print(f"[PROMPT_LOAD] ERROR: Structured prompt not found: {prompt_path}")
-            raise FileNotFoundError(f"Required prompt file not found: {prompt_path}")
-        
-        return prompt_template.format(
-            user_lang=user_lang,
-            sender_name=sender_name or "",
-            phuket_time_str=phuket_time_str,
-            name_context=name_context,
-            name_instruction=name_instruction,
-            language_instruction=language_instruction
-        )
+            response_text = await self._generate_text("detect_translate", prompt)
+            data = json.loads(response_text.strip().removeprefix("```json").removeprefix("```").removesuffix("```"))
+            if lang == 'auto':
+                detected_lang = str(data.get('language', '')).lower()
+                if detected_lang in SUPPORTED_LANGUAGES:
+                    result['language'] = detected_lang
+                    result['confidence'] = float(data.get('confidence', 0.0))
+            result['text_en'] = data.get('text_en') or text
+            result['text_thai'] = data.get('text_thai') or text
+            if result['language'] != 'auto':
+                if escalated:
+                    self.translation_cache.put(text, 'auto', 'lang', result['language'], persist=False)
+                if result['language'] != 'en' and data.get('text_en'):
+                    self.translation_cache.put(text, result['language'], 'en', result['text_en'])
+                if result['language'] != 'th' and data.get('text_thai'):
+                    self.translation_cache.put(text, result['language'], 'th', result['text_thai'])
+        except Exception as e:
+            print(f"[TRANSLATE] Ошибка определения языка/перевода: {e}")
+
+        if result['language'] == 'auto':
+            fallback_lang = self._detect_language_fallback(text)
+            result['language'] = fallback_lang
+            result['confidence'] = 0.6 if fallback_lang != 'auto' else 0.0
+
+        # Оригинал на английском/тайском не переводим
+        if result['language'] == 'en':
+            result['text_en'] = text
+        elif result['language'] == 'th':
+            result['text_thai'] = text
+        return result
+
+    def get_system_prompt(self, user_lang: str = 'auto', sender_name: str = None, is_first_message: bool = False) -> str:
+        """Генерирует полный системный промпт"""
+        return self.prompt_assembler.render_system_prompt(user_lang, sender_name, is_first_message)
 
     @log_function("ai_service")
     async def generate_response(
@@ -595,9 +670,16 @@ Example: 'Hello {sender_name}! Would you like to see our flower catalog?'"""
         messages: List[Union[Message, Dict]],
         user_lang: str = 'ru',
         sender_name: str = None,
-        is_first_message: bool = False
+        is_first_message: bool = False,
+        summary: Optional[str] = None,
+        order_data: Optional[Dict[str, Any]] = None
     ) -> Tuple[str, str, str, Optional[dict]]:
-        """Генерирует ответ AI на основе истории сообщений"""
+        """
+        Генерирует ответ AI на основе истории сообщений.
+        summary - краткое содержание ранней части диалога (см. ConversationSummarizer),
+        тогда messages содержит только последние сообщения.
+        order_data - уже прочитанные данные заказа (TurnContext); если не переданы, заказ читается из БД.
+        """
         request_id = str(uuid.uuid4())[:8]
         
         try:
@@ -625,14 +707,6 @@ Example: 'Hello {sender_name}! Would you like to see our flower catalog?'"""
                 print(f"{i:2d}. {msg}")
             print("=" * 80)
             
-            # Получаем каталог товаров
-            catalog_products = self.catalog_service.get_products()
-            catalog_summary = format_catalog_for_ai(catalog_products)
-            
-            # Создаем системный промпт с каталогом
-            system_prompt = self.get_system_prompt(user_lang, sender_name, is_first_message)
-            enhanced_prompt = system_prompt + f"\n\nACTUAL PRODUCT CATALOG:\n{catalog_summary}"
-            
             # Форматируем историю диалога
             session_id = None
             sender_id = None
@@ -645,101 +719,93 @@ Example: 'Hello {sender_name}! Would you like to see our flower catalog?'"""
                     session_id = first_msg.session_id
                     sender_id = first_msg.sender_id
             
-            conversation_history = await format_conversation_for_ai(messages, session_id, sender_id)
+            conversation_history = await format_conversation_for_ai(messages, session_id, sender_id, order_data)
             
             # Проверяем на пустую историю
             if not conversation_history:
                 conversation_history = [{"role": "assistant", "content": "Здравствуйте! Чем могу помочь?"}]
                 print(f"[AI_WARNING] Empty conversation history, using fallback")
             
-            # Создаем полный промпт
-            full_prompt = f"{enhanced_prompt}\n\nCONVERSATION HISTORY:\n"
-            history_json = json.dumps(conversation_history, ensure_ascii=False, indent=2)
-            full_prompt += history_json
-            full_prompt += "\n\nJSON RESPONSE:"
+            # Создаем полный промпт в пределах бюджета токенов (шаблон и блок каталога берутся из кэша)
+            await self.catalog_service.ensure_loaded()
+            full_prompt = self.prompt_assembler.build_prompt(
+                conversation_history, user_lang, sender_name, is_first_message,
+                summary=summary, session_key=f"{sender_id}/{session_id}" if sender_id else None
+            )
+            sections = self.prompt_assembler.get_last_sections()
+            print(f"[PROMPT] RequestID: {request_id} | ~{sections['total']['tokens_est']} tokens "
+                  f"(catalog {sections['catalog']['tokens_est']}, history {sections['history']['tokens_est']})")
             
             # print(f"[AI_REQUEST] RequestID: {request_id} | Sending full prompt to Gemini")
             
-            # Получаем ответ от AI с возможностью повторного запроса
-            max_retries = 2
-            for attempt in range(max_retries + 1):
-                try:
-                    response = self.model.generate_content(full_prompt)
-                    response_text = response.text.strip()
-                    
-                    print(f"[AI_RESPONSE] RequestID: {request_id} | Attempt {attempt + 1} | Raw response length: {len(response_text)}")
-                    print(f"[AI_RESPONSE] RequestID: {request_id} | Attempt {attempt + 1} | Raw response: {repr(response_text)}")
-                    print(f"[AI_RESPONSE] RequestID: {request_id} | Attempt {attempt + 1} | Raw response (display): {response_text}")
-                    
-                    # Парсим ответ
-                    ai_text, ai_text_en, ai_text_thai, ai_command = parse_ai_response(response_text)
-                    
-                    # Проверяем на пустой ответ (но с командой)
-                    if not ai_text and not ai_command:
-                        print(f"[AI_ERROR] Empty AI response on attempt {attempt + 1}")
-                        if attempt < max_retries:
-                            print(f"[AI_RETRY] Retrying... (attempt {attempt + 2}/{max_retries + 1})")
-                            continue
-                        else:
-                            # Логируем ошибку в систему Errors вместо отправки fallback
-                            await self._log_ai_error(
-                                error="AI returned empty response after all retries",
-                                context_data={
-                                    "attempts": max_retries + 1,
-                                    "user_lang": user_lang,
-                                    "sender_name": sender_name
-                                },
-                                sender_id=sender_id if 'sender_id' in locals() else None,
-                                session_id=session_id if 'session_id' in locals() else None
-                            )
-                            # Возвращаем пустые строки и None, чтобы система НЕ отправляла fallback
-                            return "", "", "", None
-
-                    # Если есть команда, но нет текста - это ошибка, нужно переделать
-                    if ai_command and (not ai_text or ai_text.strip() == ""):
-                        print(f"[AI_ERROR] Command without text: {ai_command}")
-                        if attempt < max_retries:
-                            print(f"[AI_RETRY] Retrying to get text with command... (attempt {attempt + 2}/{max_retries + 1})")
-                            # Добавляем строгие инструкции о необходимости текста
-                            retry_prompt = full_prompt + "\n\nCRITICAL: You MUST provide text field even when using commands. Never return empty text with commands. Always explain what you're doing before using a command."
-                            full_prompt = retry_prompt
-                            continue
-                        else:
-                            # Логируем ошибку в систему Errors вместо отправки fallback
-                            await self._log_ai_error(
-                                error="AI returned command without text after all retries",
-                                context_data={
-                                    "command": ai_command,
-                                    "attempts": max_retries + 1,
-                                    "user_lang": user_lang,
-                                    "sender_name": sender_name
-                                },
-                                sender_id=sender_id if 'sender_id' in locals() else None,
-                                session_id=session_id if 'session_id' in locals() else None
-                            )
-                            # Возвращаем пустые строки и None для команды, чтобы система НЕ отправляла fallback
-                            return "", "", "", None
-                    
-                    # Если команда None, но есть текст - это может быть невалидный ответ
-                    if ai_command is None and ai_text:
-                        print(f"[AI_RETRY] Command is None but text exists, retrying... (attempt {attempt + 2}/{max_retries + 1})")
-                        if attempt < max_retries:
-                            # Добавляем более строгие инструкции в промпт
-                            retry_prompt = full_prompt + "\n\nIMPORTANT: Your previous response was invalid. Please ensure you return a COMPLETE JSON with all required fields: text, text_en, text_thai, and command (as object with 'type' field)."
-                            full_prompt = retry_prompt
-                            continue
-                    
-                    print(f"[AI_RESPONSE] {ai_text}")
-                    return ai_text, ai_text_en, ai_text_thai, ai_command
-                    
-                except Exception as e:
-                    print(f"[AI_ERROR] Attempt {attempt + 1} failed: {e}")
-                    if attempt < max_retries:
-                        print(f"[AI_RETRY] Retrying... (attempt {attempt + 2}/{max_retries + 1})")
+            # Ответ запрашивается в JSON-режиме по схеме; повтор - только если ответ не прошел проверку
+            # или запрос упал. На одно сообщение уходит не больше AI_REPLY_MAX_ATTEMPTS вызовов Gemini,
+            # повтор идет с задержкой и только при наличии повторов в общем бюджете шлюза
+            last_error = None
+            attempt = 0
+            ai_text = ai_text_en = ai_text_thai = ""
+            try:
+                for attempt in range(1, self.reply_max_attempts + 1):
+                    if attempt > 1 and not await self.gemini.before_retry(attempt - 1, self.models.pool("chat")):
+                        print(f"[AI_RETRY] RequestID: {request_id} | Повтор запрещен бюджетом или предохранителем")
+                        self._reply_metrics["retries_denied"] += 1
+                        attempt -= 1
+                        break
+                    try:
+                        response_text = await self._generate_text("chat", full_prompt, retry=attempt > 1)
+                    except CircuitOpenError:
+                        # Gemini недоступен - отвечаем сразу, без ожидания таймаута
+                        last_error = "circuit_open"
+                        self._reply_metrics["invalid"][last_error] += 1
+                        raise
+                    except Exception as e:
+                        print(f"[AI_ERROR] RequestID: {request_id} | Attempt {attempt} failed: {e}")
+                        last_error = "request_failed"
+                        self._reply_metrics["invalid"][last_error] += 1
+                        if attempt == self.reply_max_attempts:
+                            raise
                         continue
-                    else:
-                        raise e
-            
+
+                    print(f"[AI_RESPONSE] RequestID: {request_id} | Attempt {attempt} | Raw response: {repr(response_text)}")
+                    ai_text, ai_text_en, ai_text_thai, ai_command, error = decode_ai_response(response_text)
+                    if error is not None and error.startswith("invalid_json"):
+                        # Модель без поддержки схемы или подмененная модель - старый разбор с починкой
+                        ai_text, ai_text_en, ai_text_thai, ai_command = parse_ai_response(response_text)
+                        if ai_text:
+                            self._reply_metrics["repaired"] += 1
+                            error = None
+                    if error is None:
+                        last_error = None
+                        print(f"[AI_RESPONSE] {ai_text}")
+                        return ai_text, ai_text_en, ai_text_thai, ai_command
+
+                    last_error = error.split(":")[0]
+                    self._reply_metrics["invalid"][last_error] = self._reply_metrics["invalid"].get(last_error, 0) + 1
+                    print(f"[AI_RETRY] RequestID: {request_id} | Attempt {attempt}/{self.reply_max_attempts}: {error}")
+                    if last_error == "empty_text":
+                        full_prompt += "\n\nCRITICAL: You MUST provide text field even when using commands."
+            finally:
+                self._record_reply_attempts(attempt, success=last_error is None)
+
+            if ai_text:
+                # Текст есть, команда невалидна - отправляем текст без команды
+                print(f"[AI_RESPONSE] {ai_text} (command dropped: {last_error})")
+                return ai_text, ai_text_en, ai_text_thai, None
+
+            # Логируем ошибку в систему Errors вместо отправки fallback
+            await self._log_ai_error(
+                error=f"AI returned invalid response after all attempts: {last_error}",
+                context_data={
+                    "attempts": attempt,
+                    "user_lang": user_lang,
+                    "sender_name": sender_name
+                },
+                sender_id=sender_id,
+                session_id=session_id
+            )
+            # Возвращаем пустые строки и None, чтобы система НЕ отправляла fallback
+            return "", "", "", None
+
         except Exception as e:
             print(f"[AI_REQUEST] RequestID: {request_id} | Error generating response: {e}")
             # Логируем ошибку в систему Errors вместо отправки fallback
@@ -755,6 +821,26 @@ Example: 'Hello {sender_name}! Would you like to see our flower catalog?'"""
             # Возвращаем пустые строки и None, чтобы система НЕ отправляла fallback
             return "", "", "", None
 
+    def _record_reply_attempts(self, attempts: int, success: bool):
+        self._reply_metrics["replies"] += 1
+        self._reply_metrics["calls"] += attempts
+        self._reply_metrics["retries"] += max(0, attempts - 1)
+        if not success:
+            self._reply_metrics["failed"] += 1
+        key = str(attempts)
+        self._reply_metrics["by_attempts"][key] = self._reply_metrics["by_attempts"].get(key, 0) + 1
+
+    def get_reply_metrics(self) -> Dict[str, Any]:
+        """Вызовы Gemini и повторы на один ответ бота"""
+        replies = self._reply_metrics["replies"]
+        return {
+            "max_attempts": self.reply_max_attempts,
+            **self._reply_metrics,
+            "by_attempts": dict(self._reply_metrics["by_attempts"]),
+            "invalid": dict(self._reply_metrics["invalid"]),
+            "retries_per_reply": round(self._reply_metrics["retries"] / replies, 3) if replies else 0.0
+        }
+
     def _is_repetitive_response(self, messages: List[Message]) -> bool:
         """Проверяет, не является ли последнее сообщение пользователя повторением"""
         if not messages or len(messages) < 2:
@@ -784,8 +870,10 @@ Example: 'Hello {sender_name}! Would you like to see our flower catalog?'"""
     async def _log_ai_error(self, error: str, context_data: dict, sender_id: str = None, session_id: str = None):
         """Логирует ошибку AI в систему Errors"""
         try:
-            from src.services.error_service import ErrorService
-            error_service = ErrorService()
+            error_service = self.error_service
+            if error_service is None:
+                from src.services.error_service import ErrorService
+                error_service = ErrorService()
             
             await error_service.log_error(
                 error=Exception(error),
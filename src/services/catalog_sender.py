@@ -2,24 +2,29 @@
 Отправка каталога товаров через WhatsApp Business API
 """
 
+import asyncio
+import time
 import httpx
-from typing import Optional
-from src.config.settings import WHATSAPP_TOKEN, WHATSAPP_PHONE_ID, WHATSAPP_CATALOG_ID
+from typing import Optional, List, Dict, Any
+from src.config.settings import WHATSAPP_TOKEN, WHATSAPP_PHONE_ID, WHATSAPP_CATALOG_ID, CATALOG_SEND_CONCURRENCY
 from src.services.catalog_service import CatalogService
 from src.utils.whatsapp_client import WhatsAppClient
 from src.services.message_service import MessageService
 from src.models.message import Message, MessageRole
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
 
 logger = logging.getLogger(__name__)
 
 class CatalogSender:
     """Класс для подготовки каталога товаров для отправки через WhatsApp"""
-    def __init__(self):
-        self.catalog_service = CatalogService(WHATSAPP_CATALOG_ID, WHATSAPP_TOKEN)
-        self.whatsapp_client = WhatsAppClient()
-        self.message_service = MessageService()
+    def __init__(self, catalog_service: Optional[CatalogService] = None,
+                 whatsapp_client: Optional[WhatsAppClient] = None,
+                 message_service: Optional[MessageService] = None):
+        self.catalog_service = catalog_service or CatalogService(WHATSAPP_CATALOG_ID, WHATSAPP_TOKEN)
+        self.whatsapp_client = whatsapp_client or WhatsAppClient()
+        self.message_service = message_service or MessageService()
+        self.concurrency = max(1, CATALOG_SEND_CONCURRENCY)
 
     async def get_catalog_messages(self, to_number: str, sender_id: str = None, session_id: str = None):
         """
@@ -28,6 +33,7 @@ class CatalogSender:
         """
         print(f"[CATALOG_SEND] Формирование каталога для пользователя {to_number}")
         try:
+            await self.catalog_service.ensure_loaded()
             catalog_products = self.catalog_service.get_available_products()
             if not catalog_products:
                 return [{
@@ -60,7 +66,8 @@ class CatalogSender:
             logger.info(f"[CATALOG_SEND] WHATSAPP_CATALOG_ID: {WHATSAPP_CATALOG_ID}")
             logger.info(f"[CATALOG_SEND] WHATSAPP_TOKEN: {WHATSAPP_TOKEN[:8]}... (скрыт)")
             
-            # Получаем только доступные товары
+            # Получаем только доступные товары (при холодном кэше ждем загрузку каталога)
+            await self.catalog_service.ensure_loaded()
             available_products = self.catalog_service.get_available_products()
             logger.info(f"[CATALOG_SEND] Найдено {len(available_products)} доступных товаров (всего: {len(self.catalog_service.get_products())})")
 
@@ -90,43 +97,29 @@ class CatalogSender:
                 return False
 
             # Отправляем только фото, название и цену каждого букета
-            for product in available_products:
-                name = product.get('name', 'Без названия')
-                price = product.get('price', 'Цена не указана')
-                image_url = product.get('image_url')
-                caption = f"{name}\n{price} 🌸"
-                
-                logger.info(f"[CATALOG_SEND] Отправляю товар: {name} - {price}")
-                
-                if image_url:
-                    message_id = await self.whatsapp_client.send_image_with_caption(
-                        to_number, 
-                        image_url, 
-                        caption,
-                        session_id
-                    )
-                else:
-                    # Если нет изображения, отправляем только текст
-                    message_id = await self.whatsapp_client.send_text_message(
-                        to_number, 
-                        caption,
-                        session_id
-                    )
-                
-                # Сохраняем в БД
-                if message_id and session_id:
-                    message = Message(
+            started = time.perf_counter()
+            sent = await self._send_products(to_number, available_products, session_id)
+            logger.info(f"[CATALOG_SEND] Отправлено {sum(1 for item in sent if item['message_id'])}/{len(sent)} товаров "
+                        f"за {(time.perf_counter() - started) * 1000:.0f} ms (параллельно: {self.concurrency})")
+            
+            # Сохраняем все отправленные сообщения одной пакетной записью, в порядке каталога
+            if session_id:
+                base_time = datetime.now()
+                messages = [
+                    Message(
                         sender_id=to_number,
                         session_id=session_id,
                         role=MessageRole.ASSISTANT,
-                        content=caption,
-                        content_en=caption,
-                        content_thai=caption,
-                        wa_message_id=message_id,
-                        image_url=image_url,
-                        timestamp=datetime.now()
+                        content=item['caption'],
+                        content_en=item['caption'],
+                        content_thai=item['caption'],
+                        wa_message_id=item['message_id'],
+                        image_url=item['image_url'],
+                        timestamp=base_time + timedelta(milliseconds=index)
                     )
-                    await self.message_service.add_message_to_conversation(message)
+                    for index, item in enumerate(item for item in sent if item['message_id'])
+                ]
+                await self.message_service.add_messages_to_conversation(messages)
             
             logger.info(f"[CATALOG_SEND] Каталог успешно отправлен пользователю {to_number}")
             return True
@@ -158,6 +151,57 @@ class CatalogSender:
             
             return False
 
+    async def _send_products(self, to_number: str, products: List[Dict[str, Any]], session_id: str = None) -> List[Dict[str, Any]]:
+        """
+        Отправляет товары с ограниченной параллельностью (CATALOG_SEND_CONCURRENCY).
+        Запросы стартуют строго в порядке каталога: следующий товар берет токен
+        token bucket номера только после старта предыдущего. Результаты хранятся
+        по индексу товара и возвращаются в порядке каталога; метод завершается
+        после ответа на все запросы, поэтому следующий текст не попадает между фото.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started_events = [asyncio.Event() for _ in products]
+        results: List[Dict[str, Any]] = [None] * len(products)
+
+        async def send_one(index: int, product: Dict[str, Any]):
+            name = product.get('name', 'Без названия')
+            price = product.get('price', 'Цена не указана')
+            image_url = product.get('image_url')
+            caption = f"{name}\n{price} 🌸"
+            results[index] = {"caption": caption, "image_url": image_url, "message_id": None}
+            
+            # Ждем, пока стартует отправка предыдущего товара
+            if index > 0:
+                await started_events[index - 1].wait()
+            
+            async with semaphore:
+                try:
+                    await self.whatsapp_client.send_limiter.acquire()
+                finally:
+                    started_events[index].set()
+                
+                logger.info(f"[CATALOG_SEND] Отправляю товар: {name} - {price}")
+                try:
+                    if image_url:
+                        results[index]["message_id"] = await self.whatsapp_client.send_image_with_caption(
+                            to_number, 
+                            image_url, 
+                            caption,
+                            session_id
+                        )
+                    else:
+                        # Если нет изображения, отправляем только текст
+                        results[index]["message_id"] = await self.whatsapp_client.send_text_message(
+                            to_number, 
+                            caption,
+                            session_id
+                        )
+                except Exception as e:
+                    logger.error(f"[CATALOG_SEND_ERROR] Ошибка отправки товара {name}: {e}")
+
+        await asyncio.gather(*(send_one(index, product) for index, product in enumerate(products)))
+        return results
+
 # Создаем глобальный экземпляр
 catalog_sender = CatalogSender()
 
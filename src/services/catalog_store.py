@@ -0,0 +1,396 @@
+"""
+Общий кэш каталога товаров WhatsApp.
+
+Каталог загружается из Graph API асинхронно (со всеми страницами) и хранится
+в одном экземпляре на процесс. Данные обновляются в фоне по TTL: пока идет
+обновление, читатели получают предыдущую версию (stale-while-revalidate).
+Graph API ждут, только если снимка еще нет (холодный кэш) или обновление
+запрошено явно; одновременные читатели ждут одну и ту же загрузку.
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import time
+from bisect import bisect_left
+from typing import Dict, Any, List, Optional, Set, Tuple
+import httpx
+from src.config.settings import (
+    CATALOG_TTL_SECONDS, CATALOG_PAGE_LIMIT, CATALOG_REFRESH_TIMEOUT, CATALOG_WARMUP_TIMEOUT
+)
+from src.utils.metrics import LatencyHistogram
+
+GRAPH_API_URL = "https://graph.facebook.com/v23.0"
+CATALOG_FIELDS = "id,name,description,price,retailer_id,image_url,availability"
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def normalize_tokens(text: str) -> List[str]:
+    """Разбивает текст на нормализованные токены (нижний регистр, ё -> е, без пунктуации)"""
+    if not text:
+        return []
+    return _TOKEN_RE.findall(text.lower().replace("ё", "е"))
+
+
+def is_available(product: Dict[str, Any]) -> bool:
+    """Товар в наличии (availability == 'in stock'); если поля нет, считаем доступным"""
+    avail = product.get("availability")
+    return avail is None or avail.lower() == "in stock"
+
+
+def trigrams(text: str) -> Set[str]:
+    """Все подстроки длины 3 (для поиска по подстроке без перебора товаров)"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class CatalogIndex:
+    """
+    Индексы по снимку каталога, строятся один раз при его обновлении.
+
+    by_id / by_retailer_id - поиск товара за O(1),
+    tokens - слова названия и описания -> позиции товаров; отсортированный
+    список слов позволяет искать по префиксу бинарным поиском;
+    texts - название и описание в нижнем регистре, grams - триграммы этих
+    текстов -> позиции товаров: подстрока проверяется только у кандидатов,
+    в текстах которых есть все ее триграммы.
+    """
+
+    def __init__(self, products: List[Dict[str, Any]]):
+        self.products = products
+        self.by_id: Dict[str, Dict[str, Any]] = {}
+        self.by_retailer_id: Dict[str, Dict[str, Any]] = {}
+        self.tokens: Dict[str, Set[int]] = {}
+        self.texts: List[str] = []
+        self.grams: Dict[str, Set[int]] = {}
+        self.available: List[Dict[str, Any]] = []
+
+        for position, product in enumerate(products):
+            if product.get("id") is not None:
+                self.by_id.setdefault(str(product["id"]), product)
+            if product.get("retailer_id") is not None:
+                self.by_retailer_id.setdefault(str(product["retailer_id"]), product)
+            if is_available(product):
+                self.available.append(product)
+
+            text = f"{product.get('name') or ''}\n{product.get('description') or ''}"
+            for token in normalize_tokens(text):
+                self.tokens.setdefault(token, set()).add(position)
+            lowered = text.lower().replace("ё", "е")
+            self.texts.append(lowered)
+            for gram in trigrams(lowered):
+                self.grams.setdefault(gram, set()).add(position)
+
+        self._sorted_tokens = sorted(self.tokens)
+
+    def _match_prefix(self, prefix: str) -> Set[int]:
+        """Позиции товаров, в которых есть слово, начинающееся с prefix"""
+        matched: Set[int] = set()
+        i = bisect_left(self._sorted_tokens, prefix)
+        while i < len(self._sorted_tokens) and self._sorted_tokens[i].startswith(prefix):
+            matched |= self.tokens[self._sorted_tokens[i]]
+            i += 1
+        return matched
+
+    def _match_words(self, tokens: List[str]) -> Set[int]:
+        """Позиции товаров, где каждое слово запроса - префикс какого-либо слова"""
+        candidates: Optional[Set[int]] = None
+        # Сначала самые длинные слова запроса - они дают самые узкие множества
+        for token in sorted(set(tokens), key=len, reverse=True):
+            matched = self._match_prefix(token)
+            candidates = matched if candidates is None else candidates & matched
+            if not candidates:
+                return set()
+        return candidates or set()
+
+    def search(self, query: str) -> List[Dict[str, Any]]:
+        """
+        Ищет товары, в названии или описании которых запрос встречается как
+        подстрока (в том числе в середине слова), либо каждое слово запроса
+        является префиксом какого-либо слова. Порядок - как в каталоге.
+        """
+        tokens = normalize_tokens(query)
+        if not tokens:
+            return list(self.products)
+
+        matched = self._match_words(tokens)
+        needle = query.strip().lower().replace("ё", "е")
+        matched |= self._match_substring(needle, fallback=not matched)
+        return [self.products[position] for position in sorted(matched)]
+
+    def _match_substring(self, needle: str, fallback: bool) -> Set[int]:
+        """
+        Позиции товаров, в тексте которых есть needle. Кандидаты берутся из
+        индекса триграмм; запросы короче трех символов проверяются перебором
+        только если поиск по префиксам ничего не нашел (fallback).
+        """
+        if len(needle) < 3:
+            if not fallback:
+                return set()
+            candidates = range(len(self.texts))
+        else:
+            candidates: Optional[Set[int]] = None
+            for gram in sorted(trigrams(needle), key=lambda g: len(self.grams.get(g, ()))):
+                positions = self.grams.get(gram)
+                if not positions:
+                    return set()
+                candidates = set(positions) if candidates is None else candidates & positions
+                if not candidates:
+                    return set()
+        return {position for position in candidates if needle in self.texts[position]}
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "ids": len(self.by_id),
+            "retailer_ids": len(self.by_retailer_id),
+            "tokens": len(self.tokens),
+            "trigrams": len(self.grams),
+            "available": len(self.available)
+        }
+
+
+class CatalogStore:
+    """
+    Снимок каталога с фоновым обновлением.
+
+    load() ждет загрузку при холодном кэше, get_products() синхронно
+    возвращает текущий снимок. Если снимок устарел, обновление запускается
+    в фоне; одновременно выполняется не больше одного обновления.
+    """
+
+    def __init__(self, catalog_id: str, access_token: str,
+                 ttl_seconds: float = CATALOG_TTL_SECONDS,
+                 page_limit: int = CATALOG_PAGE_LIMIT,
+                 http_client: Optional[httpx.AsyncClient] = None):
+        self.catalog_id = catalog_id
+        self.access_token = access_token
+        self.ttl_seconds = ttl_seconds
+        self.page_limit = page_limit
+        self._http_client = http_client
+
+        self._products: List[Dict[str, Any]] = []
+        self._index = CatalogIndex([])
+        self._fingerprint: Optional[str] = None
+        self._loaded_at: Optional[float] = None
+        self._stale = False
+        self.version = 0
+
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._refresh_latency = LatencyHistogram()
+        self._metrics = {
+            "refreshes": 0,
+            "refresh_errors": 0,
+            "background_refreshes": 0,
+            "stale_reads": 0,
+            "cold_reads": 0,
+            "awaited_loads": 0,
+            "last_pages": 0,
+            "last_error": None,
+            "last_refresh_at": None,
+            "last_index_ms": None
+        }
+
+    # --- Чтение ---
+
+    def get_products(self) -> List[Dict[str, Any]]:
+        """
+        Возвращает текущий снимок каталога, при необходимости запуская фоновое обновление.
+        В async-коде при холодном кэше снимок пуст - там нужно сначала дождаться load().
+        """
+        if self._loaded_at is None:
+            self._metrics["cold_reads"] += 1
+        elif self.is_stale():
+            self._metrics["stale_reads"] += 1
+        else:
+            return self._products
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Синхронный контекст (скрипты, CLI): event loop'а нет, webhook не блокируется
+            asyncio.run(self.refresh())
+            return self._products
+
+        self.schedule_refresh()
+        return self._products
+
+    async def load(self, force: bool = False) -> List[Dict[str, Any]]:
+        """
+        Возвращает снимок каталога для асинхронного кода.
+        Холодный кэш или force - ждет загрузку (вместе с уже идущим обновлением, если оно есть);
+        устаревший снимок отдается сразу и обновляется в фоне.
+        """
+        if not force and self._loaded_at is not None:
+            return self.get_products()
+        if self._loaded_at is None:
+            self._metrics["cold_reads"] += 1
+        self._metrics["awaited_loads"] += 1
+        # shield: отмена одного читателя не отменяет общую загрузку
+        await asyncio.shield(self.schedule_refresh())
+        return self._products
+
+    def get_index(self) -> CatalogIndex:
+        """Возвращает индексы текущего снимка (с той же логикой фонового обновления)"""
+        self.get_products()
+        return self._index
+
+    def get_by_id(self, product_id: str) -> Optional[Dict[str, Any]]:
+        """Товар по id за O(1)"""
+        return self.get_index().by_id.get(str(product_id))
+
+    def get_by_retailer_id(self, retailer_id: str) -> Optional[Dict[str, Any]]:
+        """Товар по retailer_id за O(1)"""
+        return self.get_index().by_retailer_id.get(str(retailer_id))
+
+    def get_available(self) -> List[Dict[str, Any]]:
+        """Товары в наличии (список посчитан при обновлении снимка)"""
+        return self.get_index().available
+
+    def search(self, query: str) -> List[Dict[str, Any]]:
+        """Поиск по подстроке и префиксам слов названия и описания"""
+        return self.get_index().search(query)
+
+    def is_stale(self) -> bool:
+        """Проверяет, истек ли TTL снимка"""
+        if self._loaded_at is None or self._stale:
+            return True
+        return time.monotonic() - self._loaded_at >= self.ttl_seconds
+
+    def invalidate(self):
+        """Помечает снимок устаревшим; данные остаются доступны до следующего обновления"""
+        self._stale = True
+
+    # --- Обновление ---
+
+    def schedule_refresh(self) -> Optional[asyncio.Task]:
+        """Запускает фоновое обновление, если оно еще не идет"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._metrics["background_refreshes"] += 1
+            self._refresh_task = asyncio.create_task(self.refresh())
+        return self._refresh_task
+
+    async def refresh(self) -> bool:
+        """
+        Загружает каталог целиком и атомарно подменяет снимок.
+        При ошибке сохраняется предыдущая версия.
+        """
+        started = time.perf_counter()
+        try:
+            products, pages = await asyncio.wait_for(self._fetch_all(), timeout=CATALOG_REFRESH_TIMEOUT)
+        except Exception as e:
+            self._metrics["refresh_errors"] += 1
+            self._metrics["last_error"] = f"{type(e).__name__}: {e}"
+            print(f"[CATALOG_STORE] Ошибка обновления каталога {self.catalog_id}: {e!r}")
+            return False
+        finally:
+            self._refresh_latency.record((time.perf_counter() - started) * 1000)
+
+        self._apply(products)
+        self._metrics["refreshes"] += 1
+        self._metrics["last_pages"] = pages
+        self._metrics["last_error"] = None
+        self._metrics["last_refresh_at"] = time.time()
+        print(f"[CATALOG_STORE] Каталог обновлен: {len(products)} товаров, {pages} стр., версия {self.version}")
+        return True
+
+    def _apply(self, products: List[Dict[str, Any]]):
+        """Подменяет снимок; версия растет только при изменении содержимого"""
+        fingerprint = hashlib.sha1(
+            json.dumps(products, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+        if fingerprint != self._fingerprint:
+            started = time.perf_counter()
+            index = CatalogIndex(products)
+            self._metrics["last_index_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            # Снимок и индексы подменяются вместе, читатели не видят промежуточного состояния
+            self._products, self._index = products, index
+            self._fingerprint = fingerprint
+            self.version += 1
+        self._loaded_at = time.monotonic()
+        self._stale = False
+
+    async def _fetch_all(self) -> Tuple[List[Dict[str, Any]], int]:
+        """Проходит все страницы /products по ссылке paging.next"""
+        if self._http_client is not None:
+            return await self._fetch_pages(self._http_client)
+        async with httpx.AsyncClient(timeout=CATALOG_REFRESH_TIMEOUT) as client:
+            return await self._fetch_pages(client)
+
+    async def _fetch_pages(self, client: httpx.AsyncClient) -> Tuple[List[Dict[str, Any]], int]:
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        url: Optional[str] = f"{GRAPH_API_URL}/{self.catalog_id}/products"
+        params: Optional[Dict[str, Any]] = {"fields": CATALOG_FIELDS, "limit": self.page_limit}
+        products: List[Dict[str, Any]] = []
+        pages = 0
+        while url:
+            response = await client.get(url, headers=headers, params=params)
+            response.raise_for_status()
+            data = response.json()
+            products.extend(data.get("data", []))
+            pages += 1
+            # Ссылка next уже содержит все параметры запроса, включая курсор
+            url = (data.get("paging") or {}).get("next")
+            params = None
+        return products, pages
+
+    # --- Жизненный цикл ---
+
+    async def start(self):
+        """Прогревает каталог при старте и запускает периодическое обновление"""
+        if self._loop_task is not None and not self._loop_task.done():
+            return
+        if self._loaded_at is None:
+            try:
+                await asyncio.wait_for(asyncio.shield(self.schedule_refresh()), timeout=CATALOG_WARMUP_TIMEOUT)
+            except asyncio.TimeoutError:
+                print(f"[CATALOG_STORE] Прогрев каталога не уложился в {CATALOG_WARMUP_TIMEOUT}s, продолжаем в фоне")
+        self._loop_task = asyncio.create_task(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.ttl_seconds)
+            await self.schedule_refresh()
+
+    async def aclose(self):
+        """Останавливает фоновое обновление"""
+        for task in (self._loop_task, self._refresh_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._loop_task = None
+        self._refresh_task = None
+
+    # --- Метрики ---
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Возвращает версию каталога и статистику обновлений"""
+        age = None if self._loaded_at is None else round(time.monotonic() - self._loaded_at, 1)
+        return {
+            "catalog_id": self.catalog_id,
+            "version": self.version,
+            "products": len(self._products),
+            "age_sec": age,
+            "ttl_sec": self.ttl_seconds,
+            "stale": self.is_stale(),
+            "refreshing": self._refresh_task is not None and not self._refresh_task.done(),
+            **self._metrics,
+            "index": self._index.get_metrics(),
+            "refresh_latency": self._refresh_latency.snapshot()
+        }
+
+
+_stores: Dict[str, CatalogStore] = {}
+
+
+def get_catalog_store(catalog_id: str, access_token: str) -> CatalogStore:
+    """Возвращает общий для процесса экземпляр CatalogStore для каталога"""
+    store = _stores.get(catalog_id)
+    if store is None:
+        store = CatalogStore(catalog_id, access_token)
+        _stores[catalog_id] = store
+    return store
@@ -12,10 +12,14 @@ from typing import Dict, Any, Optional
 import json
 
 class CommandService:
-    def __init__(self):
-        self.catalog_service = CatalogService(WHATSAPP_CATALOG_ID, WHATSAPP_TOKEN)
-        self.order_service = OrderService()
-        self.session_service = SessionService()
+    def __init__(self, catalog_service: Optional[CatalogService] = None,
+                 order_service: Optional[OrderService] = None,
+                 session_service: Optional[SessionService] = None,
+                 catalog_sender=None):
+        self.catalog_service = catalog_service or CatalogService(WHATSAPP_CATALOG_ID, WHATSAPP_TOKEN)
+        self.order_service = order_service or OrderService()
+        self.session_service = session_service or SessionService()
+        self.catalog_sender = catalog_sender
 
     @log_function("command_service")
     async def handle_command(self, command: Dict[str, Any], session_id: str, sender_id: str) -> Dict[str, Any]:
@@ -51,6 +55,7 @@ class CommandService:
     async def _handle_send_catalog(self, sender_id: str, session_id: str, command: Dict[str, Any]) -> Dict[str, Any]:
         """Обрабатывает команду отправки каталога"""
         try:
+            await self.catalog_service.ensure_loaded()
             products = self.catalog_service.get_available_products()
             
             if not products:
@@ -60,7 +65,9 @@ class CommandService:
                 }
 
             # Отправляем каталог через CatalogSender
-            from src.services.catalog_sender import catalog_sender
+            catalog_sender = self.catalog_sender
+            if catalog_sender is None:
+                from src.services.catalog_sender import catalog_sender
             success = await catalog_sender.send_catalog(sender_id, session_id)
             
             if success:
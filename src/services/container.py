@@ -0,0 +1,127 @@
+"""
+Общий граф сервисов приложения.
+
+Контейнер создается один раз при старте FastAPI и передается в обработчики
+webhook'ов и роуты. Клиент Firestore, HTTP-клиент WhatsApp, модель Gemini и
+кэш каталога переиспользуются между запросами.
+"""
+
+from typing import Optional
+from fastapi import Request
+from google.cloud import firestore
+from src.config.settings import GEMINI_API_KEY, WHATSAPP_CATALOG_ID, WHATSAPP_TOKEN
+from src.utils.whatsapp_client import WhatsAppClient
+from src.services.catalog_store import get_catalog_store
+from src.services.catalog_service import CatalogService
+from src.services.message_service import MessageService
+from src.services.history_cache import HistoryCache
+from src.services.session_service import SessionService
+from src.services.user_service import UserService
+from src.services.order_service import OrderService
+from src.services.error_service import ErrorService
+from src.services.ai_service import AIService
+from src.services.gemini_client import GeminiClient
+from src.services.model_registry import ModelRegistry
+from src.services.translation_cache import TranslationCache
+from src.services.language_detector import LanguageDetector
+from src.repositories.translation_cache_repository import TranslationCacheRepository
+from src.repositories.processed_wamid_repository import ProcessedWamidRepository
+from src.services.dedup_store import DedupStore
+from src.services.catalog_sender import CatalogSender
+from src.services.command_service import CommandService
+from src.services.translation_enrichment import TranslationEnrichmentWorker
+from src.services.conversation_summarizer import ConversationSummarizer
+from src.services.turn_context import TurnContextLoader
+from src.services.activity_index import LastActivityIndex
+from src.services.message_processor import MessageProcessor
+
+
+class ServiceContainer:
+    """Сервисы уровня приложения (по одному экземпляру на процесс)"""
+
+    def __init__(self, db: Optional[firestore.Client] = None):
+        self.db = db if db is not None else self._create_firestore_client()
+
+        # Внешние клиенты
+        self.whatsapp_client = WhatsAppClient()
+        self.catalog_store = get_catalog_store(WHATSAPP_CATALOG_ID, WHATSAPP_TOKEN)
+        self.catalog_service = CatalogService(WHATSAPP_CATALOG_ID, WHATSAPP_TOKEN, store=self.catalog_store)
+
+        # Сервисы поверх Firestore (один клиент на всех)
+        self.history_cache = HistoryCache()
+        self.message_service = MessageService(self.db, history_cache=self.history_cache)
+        self.session_service = SessionService(self.db)
+        self.user_service = UserService(self.db)
+        self.order_service = OrderService(self.db)
+        self.error_service = ErrorService(self.db)
+        self.activity_index = LastActivityIndex(self.db)
+        self.turn_loader = TurnContextLoader(self.db, self.session_service, activity_index=self.activity_index)
+        self.dedup_store = DedupStore(ProcessedWamidRepository(self.db) if self.db is not None else None)
+
+        # AI и обработка сообщений
+        self.model_registry = ModelRegistry()
+        self.gemini_client = GeminiClient(pool_limits=self.model_registry.pool_limits())
+        self.translation_cache = TranslationCache(TranslationCacheRepository(self.db)) if self.db is not None else TranslationCache()
+        self.language_detector = LanguageDetector()
+        self.ai_service = AIService(
+            GEMINI_API_KEY,
+            catalog_service=self.catalog_service,
+            error_service=self.error_service,
+            gemini_client=self.gemini_client,
+            translation_cache=self.translation_cache,
+            language_detector=self.language_detector,
+            model_registry=self.model_registry
+        )
+        self.catalog_sender = CatalogSender(
+            catalog_service=self.catalog_service,
+            whatsapp_client=self.whatsapp_client,
+            message_service=self.message_service
+        )
+        self.command_service = CommandService(
+            catalog_service=self.catalog_service,
+            order_service=self.order_service,
+            session_service=self.session_service,
+            catalog_sender=self.catalog_sender
+        )
+        self.translation_worker = TranslationEnrichmentWorker(self.ai_service, self.message_service)
+        self.conversation_summarizer = ConversationSummarizer(self.ai_service, self.session_service)
+        self.message_processor = MessageProcessor(services=self)
+
+    @staticmethod
+    def _create_firestore_client() -> Optional[firestore.Client]:
+        try:
+            return firestore.Client()
+        except Exception as e:
+            print(f"[SERVICES] Failed to initialize Firestore client: {e}")
+            return None
+
+    async def start(self):
+        """Открывает долгоживущие соединения при старте приложения"""
+        await self.whatsapp_client.start()
+        await self.catalog_store.start()
+        await self.translation_worker.start()
+
+    async def aclose(self):
+        """Освобождает ресурсы при остановке приложения"""
+        await self.catalog_store.aclose()
+        await self.translation_worker.stop()
+        await self.conversation_summarizer.flush()
+        await self.translation_cache.flush()
+        await self.whatsapp_client.aclose()
+        if self.db is not None:
+            try:
+                self.db.close()
+            except Exception as e:
+                print(f"[SERVICES] Ошибка закрытия Firestore клиента: {e}")
+
+
+def get_services(request: Request) -> ServiceContainer:
+    """
+    Зависимость FastAPI: возвращает контейнер сервисов приложения.
+    Если приложение запущено без lifespan (например, в тестах), контейнер создается при первом обращении.
+    """
+    services = getattr(request.app.state, "services", None)
+    if services is None:
+        services = ServiceContainer()
+        request.app.state.services = services
+    return services
@@ -0,0 +1,174 @@
+"""
+Сжатие длинных диалогов в краткое содержание.
+
+Когда несжатая часть истории сессии превышает SUMMARY_THRESHOLD_TOKENS,
+старые сообщения сворачиваются в краткое содержание, которое хранится в
+документе сессии (summary, summary_until). В промпт идут краткое
+содержание и сообщения после summary_until (не меньше SUMMARY_KEEP_MESSAGES
+последних), поэтому размер промпта не растет с длиной переписки.
+
+Сжатие запускается в фоне после отправки ответа, чтобы не добавлять
+задержку к ходу диалога.
+"""
+
+import asyncio
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Set, Tuple
+from src.config.settings import SUMMARY_THRESHOLD_TOKENS, SUMMARY_KEEP_MESSAGES, HISTORY_CACHE_SESSIONS
+from src.services.prompt_assembler import estimate_tokens
+
+
+def _epoch(value) -> Optional[float]:
+    """
+    Время сообщения в секундах. Наивное время - локальное (Message.timestamp
+    создается через datetime.now()), из Firestore приходит время с часовым поясом.
+    """
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        value = value.astimezone()
+    return value.timestamp()
+
+
+def history_tokens(history: List[Dict[str, Any]]) -> int:
+    """Оценка токенов истории по тексту сообщений"""
+    return sum(estimate_tokens(msg.get('content') or '') for msg in history)
+
+
+class ConversationSummarizer:
+    """Хранит и обновляет краткое содержание ранней части диалога"""
+
+    def __init__(self, ai_service, session_service,
+                 threshold_tokens: int = SUMMARY_THRESHOLD_TOKENS,
+                 keep_messages: int = SUMMARY_KEEP_MESSAGES,
+                 max_sessions: int = HISTORY_CACHE_SESSIONS):
+        self.ai_service = ai_service
+        self.session_service = session_service
+        self.threshold_tokens = threshold_tokens
+        self.keep_messages = max(2, keep_messages)
+        self.max_sessions = max_sessions
+        # Состояние сессий в памяти, чтобы не читать документ сессии на каждом ходе
+        self._states: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+        self._in_progress: Set[Tuple[str, str]] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._metrics = {
+            "prompts": 0,
+            "prompts_with_summary": 0,
+            "compactions": 0,
+            "failures": 0,
+            "folded_messages": 0,
+            "tokens_saved_est": 0
+        }
+
+    async def prepare(self, sender_id: str, session_id: str, history: List[Dict[str, Any]],
+                      summary_state: Optional[Dict[str, Any]] = None) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+        """
+        Возвращает (краткое содержание или None, сообщения для промпта).
+        Сообщения, уже вошедшие в краткое содержание, из истории убираются.
+        summary_state - состояние из уже прочитанного документа сессии (TurnContext),
+        тогда документ сессии повторно не читается.
+        """
+        self._metrics["prompts"] += 1
+        if summary_state is not None and (sender_id, session_id) not in self._states:
+            self._set_state((sender_id, session_id), summary_state)
+        state = await self._get_state(sender_id, session_id)
+        summary = state.get('summary')
+        if not summary:
+            return None, history
+
+        recent = self._unsummarized(history, state)
+        self._metrics["prompts_with_summary"] += 1
+        self._metrics["tokens_saved_est"] += max(
+            0, history_tokens(history[:len(history) - len(recent)]) - estimate_tokens(summary)
+        )
+        return summary, recent
+
+    def schedule_compaction(self, sender_id: str, session_id: str, history: List[Dict[str, Any]]):
+        """Запускает сжатие в фоне, если несжатая часть истории превысила порог"""
+        key = (sender_id, session_id)
+        state = self._states.get(key)
+        if state is None or key in self._in_progress:
+            return
+        pending = self._unsummarized(history, state)
+        if len(pending) <= self.keep_messages or history_tokens(pending) <= self.threshold_tokens:
+            return
+        self._in_progress.add(key)
+        try:
+            task = asyncio.get_running_loop().create_task(self._compact(key, state, pending))
+        except RuntimeError:
+            self._in_progress.discard(key)
+            return
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _compact(self, key: Tuple[str, str], state: Dict[str, Any], pending: List[Dict[str, Any]]):
+        sender_id, session_id = key
+        fold = pending[:-self.keep_messages]
+        try:
+            summary = await self.ai_service.summarize_conversation(state.get('summary'), fold)
+            if not summary:
+                raise ValueError("empty summary")
+            until = fold[-1].get('timestamp')
+            await self.session_service.save_conversation_summary(
+                sender_id, session_id, summary, until, state.get('folded', 0) + len(fold)
+            )
+            self._set_state(key, {'summary': summary, 'until': until, 'folded': state.get('folded', 0) + len(fold)})
+            self._metrics["compactions"] += 1
+            self._metrics["folded_messages"] += len(fold)
+            print(f"[SUMMARY] {sender_id}/{session_id}: свернуто {len(fold)} сообщений, "
+                  f"краткое содержание ~{estimate_tokens(summary)} токенов")
+        except Exception as e:
+            self._metrics["failures"] += 1
+            print(f"[SUMMARY] Ошибка сжатия истории {sender_id}/{session_id}: {e}")
+        finally:
+            self._in_progress.discard(key)
+
+    def _unsummarized(self, history: List[Dict[str, Any]], state: Dict[str, Any]) -> List[Dict[str, Any]]:
+        until = _epoch(state.get('until'))
+        if until is None:
+            return history
+        recent = [msg for msg in history if (_epoch(msg.get('timestamp')) or until + 1) > until]
+        # Последние сообщения нужны модели всегда, даже если уже вошли в краткое содержание
+        if len(recent) < self.keep_messages:
+            recent = history[-self.keep_messages:]
+        return recent
+
+    async def _get_state(self, sender_id: str, session_id: str) -> Dict[str, Any]:
+        key = (sender_id, session_id)
+        state = self._states.get(key)
+        if state is not None:
+            self._states.move_to_end(key)
+            return state
+        try:
+            state = await self.session_service.get_conversation_summary(sender_id, session_id) or {}
+        except Exception as e:
+            print(f"[SUMMARY] Ошибка чтения краткого содержания {sender_id}/{session_id}: {e}")
+            return {}
+        self._set_state(key, state)
+        return state
+
+    def _set_state(self, key: Tuple[str, str], state: Dict[str, Any]):
+        self._states[key] = state
+        self._states.move_to_end(key)
+        while len(self._states) > self.max_sessions:
+            self._states.popitem(last=False)
+
+    def forget(self, sender_id: str, session_id: str):
+        """Сбрасывает состояние сессии в памяти (например, по /newses)"""
+        self._states.pop((sender_id, session_id), None)
+
+    async def flush(self):
+        """Дожидается фоновых сжатий (при остановке и в тестах)"""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Возвращает счетчики сжатий и оценку сэкономленных токенов"""
+        return {
+            "threshold_tokens": self.threshold_tokens,
+            "keep_messages": self.keep_messages,
+            "sessions": len(self._states),
+            "in_progress": len(self._in_progress),
+            **self._metrics
+        }
@@ -0,0 +1,128 @@
+"""
+Защита от повторной обработки входящих сообщений WhatsApp.
+
+Meta повторно доставляет webhook, если не дождалась ответа, и повтор может
+прийти на другой инстанс. Первый уровень - фильтр недавних wamid в памяти
+из двух поколений: текущее поколение сменяется раз в window_seconds или при
+заполнении max_ids, предыдущее отбрасывается целиком. Память ограничена
+2 * max_ids идентификаторами, а горячие дубли отсекаются без обращения к БД.
+Второй уровень - атомарное создание документа в processed_wamids (общий для
+всех инстансов, с TTL по expires_at). Если Firestore недоступен, сообщение
+обрабатывается (лучше редкий дубль, чем потерянное сообщение). Если сообщение
+не удалось обработать, отметка снимается (release), и повторная доставка от
+Meta обрабатывается заново.
+"""
+
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Optional, Set
+from src.config.settings import DEDUP_WINDOW_SECONDS, DEDUP_MAX_IDS, DEDUP_STORE_TTL_HOURS
+
+
+class RecentIds:
+    """Недавние идентификаторы: два поколения множеств с ротацией по времени и размеру"""
+
+    def __init__(self, window_seconds: float = DEDUP_WINDOW_SECONDS, max_ids: int = DEDUP_MAX_IDS):
+        self.window_seconds = window_seconds
+        self.max_ids = max(1, max_ids)
+        self._current: Set[str] = set()
+        self._previous: Set[str] = set()
+        self._rotated_at = time.monotonic()
+        self.rotations = 0
+
+    def _rotate(self):
+        now = time.monotonic()
+        elapsed = now - self._rotated_at
+        if elapsed < self.window_seconds and len(self._current) < self.max_ids:
+            return
+        # Если прошло больше двух окон, предыдущее поколение тоже устарело
+        self._previous = self._current if elapsed < 2 * self.window_seconds else set()
+        self._current = set()
+        self._rotated_at = now
+        self.rotations += 1
+
+    def __contains__(self, item: str) -> bool:
+        self._rotate()
+        return item in self._current or item in self._previous
+
+    def add(self, item: str):
+        self._rotate()
+        self._current.add(item)
+
+    def discard(self, item: str):
+        self._current.discard(item)
+        self._previous.discard(item)
+
+    def __len__(self) -> int:
+        return len(self._current) + len(self._previous)
+
+
+class DedupStore:
+    """Проверяет, обрабатывался ли wamid, и отмечает его как обработанный"""
+
+    def __init__(self, repository=None,
+                 window_seconds: float = DEDUP_WINDOW_SECONDS,
+                 max_ids: int = DEDUP_MAX_IDS,
+                 ttl_hours: float = DEDUP_STORE_TTL_HOURS):
+        self.repository = repository
+        self.ttl_hours = ttl_hours
+        self.recent = RecentIds(window_seconds, max_ids)
+        self._metrics = {
+            "checks": 0,
+            "memory_duplicates": 0,
+            "store_duplicates": 0,
+            "claimed": 0,
+            "released": 0,
+            "store_errors": 0
+        }
+
+    async def claim(self, wamid: Optional[str]) -> bool:
+        """
+        Забирает сообщение в обработку.
+        Returns:
+            bool: True - сообщение новое, False - дубль
+        """
+        if not wamid:
+            return True
+        self._metrics["checks"] += 1
+        if wamid in self.recent:
+            self._metrics["memory_duplicates"] += 1
+            return False
+        # Отмечаем до обращения к БД, чтобы параллельный дубль на этом инстансе отсекся в памяти
+        self.recent.add(wamid)
+
+        if self.repository is not None:
+            expires_at = datetime.now(timezone.utc) + timedelta(hours=self.ttl_hours)
+            try:
+                if not await self.repository.claim(wamid, expires_at):
+                    self._metrics["store_duplicates"] += 1
+                    return False
+            except Exception as e:
+                self._metrics["store_errors"] += 1
+                print(f"[DEDUP] Ошибка записи processed_wamids для {wamid}: {e}")
+        self._metrics["claimed"] += 1
+        return True
+
+    async def release(self, wamid: Optional[str]):
+        """Снимает отметку с сообщения, которое не удалось обработать (повтор от Meta будет обработан)"""
+        if not wamid:
+            return
+        self.recent.discard(wamid)
+        self._metrics["released"] += 1
+        if self.repository is not None:
+            try:
+                await self.repository.release(wamid)
+            except Exception as e:
+                self._metrics["store_errors"] += 1
+                print(f"[DEDUP] Ошибка удаления отметки processed_wamids для {wamid}: {e}")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Счетчики дублей по уровням и размер фильтра в памяти"""
+        return {
+            "window_sec": self.recent.window_seconds,
+            "max_ids": self.recent.max_ids,
+            "recent_ids": len(self.recent),
+            "rotations": self.recent.rotations,
+            "persistent": self.repository is not None,
+            **self._metrics
+        }
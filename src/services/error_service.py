@@ -9,8 +9,8 @@ from src.models.error import Error, ErrorSeverity, ErrorStatus
 class ErrorService:
     """Сервис для работы с ошибками"""
     
-    def __init__(self):
-        self.error_repository = ErrorRepository()
+    def __init__(self, db=None):
+        self.error_repository = ErrorRepository(db)
     
     async def log_error(
         self,
@@ -0,0 +1,165 @@
+"""
+Асинхронный шлюз к Gemini.
+
+Все вызовы модели идут через generate_content_async, поэтому медленный ответ
+не блокирует event loop и webhook'и других клиентов. Семафоры пулов
+ограничивают число одновременных запросов (у вспомогательных задач свой пул,
+чтобы переводы не занимали слоты ответов), у каждого вызова есть таймаут,
+латентность собирается по задачам (chat, detect, translate).
+
+У каждого пула свой предохранитель: при всплеске ошибок Gemini вызовы пула
+сразу отклоняются (CircuitOpenError), а повторы вызовов ограничены общим
+бюджетом повторов и идут с экспоненциальной задержкой.
+"""
+
+import asyncio
+import time
+from typing import Any, Dict, Optional
+from src.config.settings import (
+    GEMINI_MAX_CONCURRENCY, GEMINI_TIMEOUT,
+    GEMINI_BREAKER_ERROR_RATE, GEMINI_BREAKER_MIN_CALLS, GEMINI_BREAKER_WINDOW_SECONDS, GEMINI_BREAKER_OPEN_SECONDS,
+    GEMINI_RETRY_BUDGET_RATIO, GEMINI_RETRY_BUDGET_MIN
+)
+from src.utils.metrics import LatencyRegistry
+from src.utils.resilience import CircuitBreaker, RetryBudget, backoff_delay
+
+
+class GeminiTimeoutError(Exception):
+    """Gemini не ответил за отведенное время"""
+
+
+class GeminiClient:
+    """Ограничивает параллельность и время вызовов Gemini и собирает метрики"""
+
+    DEFAULT_POOL = "default"
+
+    def __init__(self, max_concurrency: int = GEMINI_MAX_CONCURRENCY, timeout: float = GEMINI_TIMEOUT,
+                 pool_limits: Optional[Dict[str, int]] = None):
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.pool_limits = {name: max(1, limit) for name, limit in (pool_limits or {}).items()}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._in_flight = 0
+        self._pool_in_flight: Dict[str, int] = {}
+        self._latency = LatencyRegistry()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self.retry_budget = RetryBudget(GEMINI_RETRY_BUDGET_RATIO, GEMINI_RETRY_BUDGET_MIN)
+        self._metrics = {
+            "calls": 0,
+            "errors": 0,
+            "timeouts": 0,
+            "max_in_flight": 0
+        }
+
+    def _get_semaphore(self, pool: str) -> asyncio.Semaphore:
+        # Семафоры привязаны к event loop'у; в тестах и скриптах loop может смениться
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._semaphores = {}
+            self._loop = loop
+        semaphore = self._semaphores.get(pool)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.pool_limits.get(pool, self.max_concurrency))
+            self._semaphores[pool] = semaphore
+        return semaphore
+
+    def breaker(self, pool: Optional[str] = None) -> CircuitBreaker:
+        """Предохранитель пула (создается при первом обращении)"""
+        pool = pool if pool in self.pool_limits else self.DEFAULT_POOL
+        breaker = self._breakers.get(pool)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                pool,
+                error_rate_threshold=GEMINI_BREAKER_ERROR_RATE,
+                min_calls=GEMINI_BREAKER_MIN_CALLS,
+                window_seconds=GEMINI_BREAKER_WINDOW_SECONDS,
+                open_seconds=GEMINI_BREAKER_OPEN_SECONDS
+            )
+            self._breakers[pool] = breaker
+        return breaker
+
+    async def before_retry(self, attempt: int, pool: Optional[str] = None) -> bool:
+        """
+        Решает, можно ли повторить вызов: предохранитель пула не разомкнут и в общем
+        бюджете есть повтор. Если можно - ждет задержку с джиттером и возвращает True.
+        """
+        if self.breaker(pool).state == "open" or not self.retry_budget.try_retry():
+            return False
+        await asyncio.sleep(backoff_delay(attempt))
+        return True
+
+    async def generate(self, model, prompt: Any, task: str = "chat", timeout: Optional[float] = None,
+                       pool: Optional[str] = None, retry: bool = False):
+        """
+        Вызывает model.generate_content_async с ограничением параллельности и таймаутом.
+        Пул без заданного лимита (и вызовы без пула) делят общий лимит max_concurrency.
+        Возвращает ответ модели; при превышении таймаута бросает GeminiTimeoutError,
+        при разомкнутом предохранителе пула - CircuitOpenError.
+        retry - вызов является повтором (учитывается в бюджете повторов, см. before_retry).
+        """
+        timeout = timeout or self.timeout
+        pool = pool if pool in self.pool_limits else self.DEFAULT_POOL
+        breaker = self.breaker(pool)
+        probe = breaker.before_call()
+        semaphore = self._get_semaphore(pool)
+        self._metrics["calls"] += 1
+        if not retry:
+            self.retry_budget.record_call()
+
+        queued = time.perf_counter()
+        try:
+            async with semaphore:
+                self._latency.record(f"{task}.wait", (time.perf_counter() - queued) * 1000)
+                self._in_flight += 1
+                self._pool_in_flight[pool] = self._pool_in_flight.get(pool, 0) + 1
+                self._metrics["max_in_flight"] = max(self._metrics["max_in_flight"], self._in_flight)
+                started = time.perf_counter()
+                try:
+                    response = await asyncio.wait_for(model.generate_content_async(prompt), timeout=timeout)
+                    breaker.record_success()
+                    return response
+                except asyncio.TimeoutError:
+                    self._metrics["timeouts"] += 1
+                    breaker.record_failure()
+                    print(f"[GEMINI] {task}: нет ответа за {timeout}s")
+                    raise GeminiTimeoutError(f"Gemini {task} call timed out after {timeout}s")
+                except Exception:
+                    self._metrics["errors"] += 1
+                    breaker.record_failure()
+                    raise
+                finally:
+                    self._in_flight -= 1
+                    self._pool_in_flight[pool] -= 1
+                    self._latency.record(task, (time.perf_counter() - started) * 1000)
+        except asyncio.CancelledError:
+            # Отмена в очереди семафора или во время вызова: результата нет, пробный слот освобождаем
+            if probe:
+                breaker.release_probe()
+            raise
+
+    async def generate_text(self, model, prompt: Any, task: str = "chat", timeout: Optional[float] = None,
+                            pool: Optional[str] = None, retry: bool = False) -> str:
+        """То же, что generate, но возвращает текст ответа без пробелов по краям"""
+        response = await self.generate(model, prompt, task=task, timeout=timeout, pool=pool, retry=retry)
+        return response.text.strip()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Возвращает параметры шлюза, счетчики и латентность по задачам"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "timeout_sec": self.timeout,
+            "in_flight": self._in_flight,
+            "pools": {
+                name: {"limit": self.pool_limits.get(name, self.max_concurrency), "in_flight": count}
+                for name, count in self._pool_in_flight.items()
+            },
+            **self._metrics,
+            "circuit_breakers": {name: breaker.get_metrics() for name, breaker in self._breakers.items()},
+            "retry_budget": self.retry_budget.get_metrics(),
+            "latency": self._latency.snapshot()
+        }
+
+    def breaker_states(self) -> Dict[str, str]:
+        """Состояние предохранителей по пулам (для /health)"""
+        return {name: breaker.state for name, breaker in self._breakers.items()}
@@ -0,0 +1,175 @@
+"""
+Кэш истории диалога в памяти процесса.
+
+История сессии (sender_id, session_id) читается из Firestore один раз
+(последние N сообщений), а дальше каждое записанное сообщение (пользователя,
+бота, каталога) дописывается в кэш, поэтому обычный ход диалога обходится
+без чтения истории. Кэш ограничен числом сессий (LRU) и сообщений в сессии; запись
+живет не дольше TTL, чтобы сообщения, записанные другим инстансом, рано
+или поздно были перечитаны. /newses сбрасывает кэш сессии.
+"""
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Tuple
+from src.config.settings import HISTORY_CACHE_SESSIONS, HISTORY_CACHE_MAX_MESSAGES, HISTORY_CACHE_TTL_SECONDS
+from src.models.message import Message
+
+
+def utc_timestamp(value: Any) -> Any:
+    """Время сообщения в UTC с часовым поясом, как его возвращает Firestore (naive - локальное время)"""
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc)
+    return value
+
+
+def history_entry(message: Message) -> Dict[str, Any]:
+    """Сообщение в том же виде, в каком его возвращает чтение истории из репозитория"""
+    return {
+        # ID документа сообщения: wa_message_id или заранее выданный id
+        'id': message.wa_message_id or message.id,
+        'role': message.role.value,
+        'content': message.content,
+        'timestamp': utc_timestamp(message.timestamp),
+        'content_en': message.content_en,
+        'content_thai': message.content_thai,
+        'wa_message_id': message.wa_message_id,
+        'image_url': message.image_url,
+        'audio_url': message.audio_url,
+        'audio_duration': message.audio_duration,
+        'transcription': message.transcription,
+        'translation_status': message.translation_status
+    }
+
+
+@dataclass
+class _SessionHistory:
+    messages: List[Dict[str, Any]]
+    expires_at: float
+    # True - в кэше вся история сессии с первого сообщения
+    complete: bool
+    ids: set = field(default_factory=set)
+
+
+class HistoryCache:
+    """Write-through кэш истории по (sender_id, session_id)"""
+
+    def __init__(self, max_sessions: int = HISTORY_CACHE_SESSIONS,
+                 max_messages: int = HISTORY_CACHE_MAX_MESSAGES,
+                 ttl_seconds: float = HISTORY_CACHE_TTL_SECONDS):
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[Tuple[str, str], _SessionHistory]" = OrderedDict()
+        self._metrics = {
+            "hits": 0,
+            "misses": 0,
+            "fills": 0,
+            "appends": 0,
+            "updates": 0,
+            "lookups_by_id": 0,
+            "invalidations": 0,
+            "evictions": 0,
+            "expired": 0
+        }
+
+    def get(self, sender_id: str, session_id: str, limit: int) -> Optional[List[Dict[str, Any]]]:
+        """Последние limit сообщений сессии или None, если кэш не может ответить"""
+        entry = self._get_entry(sender_id, session_id)
+        if entry is None or (not entry.complete and len(entry.messages) < limit):
+            self._metrics["misses"] += 1
+            return None
+        self._metrics["hits"] += 1
+        # Копии: вызывающий код не должен менять содержимое кэша
+        return [dict(msg) for msg in entry.messages[-limit:]]
+
+    def fill(self, sender_id: str, session_id: str, history: List[Dict[str, Any]], complete: bool):
+        """Кладет историю, прочитанную из Firestore (complete - прочитана вся сессия)"""
+        key = (sender_id, session_id)
+        messages = [dict(msg) for msg in history[-self.max_messages:]]
+        self._sessions[key] = _SessionHistory(
+            messages=messages,
+            expires_at=time.monotonic() + self.ttl_seconds,
+            complete=complete and len(history) <= self.max_messages,
+            ids={msg['wa_message_id'] for msg in messages if msg.get('wa_message_id')}
+        )
+        self._sessions.move_to_end(key)
+        self._metrics["fills"] += 1
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self._metrics["evictions"] += 1
+
+    def append(self, message: Message):
+        """Дописывает записанное сообщение (если история сессии уже в кэше)"""
+        entry = self._get_entry(message.sender_id, message.session_id)
+        if entry is None:
+            return
+        if message.wa_message_id:
+            if message.wa_message_id in entry.ids:
+                return
+            entry.ids.add(message.wa_message_id)
+        entry.messages.append(history_entry(message))
+        if len(entry.messages) > self.max_messages:
+            dropped = entry.messages[:-self.max_messages]
+            del entry.messages[:-self.max_messages]
+            entry.ids.difference_update(msg.get('wa_message_id') for msg in dropped)
+            entry.complete = False
+        self._metrics["appends"] += 1
+
+    def update(self, sender_id: str, session_id: str, message_id: str, fields: Dict[str, Any]):
+        """
+        Обновляет поля сообщения в кэше (например, дописанные переводы).
+        message_id - ID документа сообщения (wa_message_id или сгенерированный id).
+        """
+        entry = self._get_entry(sender_id, session_id)
+        if entry is None or not message_id:
+            return
+        for msg in reversed(entry.messages):
+            if msg.get('id') == message_id or msg.get('wa_message_id') == message_id:
+                msg.update(fields)
+                self._metrics["updates"] += 1
+                return
+
+    def find_message(self, sender_id: str, wa_message_id: str) -> Optional[Dict[str, Any]]:
+        """Ищет сообщение по wa_message_id в закэшированных сессиях пользователя"""
+        if not wa_message_id:
+            return None
+        for (cached_sender, session_id), entry in list(self._sessions.items()):
+            if cached_sender != sender_id or wa_message_id not in entry.ids:
+                continue
+            if entry.expires_at <= time.monotonic():
+                continue
+            for msg in reversed(entry.messages):
+                if msg.get('wa_message_id') == wa_message_id:
+                    self._metrics["lookups_by_id"] += 1
+                    return {**msg, 'session_id': session_id}
+        return None
+
+    def invalidate(self, sender_id: str, session_id: str):
+        """Сбрасывает историю сессии"""
+        if self._sessions.pop((sender_id, session_id), None) is not None:
+            self._metrics["invalidations"] += 1
+
+    def _get_entry(self, sender_id: str, session_id: str) -> Optional[_SessionHistory]:
+        key = (sender_id, session_id)
+        entry = self._sessions.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            del self._sessions[key]
+            self._metrics["expired"] += 1
+            return None
+        self._sessions.move_to_end(key)
+        return entry
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Возвращает размер кэша и долю чтений истории без Firestore"""
+        lookups = self._metrics["hits"] + self._metrics["misses"]
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            **self._metrics,
+            "hit_ratio": round(self._metrics["hits"] / lookups, 3) if lookups else 0.0
+        }
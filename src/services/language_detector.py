@@ -0,0 +1,259 @@
+"""
+Локальное определение языка перед обращением к Gemini.
+
+Два уровня:
+1. Письменность (Unicode-блоки): тайский, кириллица, хангыль, кана, арабское
+   письмо и т.д. однозначно дают язык за микросекунды.
+2. Латиница: символы, характерные только для одного языка (ñ, ß, ł, ř...),
+   и сравнение триграмм символов с небольшими профилями языков.
+
+Если уверенность ниже порога LANGUAGE_DETECT_THRESHOLD, результат помечается
+escalate=True, и вызывающий код спрашивает Gemini.
+"""
+
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Any, List, Tuple
+from src.config.settings import LANGUAGE_DETECT_THRESHOLD
+from src.utils.metrics import LatencyHistogram
+
+# (начало блока, конец блока, письменность)
+_SCRIPT_RANGES: List[Tuple[int, int, str]] = [
+    (0x0041, 0x024F, 'latin'),
+    (0x0370, 0x03FF, 'greek'),
+    (0x0400, 0x052F, 'cyrillic'),
+    (0x0530, 0x058F, 'armenian'),
+    (0x0590, 0x05FF, 'hebrew'),
+    (0x0600, 0x06FF, 'arabic'),
+    (0x0900, 0x097F, 'devanagari'),
+    (0x0980, 0x09FF, 'bengali'),
+    (0x0E00, 0x0E7F, 'thai'),
+    (0x10A0, 0x10FF, 'georgian'),
+    (0x1200, 0x137F, 'ethiopic'),
+    (0x1E00, 0x1EFF, 'latin'),
+    (0x3040, 0x30FF, 'kana'),
+    (0x4E00, 0x9FFF, 'han'),
+    (0xAC00, 0xD7AF, 'hangul'),
+]
+
+# Письменности, по которым язык определяется однозначно
+_SCRIPT_LANGUAGE = {
+    'thai': 'th',
+    'cyrillic': 'ru',
+    'armenian': 'hy',
+    'hebrew': 'he',
+    'arabic': 'ar',
+    'devanagari': 'hi',
+    'bengali': 'bn',
+    'georgian': 'ka',
+    'ethiopic': 'am',
+    'hangul': 'ko',
+    'kana': 'ja',
+    'han': 'zh',
+}
+
+# Буквы, которые указывают на другой язык той же письменности (уверенность снижается)
+_AMBIGUOUS_LETTERS = {
+    'cyrillic': set('іїєґўђћџљњ'),
+    'arabic': set('پچژگ'),
+}
+
+# Буквы латиницы, которые встречаются только в одном из поддерживаемых языков
+_UNIQUE_LATIN = {
+    'ñ': 'es', '¿': 'es', '¡': 'es',
+    'ß': 'de',
+    'ł': 'pl', 'ą': 'pl', 'ę': 'pl', 'ś': 'pl', 'ź': 'pl', 'ż': 'pl',
+    'ř': 'cs', 'ě': 'cs', 'ů': 'cs',
+    'ğ': 'tr', 'ı': 'tr', 'ş': 'tr',
+    'ã': 'pt', 'õ': 'pt',
+    'ő': 'hu', 'ű': 'hu',
+    'ư': 'vi', 'ơ': 'vi', 'đ': 'vi', 'ạ': 'vi', 'ộ': 'vi', 'ế': 'vi',
+}
+
+# Частые слова переписки с магазином - из них строятся триграммные профили
+_LATIN_SAMPLES = {
+    'en': "the and you for with this that have are what how much can please delivery flowers "
+          "want order thank thanks hello would like tomorrow today price bouquet send when where "
+          "there your will need some roses birthday address pay card is it to of in my me",
+    'it': "il la le che per con una sono questo vorrei fiori consegna grazie buongiorno ciao "
+          "quanto costa domani oggi mazzo rose compleanno indirizzo pagare carta della degli "
+          "non ho mi di un è anche",
+    'fr': "le la les des une est pour avec vous nous je voudrais fleurs livraison merci bonjour "
+          "combien coûte demain aujourd'hui bouquet roses anniversaire adresse payer carte "
+          "que qui pas du au ce",
+    'es': "el la los las que por para con una quiero flores entrega gracias hola cuánto cuesta "
+          "mañana hoy ramo rosas cumpleaños dirección pagar tarjeta del es y de en mi",
+    'de': "der die das und ist ich nicht mit für ein eine sie wir möchte blumen lieferung danke "
+          "hallo wie viel kostet morgen heute strauß rosen geburtstag adresse bezahlen karte "
+          "auch zu den",
+    'pt': "o a os as que para com uma não eu quero flores entrega obrigado olá quanto custa "
+          "amanhã hoje buquê rosas aniversário endereço pagar cartão do da em é",
+    'nl': "de het een en is ik niet met voor van wij wil bloemen bezorging dank hallo hoeveel "
+          "kost morgen vandaag boeket rozen verjaardag adres betalen kaart ook op",
+    'id': "saya ingin bunga kirim terima kasih halo berapa harga besok hari ini buket mawar "
+          "ulang tahun alamat bayar kartu dan yang untuk dengan ada tidak bisa",
+}
+
+
+def _words(text: str) -> List[str]:
+    """Слова из букв (апостроф внутри слова сохраняется: aujourd'hui)"""
+    words = []
+    word = []
+    for ch in text.lower() + ' ':
+        if ch.isalpha() or ch == "'":
+            word.append(ch)
+        elif word:
+            words.append(''.join(word))
+            word = []
+    return words
+
+
+def _word_trigrams(words: List[str]) -> List[str]:
+    """Триграммы символов по словам с пробелами по краям (' ro', 'ros', 'ose', 'se ')"""
+    trigrams = []
+    for word in words:
+        padded = ' ' + word + ' '
+        trigrams.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+def _build_profile(sample: str) -> Dict[str, float]:
+    counts = Counter(_word_trigrams(_words(sample)))
+    total = sum(counts.values())
+    return {trigram: count / total for trigram, count in counts.items()}
+
+
+_PROFILES = {lang: _build_profile(sample) for lang, sample in _LATIN_SAMPLES.items()}
+
+
+def _build_marker_words() -> Dict[str, str]:
+    # Слово из образцов, встречающееся только в одном языке, - голос за этот язык
+    owners: Dict[str, set] = {}
+    for lang, sample in _LATIN_SAMPLES.items():
+        for word in sample.split():
+            owners.setdefault(word, set()).add(lang)
+    return {word: langs.pop() for word, langs in owners.items() if len(langs) == 1}
+
+
+_MARKER_WORDS = _build_marker_words()
+
+
+def _script_of(ch: str) -> str:
+    code = ord(ch)
+    for start, end, script in _SCRIPT_RANGES:
+        if start <= code <= end:
+            return script
+    return 'other'
+
+
+@dataclass
+class LanguageDetection:
+    """Результат локального определения языка"""
+    language: str
+    confidence: float
+    method: str
+    escalate: bool = False
+
+
+class LanguageDetector:
+    """Определяет язык локально и решает, нужен ли запрос к Gemini"""
+
+    def __init__(self, threshold: float = LANGUAGE_DETECT_THRESHOLD):
+        self.threshold = threshold
+        self.latency = LatencyHistogram()
+        self._metrics = {
+            "detections": 0,
+            "resolved_locally": 0,
+            "escalated": 0,
+            "no_letters": 0
+        }
+        self._by_method: Counter = Counter()
+
+    def detect(self, text: str) -> LanguageDetection:
+        """Определяет язык текста; escalate=True - уверенности не хватает, нужен Gemini"""
+        started = time.perf_counter()
+        result = self._detect(text or '')
+        self.latency.record((time.perf_counter() - started) * 1000)
+
+        self._metrics["detections"] += 1
+        self._by_method[result.method] += 1
+        if result.method == 'none':
+            self._metrics["no_letters"] += 1
+        elif result.confidence >= self.threshold:
+            self._metrics["resolved_locally"] += 1
+        else:
+            result.escalate = True
+            self._metrics["escalated"] += 1
+        return result
+
+    def _detect(self, text: str) -> LanguageDetection:
+        scripts: Counter = Counter()
+        for ch in text:
+            if ch.isalpha():
+                scripts[_script_of(ch)] += 1
+        letters = sum(scripts.values())
+        if not letters:
+            return LanguageDetection('auto', 0.0, 'none')
+
+        script, count = scripts.most_common(1)[0]
+        share = count / letters
+
+        if script in _SCRIPT_LANGUAGE:
+            language = _SCRIPT_LANGUAGE[script]
+            # Кана вместе с иероглифами - японский
+            if script == 'han' and scripts.get('kana'):
+                language = 'ja'
+            confidence = 0.99 * share
+            ambiguous = _AMBIGUOUS_LETTERS.get(script)
+            if ambiguous and any(ch in ambiguous for ch in text.lower()):
+                confidence = min(confidence, 0.5)
+            return LanguageDetection(language, round(confidence, 3), 'script')
+
+        if script == 'latin':
+            return self._detect_latin(text, share)
+
+        return LanguageDetection('auto', 0.0, 'unknown_script')
+
+    def _detect_latin(self, text: str, share: float) -> LanguageDetection:
+        lowered = text.lower()
+        unique = Counter(_UNIQUE_LATIN[ch] for ch in lowered if ch in _UNIQUE_LATIN)
+        if unique:
+            language = unique.most_common(1)[0][0]
+            confidence = 0.95 * share if len(unique) == 1 else 0.6
+            return LanguageDetection(language, round(confidence, 3), 'latin_letters')
+
+        words = _words(lowered)
+        trigrams = _word_trigrams(words)
+        if not trigrams:
+            return LanguageDetection('auto', 0.0, 'trigram')
+        scores = sorted(
+            ((sum(profile.get(t, 0.0) for t in trigrams), lang) for lang, profile in _PROFILES.items()),
+            reverse=True
+        )
+        best_score, language = scores[0]
+        second_score = scores[1][0]
+        if best_score <= 0:
+            return LanguageDetection('auto', 0.0, 'trigram')
+
+        # Уверенность - отрыв от второго кандидата, на коротких текстах ниже
+        margin = (best_score - second_score) / best_score
+        length_factor = min(1.0, len(trigrams) / 12)
+        confidence = (0.5 + 0.5 * margin) * length_factor * share
+
+        # Два и больше характерных слова только этого языка - уверенность высокая
+        votes = Counter(_MARKER_WORDS[w] for w in words if w in _MARKER_WORDS)
+        if votes.get(language, 0) >= 2 and len(votes) == 1:
+            confidence = max(confidence, 0.9 * share)
+        return LanguageDetection(language, round(confidence, 3), 'trigram')
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Возвращает долю определений без Gemini и задержку локального определения"""
+        detections = self._metrics["detections"]
+        return {
+            "threshold": self.threshold,
+            **self._metrics,
+            "escalation_rate": round(self._metrics["escalated"] / detections, 3) if detections else 0.0,
+            "by_method": dict(self._by_method),
+            "latency": self.latency.snapshot()
+        }
@@ -1,6 +1,7 @@
 import asyncio
 import logging
-from typing import List, Optional, Tuple, Dict, Any
+import uuid
+from typing import List, Optional, Tuple, Dict, Any, TYPE_CHECKING
 from dataclasses import dataclass
 from datetime import datetime
 
@@ -15,10 +16,15 @@ from src.services.session_service import SessionService
 from src.services.user_service import UserService
 from src.services.command_service import CommandService
 from src.services.error_service import ErrorService
+from src.services.translation_enrichment import TranslationJob, TRANSLATION_PENDING
+from src.services.turn_context import TurnContext, TurnContextLoader
 from src.utils.waba_logger import waba_logger
-from src.models.user import User, UserStatus
+from src.utils.ai_utils import AI_COMMAND_TYPES
 from src.config.settings import GEMINI_API_KEY
 
+if TYPE_CHECKING:
+    from src.services.container import ServiceContainer
+
 @dataclass
 class AIResponse:
     """Ответ от AI с текстом и командой"""
@@ -30,15 +36,24 @@ class AIResponse:
 class MessageProcessor:
     """Упрощенный процессор сообщений - единая точка обработки"""
     
-    SUPPORTED_COMMANDS = {
-        'send_catalog',
-        'save_order_info',
-        'add_order_item',
-        'remove_order_item',
-        'confirm_order',
-    }
+    SUPPORTED_COMMANDS = set(AI_COMMAND_TYPES)
     
-    def __init__(self):
+    def __init__(self, services: Optional["ServiceContainer"] = None):
+        if services is not None:
+            # Общие экземпляры сервисов приложения
+            self.whatsapp_client = services.whatsapp_client
+            self.message_service = services.message_service
+            self.session_service = services.session_service
+            self.user_service = services.user_service
+            self.ai_service = services.ai_service
+            self.command_service = services.command_service
+            self.error_service = services.error_service
+            self.order_service = services.order_service
+            self.translation_worker = services.translation_worker
+            self.summarizer = services.conversation_summarizer
+            self.turn_loader = services.turn_loader
+            return
+        
         self.whatsapp_client = WhatsAppClient()
         self.message_service = MessageService()
         self.session_service = SessionService()
@@ -46,31 +61,50 @@ class MessageProcessor:
         self.ai_service = AIService(GEMINI_API_KEY)
         self.command_service = CommandService()
         self.error_service = ErrorService()
+        self.order_service = self.command_service.order_service
+        self.translation_worker = None
+        self.summarizer = None
+        self.turn_loader = TurnContextLoader(self.session_service.db, self.session_service)
 
-    @log_function("message_processor")
     async def process_user_message(self, message_data: Dict[str, Any]) -> bool:
+        """Обрабатывает одно сообщение пользователя"""
+        return await self.process_user_messages([message_data])
+
+    @log_function("message_processor")
+    async def process_user_messages(self, messages: List[Dict[str, Any]]) -> bool:
         """
-        Основной метод обработки сообщения пользователя.
+        Основной метод обработки сообщений пользователя.
+        Принимает пачку подряд идущих сообщений одного отправителя: все сообщения
+        сохраняются в историю, а ответ AI генерируется один раз на всю пачку.
         Простая последовательность: статусы → сохранить → AI → команда → отправить
         """
+        if len(messages) > 1 and any(self._is_newses_command(m) for m in messages):
+            # Служебные команды меняют сессию - такие пачки обрабатываем по одному сообщению
+            results = [await self.process_user_messages([m]) for m in messages]
+            return all(results)
+        
+        # Основным считается последнее сообщение пачки
+        message_data = messages[-1]
+        ctx = None
         try:
             sender_id = message_data['sender_id']
-            message_text = message_data['message_text']
             sender_name = message_data.get('sender_name')
             wamid = message_data.get('wa_message_id')
             
-            # Логирование входящего сообщения
-            print(f"\n[INCOMING] 👤 {sender_name}: {message_text}")
-            if wamid:
-                waba_logger.log_ai_processing(wamid, sender_id, message_text)
-            
-            # 0. Отправляем статусы (прочитано + печатает)
-            if wamid:
-                await self._send_status_updates(wamid, sender_id)
-            
-            # 1. Получаем сессию и пользователя
-            session_id = await self.session_service.get_or_create_session_id(sender_id)
-            await self._ensure_user_exists(sender_id, sender_name)
+            for msg in messages:
+                # Логирование входящего сообщения
+                print(f"\n[INCOMING] 👤 {sender_name}: {msg['message_text']}")
+                if msg.get('wa_message_id'):
+                    waba_logger.log_ai_processing(msg['wa_message_id'], sender_id, msg['message_text'])
+                
+                # 0. Отправляем статусы (прочитано + печатает)
+                if msg.get('wa_message_id'):
+                    await self._send_status_updates(msg['wa_message_id'], sender_id)
+            
+            # 1. Получаем сессию, пользователя и заказ (одно чтение Firestore на ход)
+            ctx = await self.turn_loader.load(sender_id)
+            session_id = ctx.session_id
+            ctx.ensure_user(sender_name)
 
             # Сохраняем имя и телефон заказчика в заказ (если есть)
             customer_data = {}
@@ -82,19 +116,37 @@ class MessageProcessor:
                 customer_data['customer_phone'] = sender_id
             
             if customer_data:
-                from src.services.order_service import OrderService
-                order_service = OrderService()
-                await order_service.update_order_data(session_id, sender_id, customer_data)
+                ctx.update_order(customer_data)
+            if ctx.session_pending or ctx.order_pending:
+                # Новую сессию записываем в users до сохранения сообщений и вызова AI,
+                # иначе при сбое записи следующий ход начнет еще одну сессию. Черновик
+                # нового заказа пишется тем же batch'ем до команд AI, меняющих товары и статус
+                await ctx.flush()
+            for msg in messages:
+                if msg.get('timestamp'):
+                    ctx.record_inbound(int(msg['timestamp']), msg.get('wa_message_id'))
             
             # 2. Специальные команды
-            if message_text.strip().lower() == '/newses':
-                return await self._handle_newses_command(sender_id, session_id)
-            
-            # 3. Сохраняем сообщение пользователя
-            user_message = self._create_user_message(message_data, session_id)
-            success, _ = self.message_service.add_message_with_transaction_sync(user_message, limit=10)
-            if not success:
-                return False
+            if self._is_newses_command(message_data):
+                return await self._handle_newses_command(sender_id, session_id, ctx)
+            
+            # 3. Сохраняем сообщения пользователя (в порядке поступления)
+            user_lang = ctx.user_language
+            for msg in messages:
+                user_message = await self._create_user_message(msg, session_id, user_lang, ctx)
+                # История из транзакции не используется - сохраняем без ее чтения
+                success, _ = self.message_service.add_message_with_transaction_sync(user_message, limit=0)
+                if not success:
+                    return False
+                if user_message.translation_status == TRANSLATION_PENDING:
+                    # Переводы для CRM дописываются в фоне, ответ их не ждет
+                    self.translation_worker.submit(TranslationJob(
+                        sender_id=sender_id,
+                        session_id=session_id,
+                        message_id=user_message.wa_message_id or user_message.id,
+                        text=user_message.content,
+                        user_lang=user_lang or 'auto'
+                    ))
             
             # 4. Получаем историю и обрабатываем через AI
             conversation_history = await self.message_service.get_conversation_history_for_ai_by_sender(
@@ -104,12 +156,17 @@ class MessageProcessor:
             # Логирование истории для AI
             print(f"[HISTORY] Получено {len(conversation_history)} сообщений")
             
-            # 5. Генерируем ответ AI
-            ai_response = await self._process_ai(message_data, session_id, conversation_history)
+            # 5. Генерируем один ответ AI на всю пачку
+            ai_input = self._merge_messages(messages) if len(messages) > 1 else message_data
+            ai_response = await self._process_ai(ai_input, session_id, conversation_history, ctx)
             
             # 6. Отправляем ответ пользователю (НЕ отправляем fallback при ошибках)
             await self._send_ai_response(ai_response, sender_id, session_id, wamid, 0)
             
+            # 7. Длинная история сворачивается в краткое содержание в фоне
+            if self.summarizer is not None:
+                self.summarizer.schedule_compaction(sender_id, session_id, conversation_history)
+            
             # Логирование результата
             print(f"[SUCCESS] ✅ Ответ обработан")
             
@@ -124,37 +181,57 @@ class MessageProcessor:
                 error=e,
                 sender_id=message_data.get('sender_id'),
                 session_id=session_id if 'session_id' in locals() else None,
-                context_data={"message_data": message_data, "wamid": wamid},
+                context_data={"message_data": message_data, "wamid": wamid, "batch_size": len(messages)},
                 module="message_processor",
                 function="process_user_message"
             )
             return True  # Возвращаем True, чтобы не отправлять fallback
+        finally:
+            # Имя, сессия, язык и данные заказчика записываются одним коммитом;
+            # ошибка записи пробрасывается - пачка считается необработанной
+            if ctx is not None:
+                await ctx.flush()
 
-    async def _ensure_user_exists(self, sender_id: str, sender_name: str):
-        """Создает пользователя если не существует"""
-        user = await self.user_service.get_user(sender_id)
-        if not user:
-            user = User(
-                sender_id=sender_id,
-                name=sender_name or "Unknown",
-                language="auto",  # Язык будет определяться в сессии
-                status=UserStatus.ACTIVE
-            )
-            await self.user_service.create_user(user)
+    @staticmethod
+    def _is_newses_command(message_data: Dict[str, Any]) -> bool:
+        """Проверяет, является ли сообщение командой /newses"""
+        return (message_data.get('message_text') or '').strip().lower() == '/newses'
 
-    def _create_user_message(self, message_data: dict, session_id: str) -> Message:
+    @staticmethod
+    def _merge_messages(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Объединяет пачку сообщений в одно для определения языка и генерации ответа"""
+        merged = dict(messages[-1])
+        merged['message_text'] = "\n".join(m['message_text'] for m in messages if m.get('message_text'))
+        return merged
+
+    async def _create_user_message(self, message_data: dict, session_id: str, user_lang: Optional[str] = None,
+                                   ctx: Optional[TurnContext] = None) -> Message:
         """Создает объект сообщения пользователя"""
-        # Определяем язык и переводим
-        user_lang = self.session_service.get_user_language_sync(message_data['sender_id'], session_id)
-        if user_lang == 'auto' or not user_lang:
-            user_lang = self.ai_service.detect_language(message_data['message_text'])
-            self.session_service.save_user_language_sync(message_data['sender_id'], session_id, user_lang)
-        
-        text, text_en, text_thai = self.ai_service.translate_user_message(message_data['message_text'], user_lang)
+        translation_status = None
+        message_id = None
+        if self.translation_worker is not None and self.translation_worker.is_running:
+            # Перевод на en/th не нужен для ответа - сохраняем оригинал, переводы допишет воркер
+            text, text_en, text_thai = message_data['message_text'], None, None
+            translation_status = TRANSLATION_PENDING
+            message_id = message_data.get('wa_message_id') or uuid.uuid4().hex
+        else:
+            # Определение языка и перевод на en/th - один запрос к AI
+            if user_lang is None:
+                user_lang = self.session_service.get_user_language_sync(message_data['sender_id'], session_id)
+            translation = await self.ai_service.detect_and_translate(message_data['message_text'], user_lang or 'auto')
+            if user_lang == 'auto' or not user_lang:
+                if ctx is not None:
+                    ctx.set_user_language(translation['language'])
+                else:
+                    self.session_service.save_user_language_sync(message_data['sender_id'], session_id, translation['language'])
+            text, text_en, text_thai = translation['text'], translation['text_en'], translation['text_thai']
         
         # Сохраняем имя пользователя
         if message_data.get('sender_name'):
-            self.session_service.save_user_info_sync(message_data['sender_id'], message_data['sender_name'])
+            if ctx is not None:
+                ctx.set_user_name(message_data['sender_name'])
+            else:
+                self.session_service.save_user_info_sync(message_data['sender_id'], message_data['sender_name'])
         
         return Message(
             sender_id=message_data['sender_id'],
@@ -168,7 +245,9 @@ class MessageProcessor:
             image_url=message_data.get('image_url'),
             audio_url=message_data.get('audio_url'),
             audio_duration=message_data.get('audio_duration'),
-            transcription=message_data.get('transcription')
+            transcription=message_data.get('transcription'),
+            id=message_id,
+            translation_status=translation_status
         )
 
     def _create_ai_message(self, ai_response: AIResponse, sender_id: str, session_id: str) -> Message:
@@ -189,9 +268,18 @@ class MessageProcessor:
             timestamp=datetime.now()
         )
 
-    async def _process_ai(self, message_data: Dict[str, Any], session_id: str, conversation_history: List[Dict]) -> AIResponse:
+    async def _process_ai(self, message_data: Dict[str, Any], session_id: str, conversation_history: List[Dict],
+                          ctx: Optional[TurnContext] = None) -> AIResponse:
         """Обрабатывает сообщение через AI"""
         try:
+            # Ранняя часть длинного диалога заменяется кратким содержанием
+            summary = None
+            if self.summarizer is not None:
+                summary, conversation_history = await self.summarizer.prepare(
+                    message_data['sender_id'], session_id, conversation_history,
+                    summary_state=ctx.summary_state() if ctx is not None else None
+                )
+            
             # Конвертируем историю в объекты Message
             ai_messages = []
             for msg_dict in conversation_history:
@@ -206,18 +294,24 @@ class MessageProcessor:
                 ai_messages.append(message)
             
             # Получаем язык пользователя
-            user_lang = await self.session_service.get_user_language(message_data['sender_id'], session_id)
+            if ctx is not None:
+                user_lang = ctx.user_language
+            else:
+                user_lang = await self.session_service.get_user_language(message_data['sender_id'], session_id)
             
             # Проверяем, нужно ли определить язык
             if user_lang == 'auto' or not user_lang:
-                detection_result = self.ai_service.detect_language_with_confidence(message_data['message_text'])
+                detection_result = await self.ai_service.detect_language_with_confidence(message_data['message_text'])
                 detected_lang = detection_result['language']
                 confidence = detection_result['confidence']
                 should_ask = detection_result['should_ask']
                 
                 if detected_lang != 'auto':
                     # Сохраняем определенный язык
-                    await self.session_service.save_user_language(message_data['sender_id'], session_id, detected_lang)
+                    if ctx is not None:
+                        ctx.set_user_language(detected_lang)
+                    else:
+                        await self.session_service.save_user_language(message_data['sender_id'], session_id, detected_lang)
                     user_lang = detected_lang
                     
                     # Логируем результат определения языка
@@ -234,14 +328,16 @@ class MessageProcessor:
                         )
             
             # Определяем, является ли это первым сообщением в диалоге
-            is_first_message = len(conversation_history) <= 1
+            is_first_message = len(conversation_history) <= 1 and not summary
             
             # Генерируем ответ AI
             ai_text, ai_text_en, ai_text_thai, ai_command = await self.ai_service.generate_response(
                 ai_messages,
                 user_lang=user_lang,
                 sender_name=message_data.get('sender_name'),
-                is_first_message=is_first_message
+                is_first_message=is_first_message,
+                summary=summary,
+                order_data=ctx.order_data() if ctx is not None else None
             )
             
             return AIResponse(ai_text, ai_text_en, ai_text_thai, ai_command)
@@ -329,21 +425,10 @@ class MessageProcessor:
                         module="message_processor",
                         function="_send_ai_response"
                     )
-                    # Повторно отправляем запрос к AI при ошибке парсинга команды
-                    if retry_count < 3:
-                        logger.warning(f"Unknown command '{command_type}' from AI, retrying... (attempt {retry_count + 1})")
-                        # Получаем историю сообщений для повторного запроса
-                        conversation_history = await self.message_service.get_conversation_history_for_ai_by_sender(sender_id, session_id, limit=100)
-                        # Повторно обрабатываем через AI
-                        new_ai_response = await self._process_ai(
-                            {"sender_id": sender_id, "message_text": conversation_history[-1].get('content', '') if conversation_history else ""},
-                            session_id,
-                            conversation_history
-                        )
-                        return await self._send_ai_response(new_ai_response, sender_id, session_id, wamid, retry_count + 1)
-                    else:
-                        logger.error(f"Max retries reached for unknown command: {command_type}")
-                        return True  # Возвращаем True, чтобы не отправлять fallback
+                    # Текст уже отправлен; повторный запрос к AI продублировал бы сообщение.
+                    # Типы команд проверяются по схеме ответа в AIService, сюда попадать не должны
+                    logger.error(f"Unknown command from AI, skipped: {command_type}")
+                    return True  # Возвращаем True, чтобы не отправлять fallback
                 
                 command_result = await self._handle_ai_command(ai_response.command, session_id, sender_id, wamid)
                 
@@ -452,11 +537,8 @@ class MessageProcessor:
     async def _send_text_message(self, to_number: str, content: str, session_id: str, content_en: str = None, content_thai: str = None) -> bool:
         """Отправляет текстовое сообщение"""
         try:
-            # Получаем язык пользователя
-            user_lang = await self.session_service.get_user_language(to_number, session_id)
-            
             # Логирование отправки
-            print(f"[SEND] Отправляем пользователю {to_number}: {content[:100]}... (lang={user_lang})")
+            print(f"[SEND] Отправляем пользователю {to_number}: {content[:100]}...")
             
             # Отправляем через WhatsApp (эмодзи добавляется автоматически)
             message_id = await self.whatsapp_client.send_text_message(to_number, content, session_id)
@@ -486,11 +568,25 @@ class MessageProcessor:
             logging.error(f"[MESSAGE_PROCESSOR] Send text error: {e}")
             return False
 
-    async def _handle_newses_command(self, sender_id: str, session_id: str) -> bool:
+    async def _handle_newses_command(self, sender_id: str, session_id: str, ctx: Optional[TurnContext] = None) -> bool:
         """Обрабатывает команду создания новой сессии"""
         try:
-            new_session_id = await self.session_service.create_new_session_after_order(sender_id)
-            user_lang = await self.session_service.get_user_language(sender_id, session_id)
+            if ctx is not None:
+                # Изменения старой сессии записываются до переключения, users - в конце хода
+                user_lang = ctx.user_language
+                await ctx.flush()
+                new_session_id = self.session_service.generate_session_id(sender_id)
+                ctx.start_session(new_session_id)
+                await ctx.flush()
+                self.turn_loader.remember_session(sender_id, new_session_id)
+                print(f"Created new session after order: {new_session_id} for {sender_id}")
+            else:
+                new_session_id = await self.session_service.create_new_session_after_order(sender_id)
+                user_lang = await self.session_service.get_user_language(sender_id, session_id)
+            self.message_service.invalidate_history(sender_id, session_id)
+            self.message_service.start_empty_history(sender_id, new_session_id)
+            if self.summarizer is not None:
+                self.summarizer.forget(sender_id, session_id)
             confirmation_messages = self._get_newses_messages(user_lang, new_session_id)
             return await self._send_text_message(sender_id, confirmation_messages['ru'], session_id, confirmation_messages['en'], confirmation_messages['th'])
         except Exception as e:
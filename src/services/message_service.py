@@ -2,7 +2,8 @@
 Сервис для работы с сообщениями
 """
 
-from src.repositories.message_repository import MessageRepository
+from src.repositories.message_repository import MessageRepository, HistoryCursor
+from src.services.history_cache import HistoryCache
 from src.models.message import Message
 from src.utils.logging_decorator import log_function
 from typing import List, Optional, Dict, Any, Tuple
@@ -10,9 +11,19 @@ from google.cloud import firestore
 from datetime import datetime
 
 class MessageService:
-    def __init__(self):
-        self.repo = MessageRepository()
-        self.db = self._get_firestore_client()
+    def __init__(self, db=None, history_cache: Optional[HistoryCache] = None):
+        self.db = db if db is not None else self._get_firestore_client()
+        self.repo = MessageRepository(self.db)
+        # История сессий в памяти: дописывается при каждой записи сообщения
+        self.history_cache = history_cache or HistoryCache()
+        # Откуда берется контекст ответа (reply) по wa_message_id
+        self._wamid_metrics = {
+            "lookups": 0,
+            "cache_hits": 0,
+            "index_hits": 0,
+            "session_scans": 0,
+            "not_found": 0
+        }
     
     def _get_firestore_client(self):
         """Получает клиент Firestore"""
@@ -35,6 +46,7 @@ class MessageService:
         try:
             success = await self.repo.add_message_to_conversation(message)
             if success:
+                self.history_cache.append(message)
                 print(f"Message added to conversation: {message.sender_id}/{message.session_id}")
                 return "success"
             else:
@@ -44,6 +56,19 @@ class MessageService:
             print(f"Error adding message to conversation: {e}")
             return None
 
+    @log_function("message_service")
+    async def add_messages_to_conversation(self, messages: List[Message]) -> bool:
+        """Сохраняет несколько сообщений одной сессии одной пакетной записью"""
+        try:
+            success = await self.repo.add_messages_batch(messages)
+            if success:
+                for message in messages:
+                    self.history_cache.append(message)
+            return success
+        except Exception as e:
+            print(f"Error adding messages batch to conversation: {e}")
+            return False
+
     @log_function("message_service")
     async def add_message_with_transaction(self, message: Message, limit: int = 10) -> Tuple[bool, List[Dict[str, Any]]]:
         """
@@ -60,6 +85,7 @@ class MessageService:
         try:
             success, history = await self.repo.add_message_with_transaction(message, limit)
             if success:
+                self.history_cache.append(message)
                 print(f"Message added with transaction: {message.sender_id}/{message.session_id}")
                 print(f"Retrieved {len(history)} messages in transaction")
             else:
@@ -106,15 +132,28 @@ class MessageService:
         Получает историю диалога по sender_id и session_id.
         Использует репозиторий для работы с БД.
         """
+        cached = self.history_cache.get(sender_id, session_id, limit)
+        if cached is not None:
+            return cached
         try:
             history = await self.repo.get_conversation_history_by_sender(sender_id, session_id, limit=limit)
             print(f"Retrieved {len(history)} messages for sender {sender_id}, session {session_id}")
+            # Прочитано меньше limit - в кэше вся сессия, иначе ее последние сообщения
+            self.history_cache.fill(sender_id, session_id, history, complete=len(history) < limit)
             return history
             
         except Exception as e:
             print(f"Error getting conversation history: {e}")
             return []
 
+    async def get_history_page(self, sender_id: str, session_id: str, limit: int = 50,
+                               before: Optional[HistoryCursor] = None) -> Tuple[List[Dict[str, Any]], Optional[HistoryCursor]]:
+        """
+        Страница истории: последние limit сообщений до курсора before (время и ID документа).
+        Возвращает (сообщения по возрастанию времени, курсор следующей страницы или None).
+        """
+        return await self.repo.get_history_window(sender_id, session_id, limit, before)
+
     async def get_messages_for_session(self, session_id: str, limit: int = 100) -> List[Dict[str, Any]]:
         """
         Получает сообщения для сессии (для совместимости с message_processor).
@@ -127,8 +166,9 @@ class MessageService:
     
     async def get_message_by_wa_id(self, sender_id: str, session_id: str, wa_message_id: str) -> Optional[Dict[str, Any]]:
         """
-        Получает сообщение по WhatsApp message ID.
-        Ищет во всех сессиях пользователя, а не только в текущей.
+        Получает сообщение по WhatsApp message ID среди всех сессий пользователя.
+        Порядок: кэш истории -> wamid_index (одно чтение) -> обход сессий
+        (для сообщений, сохраненных до появления индекса; найденное дописывается в индекс).
         
         Args:
             sender_id: ID пользователя
@@ -138,18 +178,33 @@ class MessageService:
         Returns:
             Dict с данными сообщения или None
         """
+        self._wamid_metrics["lookups"] += 1
+        # Обычно отвечают на недавнее сообщение - оно уже в кэше истории
+        cached = self.history_cache.find_message(sender_id, wa_message_id)
+        if cached is not None:
+            self._wamid_metrics["cache_hits"] += 1
+            return cached
         try:
-            print(f"[WAID_SEARCH] Начинаем поиск wa_id {wa_message_id} для пользователя {sender_id}")
-            
-            # Используем новый метод из репозитория с передачей SessionService
+            message = await self.repo.get_message_by_wa_id_indexed(sender_id, wa_message_id)
+            if message:
+                self._wamid_metrics["index_hits"] += 1
+                return message
+
+            print(f"[WAID_SEARCH] wa_id {wa_message_id} нет в индексе, ищем по сессиям пользователя {sender_id}")
+            self._wamid_metrics["session_scans"] += 1
             from src.services.session_service import SessionService
-            session_service = SessionService()
+            session_service = SessionService(self.db)
             message = await self.repo.get_message_by_wa_id(sender_id, wa_message_id, session_service)
             
             if message:
                 print(f"[WAID_SEARCH] НАЙДЕНО! wa_id {wa_message_id} в сессии {message.get('session_id')}")
+                try:
+                    await self.repo.backfill_wamid_index(sender_id, message)
+                except Exception as e:
+                    print(f"[WAID_SEARCH] Не удалось дописать wamid_index: {e}")
                 return message
             else:
+                self._wamid_metrics["not_found"] += 1
                 print(f"[WAID_SEARCH] Message with wa_id {wa_message_id} not found for user {sender_id}")
                 return None
                 
@@ -157,12 +212,47 @@ class MessageService:
             print(f"[WAID_SEARCH] Error getting message by wa_id: {e}")
             return None
 
+    def get_wamid_metrics(self) -> Dict[str, Any]:
+        """Попадания в кэш/индекс и обходы сессий при поиске контекста ответа"""
+        return dict(self._wamid_metrics)
+
     def add_message_with_transaction_sync(self, message, limit=10):
         """
         Сохраняет сообщение и возвращает историю диалога через sync-транзакцию Firestore.
+        limit=0 - сохранить без чтения истории.
         """
-        return self.repo.add_message_with_transaction_sync(message, limit)
+        success, history = self.repo.add_message_with_transaction_sync(message, limit)
+        if success:
+            self.history_cache.append(message)
+        return success, history
 
     def add_user_and_ai_messages_with_transaction_sync(self, user_message: Message, ai_message: Message, limit: int = 10):
         """Сохраняет сообщение пользователя и AI в одной транзакции"""
-        return self.repo.add_user_and_ai_messages_with_transaction_sync(user_message, ai_message, limit) 
\ No newline at end of file
+        success, history = self.repo.add_user_and_ai_messages_with_transaction_sync(user_message, ai_message, limit)
+        if success:
+            self.history_cache.append(user_message)
+            self.history_cache.append(ai_message)
+        return success, history
+
+    async def update_message_translations(self, sender_id: str, session_id: str, message_id: str,
+                                          content_en: Optional[str], content_thai: Optional[str],
+                                          status: str) -> bool:
+        """Дописывает переводы в сообщение (в Firestore и в кэше истории)"""
+        success = await self.repo.update_message_translations(
+            sender_id, session_id, message_id, content_en, content_thai, status
+        )
+        fields = {'translation_status': status}
+        if content_en is not None:
+            fields['content_en'] = content_en
+        if content_thai is not None:
+            fields['content_thai'] = content_thai
+        self.history_cache.update(sender_id, session_id, message_id, fields)
+        return success
+
+    def invalidate_history(self, sender_id: str, session_id: str):
+        """Сбрасывает кэш истории сессии (например, по /newses)"""
+        self.history_cache.invalidate(sender_id, session_id)
+
+    def start_empty_history(self, sender_id: str, session_id: str):
+        """Новая сессия пуста - первое чтение ее истории не пойдет в Firestore"""
+        self.history_cache.fill(sender_id, session_id, [], complete=True) 
\ No newline at end of file
@@ -0,0 +1,145 @@
+"""
+Реестр моделей Gemini по задачам.
+
+Каждой задаче (ответ бота, перевод, определение языка, проверка здоровья)
+соответствует своя модель, конфигурация генерации, таймаут и пул
+одновременных запросов в GeminiClient. Объекты GenerativeModel создаются
+один раз при первом обращении и переиспользуются, поэтому дешевые задачи
+можно перевести на быструю модель, не трогая модель диалога.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+import google.generativeai as genai
+from google.generativeai import GenerationConfig
+from google.generativeai.types import HarmCategory, HarmBlockThreshold
+from src.utils.ai_utils import AI_RESPONSE_SCHEMA
+from src.config.settings import (
+    CHAT_MODEL, TRANSLATION_MODEL, LANGUAGE_DETECT_MODEL, SUMMARY_MODEL, HEALTH_MODEL,
+    GEMINI_MAX_CONCURRENCY, GEMINI_AUX_CONCURRENCY, GEMINI_TIMEOUT, GEMINI_AUX_TIMEOUT
+)
+
+# Ответы модели не блокируются фильтрами (клиенты пишут о чем угодно)
+SAFETY_OFF = {
+    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+}
+
+
+@dataclass
+class ModelSpec:
+    """Настройки модели для одной задачи"""
+    model_name: str
+    generation_config: Dict[str, Any]
+    timeout: float
+    max_concurrency: int
+    safety_off: bool = True
+    pool: Optional[str] = None  # Имя пула в GeminiClient; по умолчанию - имя задачи
+
+
+def default_specs() -> Dict[str, ModelSpec]:
+    """Задачи бота и их модели (имена моделей задаются переменными окружения)"""
+    return {
+        "chat": ModelSpec(
+            model_name=CHAT_MODEL,
+            generation_config={"temperature": 0.7, "top_p": 0.9, "top_k": 40, "max_output_tokens": 8192,
+                               "response_mime_type": "application/json", "response_schema": AI_RESPONSE_SCHEMA},
+            timeout=GEMINI_TIMEOUT,
+            max_concurrency=GEMINI_MAX_CONCURRENCY
+        ),
+        "translate": ModelSpec(
+            model_name=TRANSLATION_MODEL,
+            generation_config={"temperature": 0.1, "top_p": 1, "top_k": 1, "max_output_tokens": 4096},
+            timeout=GEMINI_AUX_TIMEOUT,
+            max_concurrency=GEMINI_AUX_CONCURRENCY,
+            pool="aux"
+        ),
+        "detect_translate": ModelSpec(
+            model_name=TRANSLATION_MODEL,
+            generation_config={"temperature": 0.1, "top_p": 1, "top_k": 1, "max_output_tokens": 4096,
+                               "response_mime_type": "application/json"},
+            timeout=GEMINI_AUX_TIMEOUT,
+            max_concurrency=GEMINI_AUX_CONCURRENCY,
+            pool="aux"
+        ),
+        "detect": ModelSpec(
+            model_name=LANGUAGE_DETECT_MODEL,
+            generation_config={"temperature": 0.1, "top_p": 1, "top_k": 1, "max_output_tokens": 200,
+                               "response_mime_type": "application/json"},
+            timeout=GEMINI_AUX_TIMEOUT,
+            max_concurrency=GEMINI_AUX_CONCURRENCY,
+            pool="aux"
+        ),
+        "summarize": ModelSpec(
+            model_name=SUMMARY_MODEL,
+            generation_config={"temperature": 0.2, "top_p": 1, "top_k": 1, "max_output_tokens": 1024},
+            timeout=GEMINI_AUX_TIMEOUT,
+            max_concurrency=GEMINI_AUX_CONCURRENCY,
+            pool="aux"
+        ),
+        "health": ModelSpec(
+            model_name=HEALTH_MODEL,
+            generation_config={"temperature": 0.0, "max_output_tokens": 10},
+            timeout=10.0,
+            max_concurrency=1,
+            safety_off=False
+        ),
+    }
+
+
+class ModelRegistry:
+    """Создает модели задач один раз и отдает их вместе с настройками"""
+
+    def __init__(self, specs: Optional[Dict[str, ModelSpec]] = None):
+        self.specs = specs or default_specs()
+        self._models: Dict[str, Any] = {}
+
+    def spec(self, task: str) -> ModelSpec:
+        if task not in self.specs:
+            raise KeyError(f"Unknown Gemini task: {task}")
+        return self.specs[task]
+
+    def pool(self, task: str) -> str:
+        """Пул одновременных запросов задачи в GeminiClient"""
+        return self.spec(task).pool or task
+
+    def pool_limits(self) -> Dict[str, int]:
+        """Лимиты пулов для GeminiClient (у общего пула - минимальный из заданных)"""
+        limits: Dict[str, int] = {}
+        for task, spec in self.specs.items():
+            pool = spec.pool or task
+            limits[pool] = min(limits.get(pool, spec.max_concurrency), spec.max_concurrency)
+        return limits
+
+    def model(self, task: str):
+        """Возвращает GenerativeModel задачи (создается при первом обращении)"""
+        model = self._models.get(task)
+        if model is None:
+            spec = self.spec(task)
+            model = genai.GenerativeModel(
+                model_name=spec.model_name,
+                generation_config=GenerationConfig(**spec.generation_config),
+                safety_settings=SAFETY_OFF if spec.safety_off else None
+            )
+            self._models[task] = model
+        return model
+
+    def set_model(self, task: str, model):
+        """Подменяет модель задачи (бенчмарки, тесты)"""
+        self.spec(task)
+        self._models[task] = model
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Возвращает модель, таймаут и пул каждой задачи"""
+        return {
+            task: {
+                "model": spec.model_name,
+                "timeout_sec": spec.timeout,
+                "pool": spec.pool or task,
+                "max_concurrency": spec.max_concurrency,
+                "loaded": task in self._models
+            }
+            for task, spec in self.specs.items()
+        }
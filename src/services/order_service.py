@@ -1,5 +1,10 @@
 """
 Сервис для работы с заказами (один заказ на сессию с несколькими товарами)
+
+Изменения заказа записываются по полям: новые значения сравниваются с
+прочитанным заказом, в update уходят только изменившиеся поля, товары
+добавляются через ArrayUnion, а удаляются по product_id в транзакции.
+Если ничего не изменилось, запись пропускается.
 """
 
 from src.utils.logging_decorator import log_function
@@ -7,10 +12,41 @@ from src.repositories.order_repository import OrderRepository
 from src.models.order import Order, OrderItem, OrderStatus
 from typing import List, Optional, Dict, Any
 from datetime import datetime
+from google.cloud import firestore
+
+# Общие поля заказа (не товары), которые можно менять командами и данными WABA
+GENERAL_FIELDS = ['date', 'time', 'delivery_needed', 'address', 'card_needed',
+                  'card_text', 'recipient_name', 'recipient_phone', 'customer_name', 'customer_phone']
+
+
+def changed_fields(order: Optional[Order], fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Поля, значения которых отличаются от заказа (для несуществующего заказа - все)"""
+    if order is None:
+        return dict(fields)
+    return {name: value for name, value in fields.items() if getattr(order, name, None) != value}
+
 
 class OrderService:
-    def __init__(self):
-        self.repo = OrderRepository()
+    def __init__(self, db=None):
+        self.repo = OrderRepository(db)
+        self._metrics = {
+            "writes": 0,
+            "creates": 0,
+            "fields_written": 0,
+            "skipped_writes": 0
+        }
+
+    async def _write_fields(self, order: Order, fields: Dict[str, Any]) -> bool:
+        """Записывает изменившиеся поля заказа вместе с updated_at"""
+        order.updated_at = datetime.now()
+        fields = {**fields, 'updated_at': order.updated_at.isoformat()}
+        self._metrics["writes"] += 1
+        self._metrics["fields_written"] += len(fields)
+        return await self.repo.update_order_fields(order.sender_id, order.session_id, fields)
+
+    def _skip_write(self, order: Order):
+        self._metrics["skipped_writes"] += 1
+        print(f"[ORDER] Заказ {order.sender_id}/{order.session_id} не изменился, запись пропущена")
 
     @log_function("order_service")
     async def get_or_create_order(self, session_id: str, sender_id: str) -> Order:
@@ -40,19 +76,27 @@ class OrderService:
         Обновляет данные заказа (доставка, получатель и т.д.).
         Возвращает order_id.
         """
-        order = await self.get_or_create_order(session_id, sender_id)
-        
         # Обновляем только общие поля (не товары)
-        general_fields = ['date', 'time', 'delivery_needed', 'address', 'card_needed', 
-                         'card_text', 'recipient_name', 'recipient_phone', 'customer_name', 'customer_phone']
-        
-        for field in general_fields:
-            if field in order_data:
-                setattr(order, field, order_data[field])
+        fields = {field: order_data[field] for field in GENERAL_FIELDS if field in order_data}
+        
+        order = await self.repo.get_order_by_session(sender_id, session_id)
+        if order is None:
+            # Новый заказ создается сразу с данными - одна запись вместо создания и обновления
+            order = Order(order_id=session_id, session_id=session_id, sender_id=sender_id, status=OrderStatus.DRAFT)
+            for field, value in fields.items():
+                setattr(order, field, value)
+            await self.repo.create_order_for_session(order)
+            self._metrics["creates"] += 1
+            return order.order_id
         
-        order.updated_at = datetime.now()
+        changes = changed_fields(order, fields)
+        if not changes:
+            self._skip_write(order)
+            return order.order_id
         
-        await self.repo.update_order_by_session(sender_id, session_id, order)
+        for field, value in changes.items():
+            setattr(order, field, value)
+        await self._write_fields(order, changes)
         return order.order_id
 
     @log_function("order_service")
@@ -72,11 +116,15 @@ class OrderService:
             price=item_data.get('price'),
             notes=item_data.get('notes')
         )
+        # ArrayUnion не добавит точную копию уже существующего товара - тогда пишем список целиком
+        duplicate = any(existing.to_dict() == item.to_dict() for existing in order.items)
         order.items.append(item)
         print(f"Added new item {product_id}: {item_data['bouquet']}")
         
-        order.updated_at = datetime.now()
-        await self.repo.update_order_by_session(sender_id, session_id, order)
+        if duplicate:
+            await self._write_fields(order, {'items': [i.to_dict() for i in order.items]})
+        else:
+            await self._write_fields(order, {'items': firestore.ArrayUnion([item.to_dict()])})
         return order.order_id
 
     async def update_order_item(self, session_id: str, sender_id: str, item_data: Dict[str, Any]) -> str:
@@ -100,6 +148,7 @@ class OrderService:
         
         if existing_item:
             # Обновляем существующий товар
+            before = existing_item.to_dict()
             existing_item.bouquet = item_data['bouquet']
             existing_item.quantity = item_data.get('quantity', 1)
             if 'price' in item_data:
@@ -111,8 +160,11 @@ class OrderService:
             # Товар не найден, добавляем новый
             return await self.add_item(session_id, sender_id, item_data)
         
-        order.updated_at = datetime.now()
-        await self.repo.update_order_by_session(sender_id, session_id, order)
+        if existing_item.to_dict() == before:
+            self._skip_write(order)
+            return order.order_id
+        # Элемент массива нельзя изменить на месте - переписываем только поле items
+        await self._write_fields(order, {'items': [item.to_dict() for item in order.items]})
         return order.order_id
 
     async def remove_item(self, session_id: str, sender_id: str, product_id: str) -> bool:
@@ -121,14 +173,17 @@ class OrderService:
         """
         order = await self.get_or_create_order(session_id, sender_id)
         
-        original_count = len(order.items)
+        if not any(item.product_id == product_id for item in order.items):
+            return False
         order.items = [item for item in order.items if item.product_id != product_id]
-        
-        if len(order.items) < original_count:
-            order.updated_at = datetime.now()
-            await self.repo.update_order_by_session(sender_id, session_id, order)
-            return True
-        return False
+        order.updated_at = datetime.now()
+        self._metrics["writes"] += 1
+        self._metrics["fields_written"] += 2
+        # Удаление по product_id в транзакции: результат подтверждает, что товар действительно удален
+        removed = await self.repo.remove_items_by_product_id(
+            sender_id, session_id, product_id, order.updated_at.isoformat()
+        )
+        return removed > 0
 
 
 
@@ -138,12 +193,36 @@ class OrderService:
         Обновляет статус заказа.
         """
         order = await self.get_or_create_order(session_id, sender_id)
+        if order.status == status:
+            self._skip_write(order)
+            return True
         order.status = status
-        order.updated_at = datetime.now()
-        
-        await self.repo.update_order_by_session(sender_id, session_id, order)
+        await self._write_fields(order, {'status': status.value})
         return True
 
+    @staticmethod
+    def order_to_data(order: Order) -> Dict[str, Any]:
+        """Данные заказа в формате get_order_data"""
+        items = [item.to_dict() for item in order.items] if isinstance(order.items, list) else []
+        return {
+            'order_id': order.order_id,
+            'sender_id': order.sender_id,
+            'status': order.status.value,
+            'date': order.date,
+            'time': order.time,
+            'delivery_needed': order.delivery_needed,
+            'address': order.address,
+            'card_needed': order.card_needed,
+            'card_text': order.card_text,
+            'recipient_name': order.recipient_name,
+            'recipient_phone': order.recipient_phone,
+            'customer_name': getattr(order, 'customer_name', None),
+            'customer_phone': getattr(order, 'customer_phone', None),
+            'items': items,
+            'created_at': order.created_at.isoformat(),
+            'updated_at': order.updated_at.isoformat()
+        }
+
     async def get_order_data(self, session_id: str, sender_id: str = None) -> Optional[Dict[str, Any]]:
         """
         Получает данные заказа для сессии.
@@ -173,24 +252,7 @@ class OrderService:
                 else:
                     print("order.items attribute not found")
                 
-                result = {
-                    'order_id': order.order_id,
-                    'sender_id': order.sender_id,
-                    'status': order.status.value,
-                    'date': order.date,
-                    'time': order.time,
-                    'delivery_needed': order.delivery_needed,
-                    'address': order.address,
-                    'card_needed': order.card_needed,
-                    'card_text': order.card_text,
-                    'recipient_name': order.recipient_name,
-                    'recipient_phone': order.recipient_phone,
-                    'customer_name': getattr(order, 'customer_name', None),
-                    'customer_phone': getattr(order, 'customer_phone', None),
-                    'items': items,
-                    'created_at': order.created_at.isoformat(),
-                    'updated_at': order.updated_at.isoformat()
-                }
+                result = self.order_to_data(order)
                 print(f"Returning order data with {len(items)} items")
                 return result
             else:
@@ -202,6 +264,10 @@ class OrderService:
             traceback.print_exc()
             raise
 
+    def get_metrics(self) -> Dict[str, Any]:
+        """Счетчики записей заказов и пропущенных (ничего не изменилось) записей"""
+        return dict(self._metrics)
+
     async def get_user_order_history(self, sender_id: str, limit: int = 10) -> List[Order]:
         """
         Получает историю заказов пользователя.
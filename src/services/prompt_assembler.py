@@ -0,0 +1,293 @@
+"""
+Сборка промпта для AI.
+
+Шаблон системного промпта читается с диска один раз (и перечитывается, если
+файл изменился) и заранее разбирается на статичные куски и подстановки.
+Блок каталога форматируется один раз на версию каталога, время на Пхукете -
+один раз в минуту. На каждый запрос подставляются только короткие
+динамические части и история диалога.
+
+Промпт собирается из секций (системный промпт, каталог, данные заказа,
+краткое содержание, история) с оценкой токенов каждой. Если сумма больше
+PROMPT_TOKEN_BUDGET, сначала отбрасываются старые сообщения истории (до
+PROMPT_MIN_HISTORY_MESSAGES последних), затем краткое содержание. Системный
+промпт, каталог и данные заказа не урезаются: без них ответ будет неверным.
+"""
+
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from string import Formatter
+from typing import Dict, Any, List, Optional, Tuple
+import pytz
+from src.config.settings import PROMPT_RELOAD_CHECK_SECONDS, PROMPT_TOKEN_BUDGET, PROMPT_MIN_HISTORY_MESSAGES
+from src.utils.ai_utils import format_catalog_for_ai
+
+DEFAULT_PROMPT_PATH = os.path.join(os.path.dirname(__file__), "prompts", "ai_system_prompt.prompt")
+PHUKET_TZ = pytz.timezone('Asia/Bangkok')
+
+
+HISTORY_HEADER = "\n\nCONVERSATION HISTORY (one message per line, 'role: text'):\n"
+# Сколько сессий держать в статистике токенов по диалогам
+SESSION_TOKEN_STATS_SIZE = 500
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Грубая оценка числа токенов: ~4 символа ASCII на токен, ~2 символа
+    кириллицы/тайского на токен
+    """
+    if not text:
+        return 0
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars + 1) // 2
+
+
+def encode_history_line(message: Dict[str, Any]) -> str:
+    """Сообщение истории одной строкой: 'role: текст' (переводы строк экранируются)"""
+    content = str(message.get('content') or '').replace("\n", "\\n")
+    return f"{message.get('role', 'user')}: {content}"
+
+
+def _section_stats(text: str) -> Dict[str, int]:
+    return {"bytes": len(text.encode("utf-8")), "tokens_est": estimate_tokens(text)}
+
+
+class PromptTemplate:
+    """Шаблон промпта, разобранный на литералы и имена подстановок"""
+
+    def __init__(self, path: str, reload_check_seconds: float = PROMPT_RELOAD_CHECK_SECONDS):
+        self.path = path
+        self.reload_check_seconds = reload_check_seconds
+        self.loads = 0
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._parts: List[Tuple[str, Optional[str]]] = []
+        self.static_text = ""
+        self.static_stats = {"bytes": 0, "tokens_est": 0}
+
+    def _load(self, mtime: float):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                text = f.read()
+        except FileNotFoundError:
+            print(f"[PROMPT_LOAD] ERROR: Structured prompt not found: {self.path}")
+            raise FileNotFoundError(f"Required prompt file not found: {self.path}")
+
+        parts = []
+        static = []
+        for literal, field_name, format_spec, conversion in Formatter().parse(text):
+            parts.append((literal, field_name))
+            static.append(literal)
+        self._parts = parts
+        self.static_text = "".join(static)
+        self.static_stats = _section_stats(self.static_text)
+        self._mtime = mtime
+        self.loads += 1
+        print(f"[PROMPT_LOAD] Loaded structured prompt from: {self.path} ({len(parts)} parts)")
+
+    def _ensure_loaded(self):
+        now = time.monotonic()
+        if self._mtime is not None and now - self._checked_at < self.reload_check_seconds:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            if self._mtime is not None:
+                # Файл временно пропал (например, при деплое) - работаем со старой версией
+                return
+            mtime = 0.0
+        if mtime != self._mtime:
+            self._load(mtime)
+
+    def render(self, values: Dict[str, str]) -> str:
+        """Подставляет значения в шаблон"""
+        self._ensure_loaded()
+        chunks = []
+        for literal, field_name in self._parts:
+            chunks.append(literal)
+            if field_name is not None:
+                chunks.append(values[field_name])
+        return "".join(chunks)
+
+
+class PromptAssembler:
+    """Собирает системный промпт, каталог и историю диалога в один запрос к AI"""
+
+    def __init__(self, catalog_service, template_path: str = DEFAULT_PROMPT_PATH,
+                 token_budget: int = PROMPT_TOKEN_BUDGET,
+                 min_history_messages: int = PROMPT_MIN_HISTORY_MESSAGES):
+        self.catalog_service = catalog_service
+        self.template = PromptTemplate(template_path)
+        self.token_budget = token_budget
+        self.min_history_messages = min_history_messages
+        # Расход токенов по диалогам (последние SESSION_TOKEN_STATS_SIZE сессий)
+        self._session_tokens: "OrderedDict[str, Dict[str, int]]" = OrderedDict()
+        self._catalog_block: Optional[str] = None
+        self._catalog_version: Optional[int] = None
+        self._time_minute: Optional[int] = None
+        self._time_str = ""
+        self._metrics = {
+            "prompts": 0,
+            "catalog_renders": 0,
+            "catalog_cache_hits": 0,
+            "last_sections": {},
+            "last_trimmed_messages": 0,
+            "trimmed_messages": 0,
+            "summary_dropped": 0,
+            "over_budget": 0,
+            "tokens_total": 0,
+            "tokens_max": 0,
+            "section_tokens_total": {"catalog": 0, "order": 0, "summary": 0, "history": 0}
+        }
+
+    def _phuket_time_str(self) -> str:
+        minute = int(time.time() // 60)
+        if minute != self._time_minute:
+            try:
+                self._time_str = datetime.now(PHUKET_TZ).strftime('%d %B %Y, %H:%M')
+            except Exception:
+                self._time_str = 'Error determining Phuket time'
+            self._time_minute = minute
+        return self._time_str
+
+    def catalog_block(self) -> str:
+        """Блок каталога для промпта; пересобирается только при смене версии каталога"""
+        products = self.catalog_service.get_products()
+        version = getattr(self.catalog_service, "version", None)
+        if self._catalog_block is not None and version is not None and version == self._catalog_version:
+            self._metrics["catalog_cache_hits"] += 1
+            return self._catalog_block
+        self._catalog_block = f"\n\nACTUAL PRODUCT CATALOG:\n{format_catalog_for_ai(products)}"
+        self._catalog_version = version
+        self._metrics["catalog_renders"] += 1
+        return self._catalog_block
+
+    def render_system_prompt(self, user_lang: str = 'auto', sender_name: str = None, is_first_message: bool = False) -> str:
+        """Системный промпт без каталога"""
+        name_context = f"User name: {sender_name}" if sender_name else "User name unknown"
+
+        if sender_name and is_first_message:
+            name_instruction = f"""
+GREETING WITH NAME: This is the first message in conversation, use the user's name '{sender_name}' in greeting.
+IMPORTANT: The name '{sender_name}' is from WhatsApp profile. If the user writes in Russian, use Russian name format.
+If the user writes in English, use English name format. If the user writes in Thai, use Thai name format.
+Example: 'Hello {sender_name}! Would you like to see our flower catalog?'"""
+        else:
+            name_instruction = ""
+
+        if user_lang == 'auto':
+            language_instruction = "IMPORTANT: Respond in English by default! If user writes in another language, respond in the same language."
+        elif user_lang in ['it', 'fr', 'es', 'de']:
+            # Для европейских языков отвечаем на английском, но понимаем их
+            language_instruction = f"IMPORTANT: User writes in {user_lang.upper()} language, but respond in English! User understands English."
+        else:
+            language_instruction = f"IMPORTANT: Respond in user's language! User writes in language code '{user_lang}'. Respond in the same language."
+
+        return self.template.render({
+            "user_lang": user_lang,
+            "sender_name": sender_name or "",
+            "phuket_time_str": self._phuket_time_str(),
+            "name_context": name_context,
+            "name_instruction": name_instruction,
+            "language_instruction": language_instruction
+        })
+
+    def build_prompt(self, conversation_history: List[Dict[str, Any]], user_lang: str = 'auto',
+                     sender_name: str = None, is_first_message: bool = False,
+                     summary: Optional[str] = None, session_key: Optional[str] = None) -> str:
+        """
+        Полный промпт: системный промпт, каталог, данные заказа, краткое содержание,
+        история диалога. Записи истории с ролью 'system' (данные заказа) идут
+        отдельной секцией; история укладывается в бюджет токенов.
+        """
+        system_prompt = self.render_system_prompt(user_lang, sender_name, is_first_message)
+        catalog = self.catalog_block()
+        order_entries = [m.get('content') or '' for m in conversation_history if m.get('role') == 'system']
+        order = "\n\n" + "\n".join(order_entries) if order_entries else ""
+        summary_block = f"\n\nEARLIER CONVERSATION SUMMARY:\n{summary}" if summary else ""
+        lines = [encode_history_line(m) for m in conversation_history if m.get('role') != 'system']
+        tail = "\n\nJSON RESPONSE:"
+
+        fixed_tokens = (estimate_tokens(system_prompt) + estimate_tokens(catalog)
+                        + estimate_tokens(order) + estimate_tokens(tail) + estimate_tokens(HISTORY_HEADER))
+        line_tokens = [estimate_tokens(line) + 1 for line in lines]
+        history_tokens = sum(line_tokens)
+        summary_tokens = estimate_tokens(summary_block)
+
+        # Сначала отбрасываем самые старые сообщения, потом краткое содержание
+        trimmed = 0
+        keep_min = min(len(lines), self.min_history_messages)
+        while (fixed_tokens + summary_tokens + history_tokens > self.token_budget
+               and len(lines) - trimmed > keep_min):
+            history_tokens -= line_tokens[trimmed]
+            trimmed += 1
+        if trimmed:
+            lines = lines[trimmed:]
+            self._metrics["trimmed_messages"] += trimmed
+        if summary_block and fixed_tokens + summary_tokens + history_tokens > self.token_budget:
+            summary_block = ""
+            summary_tokens = 0
+            self._metrics["summary_dropped"] += 1
+
+        history = HISTORY_HEADER + "\n".join(lines)
+        prompt = system_prompt + catalog + order + summary_block + history + tail
+
+        template_stats = self.template.static_stats
+        system_bytes = len(system_prompt.encode("utf-8"))
+        dynamic_bytes = system_bytes - template_stats["bytes"]
+        sections = {
+            "template": template_stats,
+            "dynamic": {"bytes": dynamic_bytes, "tokens_est": estimate_tokens(system_prompt) - template_stats["tokens_est"]},
+            "catalog": _section_stats(catalog),
+            "order": _section_stats(order),
+            "summary": _section_stats(summary_block),
+            "history": _section_stats(history),
+            "total": _section_stats(prompt)
+        }
+        total_tokens = sections["total"]["tokens_est"]
+        self._metrics["prompts"] += 1
+        self._metrics["last_sections"] = sections
+        self._metrics["last_trimmed_messages"] = trimmed
+        self._metrics["tokens_total"] += total_tokens
+        self._metrics["tokens_max"] = max(self._metrics["tokens_max"], total_tokens)
+        if total_tokens > self.token_budget:
+            self._metrics["over_budget"] += 1
+        for name in ("catalog", "order", "summary", "history"):
+            self._metrics["section_tokens_total"][name] += sections[name]["tokens_est"]
+        if session_key:
+            self._record_session_tokens(session_key, total_tokens)
+        return prompt
+
+    def _record_session_tokens(self, session_key: str, tokens: int):
+        stats = self._session_tokens.pop(session_key, None) or {"prompts": 0, "tokens": 0}
+        stats["prompts"] += 1
+        stats["tokens"] += tokens
+        self._session_tokens[session_key] = stats
+        while len(self._session_tokens) > SESSION_TOKEN_STATS_SIZE:
+            self._session_tokens.popitem(last=False)
+
+    def get_last_sections(self) -> Dict[str, Dict[str, int]]:
+        """Размеры секций последнего собранного промпта"""
+        return self._metrics["last_sections"]
+
+    def session_tokens(self, session_key: str) -> Dict[str, int]:
+        """Сколько промптов и токенов (оценка) ушло в Gemini по диалогу"""
+        return dict(self._session_tokens.get(session_key) or {"prompts": 0, "tokens": 0})
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Возвращает размеры секций последнего промпта, расход токенов и статистику кэшей"""
+        prompts = self._metrics["prompts"]
+        top_sessions = sorted(self._session_tokens.items(), key=lambda item: item[1]["tokens"], reverse=True)[:10]
+        return {
+            "template_path": self.template.path,
+            "template_loads": self.template.loads,
+            "catalog_version": self._catalog_version,
+            "token_budget": self.token_budget,
+            **self._metrics,
+            "section_tokens_total": dict(self._metrics["section_tokens_total"]),
+            "tokens_avg": round(self._metrics["tokens_total"] / prompts) if prompts else 0,
+            "top_sessions": [{"session": key, **stats} for key, stats in top_sessions]
+        }
@@ -0,0 +1,199 @@
+"""
+Планировщик обработки сообщений по отправителям.
+
+Сообщения одного sender_id обрабатываются строго последовательно в порядке
+поступления, разные отправители обрабатываются параллельно. Несколько быстрых
+сообщений подряд склеиваются в одну пачку и дают один вызов AI. Окно склейки
+выдерживается только при всплеске (за первым сообщением уже зарезервированы
+следующие), одиночное сообщение обрабатывается сразу. Число одновременно
+обрабатываемых пачек (вызовов AI и Firestore) ограничено общим лимитом,
+равным числу воркеров очереди webhook'ов.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional, Callable, Awaitable, List
+from src.config.settings import SENDER_COALESCE_WINDOW_MS, SENDER_MAX_BATCH_SIZE, WEBHOOK_QUEUE_WORKERS
+from src.utils.metrics import LatencyHistogram
+
+
+@dataclass
+class LaneTicket:
+    """Место сообщения в очереди отправителя (резервируется при приеме webhook'а)"""
+    sender_id: str
+    message: Optional[Dict[str, Any]] = None
+    ready: bool = False
+    future: Optional[asyncio.Future] = None
+
+
+@dataclass
+class SenderLane:
+    """Очередь сообщений одного отправителя"""
+    tickets: List[LaneTicket] = field(default_factory=list)
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+    drainer: Optional[asyncio.Task] = None
+
+
+class SenderLaneScheduler:
+    """Последовательная обработка по отправителю со склейкой пачек"""
+
+    def __init__(self, processor: Callable[[List[Dict[str, Any]]], Awaitable[bool]],
+                 coalesce_window_ms: int = SENDER_COALESCE_WINDOW_MS,
+                 max_batch_size: int = SENDER_MAX_BATCH_SIZE,
+                 max_concurrent_batches: int = WEBHOOK_QUEUE_WORKERS):
+        self.processor = processor
+        self.coalesce_window = max(0, coalesce_window_ms) / 1000
+        self.max_batch_size = max(1, max_batch_size)
+        # Общий лимит одновременных пачек для всех отправителей
+        self.max_concurrent_batches = max(1, max_concurrent_batches)
+        self._batch_slots = asyncio.Semaphore(self.max_concurrent_batches)
+        self._running_batches = 0
+        self._lanes: Dict[str, SenderLane] = {}
+        self._batch_latency = LatencyHistogram()
+        self._metrics = {
+            "batches": 0,
+            "messages": 0,
+            "coalesced_messages": 0,
+            "cancelled_tickets": 0,
+            "max_batch_size": 0,
+            "failed_batches": 0,
+            "burst_waits": 0,
+            "slot_waits": 0
+        }
+
+    def reserve(self, sender_id: str) -> LaneTicket:
+        """
+        Резервирует место в очереди отправителя.
+        Вызывается синхронно при приеме webhook'а, чтобы зафиксировать порядок поступления.
+        """
+        ticket = LaneTicket(sender_id=sender_id, future=asyncio.get_running_loop().create_future())
+        lane = self._lanes.get(sender_id)
+        if lane is None:
+            lane = SenderLane()
+            self._lanes[sender_id] = lane
+        lane.tickets.append(ticket)
+        if lane.drainer is None or lane.drainer.done():
+            lane.drainer = asyncio.create_task(self._drain(sender_id, lane), name=f"sender-lane-{sender_id}")
+        return ticket
+
+    async def submit(self, ticket: LaneTicket, message: Dict[str, Any]) -> bool:
+        """Передает извлеченное сообщение в очередь и ждет завершения его обработки"""
+        self._resolve(ticket, message)
+        return await ticket.future
+
+    def dispatch(self, ticket: LaneTicket, message: Dict[str, Any]):
+        """
+        Передает извлеченное сообщение в очередь, не дожидаясь обработки.
+        Результат пачки учитывается в метриках (failed_batches).
+        """
+        self._resolve(ticket, message)
+
+    async def wait_idle(self, timeout: float = 30.0):
+        """Дожидается обработки всех очередей отправителей (при остановке приложения)"""
+        drainers = [lane.drainer for lane in self._lanes.values() if lane.drainer and not lane.drainer.done()]
+        if not drainers:
+            return
+        done, pending = await asyncio.wait(drainers, timeout=timeout)
+        if pending:
+            print(f"[SENDER_LANES] Не дождались обработки очередей отправителей: {len(pending)}")
+
+    def cancel(self, ticket: LaneTicket):
+        """Освобождает место сообщения, которое не нужно обрабатывать"""
+        self._metrics["cancelled_tickets"] += 1
+        self._resolve(ticket, None)
+
+    def _resolve(self, ticket: LaneTicket, message: Optional[Dict[str, Any]]):
+        ticket.message = message
+        ticket.ready = True
+        lane = self._lanes.get(ticket.sender_id)
+        if lane:
+            lane.changed.set()
+
+    async def _wait_head_ready(self, lane: SenderLane):
+        """Ждет, пока первое сообщение в очереди будет извлечено"""
+        while not lane.tickets[0].ready:
+            lane.changed.clear()
+            await lane.changed.wait()
+
+    async def _wait_burst(self, lane: SenderLane):
+        """
+        Ждет извлечения сообщений, зарезервированных вслед за первым,
+        но не дольше окна склейки.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.coalesce_window
+        while not all(ticket.ready for ticket in lane.tickets[:self.max_batch_size]):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            lane.changed.clear()
+            try:
+                await asyncio.wait_for(lane.changed.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return
+
+    def _take_batch(self, lane: SenderLane) -> List[LaneTicket]:
+        """Забирает из головы очереди подряд идущие готовые сообщения"""
+        batch = []
+        while lane.tickets and lane.tickets[0].ready and len(batch) < self.max_batch_size:
+            batch.append(lane.tickets.pop(0))
+        return batch
+
+    async def _drain(self, sender_id: str, lane: SenderLane):
+        """Обрабатывает очередь отправителя, пока в ней есть сообщения"""
+        while lane.tickets:
+            await self._wait_head_ready(lane)
+
+            # Окно склейки только при всплеске: следующие сообщения уже приняты, но еще извлекаются
+            if self.coalesce_window and lane.tickets[0].message is not None and len(lane.tickets) > 1:
+                self._metrics["burst_waits"] += 1
+                await self._wait_burst(lane)
+
+            batch = self._take_batch(lane)
+            messages = [ticket.message for ticket in batch if ticket.message is not None]
+            result = True
+            if messages:
+                self._record_batch(len(messages))
+                if self._batch_slots.locked():
+                    self._metrics["slot_waits"] += 1
+                async with self._batch_slots:
+                    self._running_batches += 1
+                    started = time.perf_counter()
+                    try:
+                        result = await self.processor(messages)
+                    except Exception as e:
+                        print(f"[SENDER_LANES] Ошибка обработки пачки для {sender_id}: {e}")
+                        result = False
+                    finally:
+                        self._running_batches -= 1
+                    if not result:
+                        self._metrics["failed_batches"] += 1
+                    self._batch_latency.record((time.perf_counter() - started) * 1000)
+
+            for ticket in batch:
+                if not ticket.future.done():
+                    ticket.future.set_result(result)
+
+        if self._lanes.get(sender_id) is lane:
+            del self._lanes[sender_id]
+
+    def _record_batch(self, size: int):
+        self._metrics["batches"] += 1
+        self._metrics["messages"] += size
+        self._metrics["coalesced_messages"] += size - 1
+        self._metrics["max_batch_size"] = max(self._metrics["max_batch_size"], size)
+        if size > 1:
+            print(f"[SENDER_LANES] Склеено сообщений в одну пачку: {size}")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Возвращает метрики планировщика"""
+        return {
+            "active_lanes": len(self._lanes),
+            "pending_messages": sum(len(lane.tickets) for lane in self._lanes.values()),
+            "coalesce_window_ms": int(self.coalesce_window * 1000),
+            "running_batches": self._running_batches,
+            "max_concurrent_batches": self.max_concurrent_batches,
+            **self._metrics,
+            "batch_latency": self._batch_latency.snapshot()
+        }
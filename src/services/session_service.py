@@ -6,14 +6,14 @@ from src.repositories.session_repository import SessionRepository
 from src.models.session import Session
 from src.utils.logging_decorator import log_function
 from typing import Optional, List, Dict, Any
-from datetime import datetime
+from datetime import datetime, timedelta
 import random
 from google.cloud import firestore
 
 class SessionService:
-    def __init__(self):
-        self.repo = SessionRepository()
-        self.db = self._get_firestore_client()
+    def __init__(self, db=None):
+        self.db = db if db is not None else self._get_firestore_client()
+        self.repo = SessionRepository(self.db)
     
     def _get_firestore_client(self):
         """Получает клиент Firestore"""
@@ -32,23 +32,11 @@ class SessionService:
                 doc_ref = self.db.collection('users').document(sender_id)
                 doc = doc_ref.get()
                 if doc.exists:
-                    user_data = doc.to_dict()
-                    session_id = user_data.get('session_id')
-                    session_created = user_data.get('session_created')
-                    
-                    if session_id and session_created:
-                        # Проверяем срок сессии (неделя)
-                        from datetime import timedelta
-                        session_date = session_created
-                        if hasattr(session_date, 'timestamp'):
-                            session_date = session_date.timestamp()
-                        
-                        week_ago = datetime.now() - timedelta(days=7)
-                        if session_date > week_ago.timestamp():
-                            print(f"Found valid session: {session_id} for {sender_id}")
-                            return session_id
-                        else:
-                            print(f"Session expired, creating new one for {sender_id}")
+                    session_id = self.active_session_id(doc.to_dict())
+                    if session_id:
+                        print(f"Found valid session: {session_id} for {sender_id}")
+                        return session_id
+                    print(f"Session expired, creating new one for {sender_id}")
             except Exception as e:
                 print(f"Error checking users: {e}")
         
@@ -59,6 +47,32 @@ class SessionService:
         print(f"Created new session: {new_session_id} for {sender_id}")
         return new_session_id
 
+    @staticmethod
+    def active_session_id(user_data: Optional[Dict[str, Any]]) -> Optional[str]:
+        """Возвращает session_id из документа users, если сессия не старше недели"""
+        if not user_data:
+            return None
+        session_id = user_data.get('session_id')
+        session_created = user_data.get('session_created')
+        if not session_id or not session_created:
+            return None
+        session_date = session_created
+        if hasattr(session_date, 'timestamp'):
+            session_date = session_date.timestamp()
+        week_ago = datetime.now() - timedelta(days=7)
+        return session_id if session_date > week_ago.timestamp() else None
+
+    @staticmethod
+    def summary_state(session_data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Краткое содержание диалога из документа сессии: {'summary', 'until', 'folded'} или {}"""
+        if not session_data or not session_data.get('summary'):
+            return {}
+        return {
+            'summary': session_data.get('summary'),
+            'until': session_data.get('summary_until'),
+            'folded': session_data.get('summary_messages', 0)
+        }
+
     @log_function("session_service")
     async def create_new_session_after_order(self, sender_id: str) -> str:
         """
@@ -166,6 +180,48 @@ class SessionService:
             print(f"Error getting user language: {e}")
             return 'auto'
 
+    async def get_conversation_summary(self, sender_id: str, session_id: str) -> Dict[str, Any]:
+        """
+        Получает краткое содержание ранней части диалога из документа сессии.
+
+        Returns:
+            dict: {'summary', 'until', 'folded'} или пустой словарь
+        """
+        if not self.db:
+            return {}
+
+        import asyncio
+        session_ref = self.db.collection('conversations').document(sender_id).collection('sessions').document(session_id)
+        loop = asyncio.get_running_loop()
+        doc = await loop.run_in_executor(None, session_ref.get)
+        if not doc.exists:
+            return {}
+        return self.summary_state(doc.to_dict())
+
+    async def save_conversation_summary(self, sender_id: str, session_id: str, summary: str,
+                                        until: Optional[datetime], folded: int):
+        """
+        Сохраняет краткое содержание диалога в документ сессии.
+
+        Args:
+            summary: Текст краткого содержания
+            until: Время последнего сообщения, вошедшего в краткое содержание
+            folded: Сколько сообщений свернуто всего
+        """
+        if not self.db:
+            return
+
+        import asyncio
+        session_ref = self.db.collection('conversations').document(sender_id).collection('sessions').document(session_id)
+        data = {
+            'summary': summary,
+            'summary_until': until,
+            'summary_messages': folded,
+            'summary_updated_at': firestore.SERVER_TIMESTAMP
+        }
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, lambda: session_ref.set(data, merge=True))
+
     async def get_user_info(self, sender_id: str) -> dict:
         """Получает информацию о пользователе из коллекции users"""
         if not self.db:
@@ -187,6 +243,10 @@ class SessionService:
             print(f"Error getting user info: {e}")
             return {}
 
+    def generate_session_id(self, sender_id: str) -> str:
+        """Новый ID сессии (без записи в БД: сессию записывает вызывающий код)"""
+        return self._generate_session_id(sender_id)
+
     def _generate_session_id(self, sender_id: str) -> str:
         now = datetime.now()
         timestamp_str = now.strftime("%Y%m%d_%H%M%S")
@@ -0,0 +1,165 @@
+"""
+Двухуровневый кэш переводов.
+
+Ключ - (нормализованный текст, исходный язык, целевой язык). Первый уровень -
+LRU в памяти процесса с ограничением размера и TTL, второй - коллекция
+translation_cache в Firestore, общая для всех инстансов и для фоновых задач.
+Повторяющиеся фразы ("ok", "спасибо", адреса) переводятся Gemini один раз.
+"""
+
+import asyncio
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Optional, Set, Tuple
+from src.config.settings import (
+    TRANSLATION_CACHE_SIZE, TRANSLATION_CACHE_TTL_SECONDS,
+    TRANSLATION_CACHE_STORE_TTL_DAYS, TRANSLATION_CACHE_MAX_TEXT_LENGTH
+)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Нормализует текст для ключа кэша: регистр и лишние пробелы не важны"""
+    return _WHITESPACE_RE.sub(" ", text.strip()).casefold()
+
+
+def make_key(text: str, source: str, target: str) -> str:
+    """Ключ кэша (он же ID документа в Firestore)"""
+    raw = f"{source}\x1f{target}\x1f{normalize_text(text)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:40]
+
+
+class TranslationCache:
+    """LRU+TTL в памяти перед постоянным хранилищем (если оно передано)"""
+
+    def __init__(self, repository=None,
+                 max_size: int = TRANSLATION_CACHE_SIZE,
+                 ttl_seconds: float = TRANSLATION_CACHE_TTL_SECONDS,
+                 max_text_length: int = TRANSLATION_CACHE_MAX_TEXT_LENGTH):
+        self.repository = repository
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.max_text_length = max_text_length
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._pending_writes: Set[asyncio.Task] = set()
+        self._metrics = {
+            "lookups": 0,
+            "memory_hits": 0,
+            "store_hits": 0,
+            "misses": 0,
+            "skipped": 0,
+            "writes": 0,
+            "store_errors": 0,
+            "evictions": 0,
+            "expired": 0
+        }
+
+    def cacheable(self, text: str) -> bool:
+        """Длинные уникальные тексты не кэшируем"""
+        return bool(text) and len(text) <= self.max_text_length
+
+    async def get(self, text: str, source: str, target: str, persist: bool = True) -> Optional[str]:
+        """Ищет перевод сначала в памяти, затем (если persist) в Firestore"""
+        if not self.cacheable(text):
+            self._metrics["skipped"] += 1
+            return None
+        self._metrics["lookups"] += 1
+        key = make_key(text, source, target)
+
+        value = self._get_memory(key)
+        if value is not None:
+            self._metrics["memory_hits"] += 1
+            return value
+
+        if persist and self.repository is not None:
+            try:
+                data = await self.repository.get_translation(key)
+            except Exception as e:
+                self._metrics["store_errors"] += 1
+                print(f"[TRANSLATION_CACHE] Ошибка чтения кэша: {e}")
+                data = None
+            if data and data.get("translation"):
+                self._metrics["store_hits"] += 1
+                self._set_memory(key, data["translation"])
+                return data["translation"]
+
+        self._metrics["misses"] += 1
+        return None
+
+    def put(self, text: str, source: str, target: str, translation: str, persist: bool = True):
+        """
+        Сохраняет перевод в память и в фоне - в Firestore. С persist=False запись
+        остается только в ограниченном LRU процесса (для служебных значений,
+        которые не стоит хранить для каждого произвольного текста).
+        """
+        if not self.cacheable(text) or not translation:
+            return
+        key = make_key(text, source, target)
+        self._set_memory(key, translation)
+        self._metrics["writes"] += 1
+
+        if not persist or self.repository is None:
+            return
+        now = datetime.now(timezone.utc)
+        data = {
+            "text": normalize_text(text),
+            "source": source,
+            "target": target,
+            "translation": translation,
+            "created_at": now,
+            "expires_at": now + timedelta(days=TRANSLATION_CACHE_STORE_TTL_DAYS)
+        }
+        try:
+            task = asyncio.get_running_loop().create_task(self._save(key, data))
+        except RuntimeError:
+            return
+        self._pending_writes.add(task)
+        task.add_done_callback(self._pending_writes.discard)
+
+    async def _save(self, key: str, data: Dict[str, Any]):
+        try:
+            await self.repository.save_translation(key, data)
+        except Exception as e:
+            self._metrics["store_errors"] += 1
+            print(f"[TRANSLATION_CACHE] Ошибка записи кэша: {e}")
+
+    async def flush(self):
+        """Дожидается фоновых записей в Firestore (при остановке и в тестах)"""
+        if self._pending_writes:
+            await asyncio.gather(*list(self._pending_writes), return_exceptions=True)
+
+    def _get_memory(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self._metrics["expired"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set_memory(self, key: str, value: str):
+        self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._metrics["evictions"] += 1
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Возвращает размер кэша и доли попаданий"""
+        lookups = self._metrics["lookups"]
+        hits = self._metrics["memory_hits"] + self._metrics["store_hits"]
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "persistent": self.repository is not None,
+            **self._metrics,
+            "hit_ratio": round(hits / lookups, 3) if lookups else 0.0,
+            "memory_hit_ratio": round(self._metrics["memory_hits"] / lookups, 3) if lookups else 0.0
+        }
@@ -0,0 +1,188 @@
+"""
+Отложенный перевод сообщений пользователя.
+
+Переводы content_en / content_thai нужны только CRM и истории чата, поэтому
+сообщение сохраняется сразу с оригинальным текстом и статусом перевода
+'pending', а переводы дописываются в документ фоновыми воркерами уже после
+того, как бот ответил клиенту. Задачи, которые не удалось выполнить
+(очередь заполнена, воркеры не запущены или остановлены раньше, чем дошла
+очередь), помечаются статусом 'failed', чтобы сообщение не осталось 'pending'.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Set
+from src.config.settings import TRANSLATION_ENRICH_WORKERS, TRANSLATION_ENRICH_MAXSIZE
+from src.utils.metrics import LatencyRegistry
+
+TRANSLATION_PENDING = 'pending'
+TRANSLATION_DONE = 'done'
+TRANSLATION_FAILED = 'failed'
+
+
+@dataclass
+class TranslationJob:
+    """Задача на перевод одного сохраненного сообщения"""
+    sender_id: str
+    session_id: str
+    message_id: str
+    text: str
+    user_lang: str = 'auto'
+    attempts: int = 0
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class TranslationEnrichmentWorker:
+    """Очередь переводов с пулом воркеров"""
+
+    MAX_ATTEMPTS = 2
+
+    def __init__(self, ai_service, message_service,
+                 workers: int = TRANSLATION_ENRICH_WORKERS, maxsize: int = TRANSLATION_ENRICH_MAXSIZE):
+        self.ai_service = ai_service
+        self.message_service = message_service
+        self.workers_count = max(1, workers)
+        self.maxsize = maxsize
+        self.latency = LatencyRegistry()
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        # Задачи, которые воркеры взяли в работу (индекс воркера -> задача)
+        self._in_flight: Dict[int, TranslationJob] = {}
+        # Фоновые записи статуса 'failed' для отброшенных задач
+        self._marking: Set[asyncio.Task] = set()
+        self._metrics = {
+            "enqueued": 0,
+            "processed": 0,
+            "failed": 0,
+            "retried": 0,
+            "dropped": 0,
+            "abandoned": 0
+        }
+
+    @property
+    def is_running(self) -> bool:
+        """Запущены ли воркеры"""
+        return bool(self._workers)
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def start(self):
+        """Запускает воркеры (вызывается при старте приложения)"""
+        if self.is_running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._workers = [
+            asyncio.create_task(self._worker(i), name=f"translation-worker-{i}")
+            for i in range(self.workers_count)
+        ]
+        print(f"[TRANSLATION_ENRICH] Запущено воркеров: {self.workers_count}")
+
+    async def stop(self, timeout: float = 10.0):
+        """Дожидается переводов из очереди и останавливает воркеры"""
+        if not self.is_running:
+            await self._flush_marking()
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"[TRANSLATION_ENRICH] Не дождались переводов, осталось задач: {self.depth()}")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+        # Прерванные и не начатые переводы больше никто не выполнит
+        abandoned = list(self._in_flight.values())
+        self._in_flight.clear()
+        while not self._queue.empty():
+            abandoned.append(self._queue.get_nowait())
+            self._queue.task_done()
+        if abandoned:
+            self._metrics["abandoned"] += len(abandoned)
+            print(f"[TRANSLATION_ENRICH] Переводы помечены как неудавшиеся при остановке: {len(abandoned)}")
+            await asyncio.gather(*(self._mark_failed(job) for job in abandoned))
+        await self._flush_marking()
+
+    async def _flush_marking(self):
+        if self._marking:
+            await asyncio.gather(*list(self._marking), return_exceptions=True)
+
+    def submit(self, job: TranslationJob) -> bool:
+        """
+        Ставит перевод в очередь без ожидания. Возвращает False, если воркеры
+        не запущены или очередь заполнена - тогда сообщение помечается 'failed'.
+        """
+        if self._enqueue(job):
+            return True
+        if self.is_running:
+            self._metrics["dropped"] += 1
+            print(f"[TRANSLATION_ENRICH] Очередь заполнена, перевод {job.message_id} пропущен")
+        task = asyncio.get_running_loop().create_task(self._mark_failed(job))
+        self._marking.add(task)
+        task.add_done_callback(self._marking.discard)
+        return False
+
+    def _enqueue(self, job: TranslationJob) -> bool:
+        if not self.is_running:
+            return False
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            return False
+        self._metrics["enqueued"] += 1
+        return True
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self._queue.get()
+            self._in_flight[index] = job
+            started = time.perf_counter()
+            try:
+                await self._translate(job)
+                self._in_flight.pop(index, None)
+            except Exception as e:
+                self._in_flight.pop(index, None)
+                print(f"[TRANSLATION_ENRICH] Ошибка перевода {job.message_id} в воркере {index}: {e}")
+            finally:
+                finished = time.perf_counter()
+                self.latency.record("translate", (finished - started) * 1000)
+                self.latency.record("lag", (finished - job.enqueued_at) * 1000)
+                self._queue.task_done()
+
+    async def _translate(self, job: TranslationJob):
+        job.attempts += 1
+        try:
+            result = await self.ai_service.detect_and_translate(job.text, job.user_lang)
+            await self.message_service.update_message_translations(
+                job.sender_id, job.session_id, job.message_id,
+                result['text_en'], result['text_thai'], TRANSLATION_DONE
+            )
+            self._metrics["processed"] += 1
+        except Exception as e:
+            if job.attempts < self.MAX_ATTEMPTS and self._enqueue(job):
+                self._metrics["retried"] += 1
+                return
+            self._metrics["failed"] += 1
+            print(f"[TRANSLATION_ENRICH] Перевод {job.message_id} не удался: {e}")
+            await self._mark_failed(job)
+
+    async def _mark_failed(self, job: TranslationJob):
+        """Снимает статус 'pending' с сообщения, перевод которого не будет выполнен"""
+        try:
+            await self.message_service.update_message_translations(
+                job.sender_id, job.session_id, job.message_id, None, None, TRANSLATION_FAILED
+            )
+        except Exception as e:
+            print(f"[TRANSLATION_ENRICH] Не удалось записать статус перевода {job.message_id}: {e}")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Возвращает состояние очереди переводов и задержку до готовности перевода"""
+        return {
+            "running": self.is_running,
+            "depth": self.depth(),
+            "workers": self.workers_count,
+            **self._metrics,
+            "stages": self.latency.snapshot()
+        }
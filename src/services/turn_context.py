@@ -0,0 +1,310 @@
+"""
+Контекст хода диалога: пользователь, сессия и заказ, прочитанные один раз.
+
+На одно входящее сообщение документы users/{sender_id},
+conversations/{sender_id}/sessions/{session_id} и
+orders/{sender_id}/sessions/{session_id} читаются одним get_all, дальше
+язык, данные заказа и краткое содержание берутся из памяти. Изменения
+(новая сессия, имя пользователя, язык, данные заказчика) копятся в
+контексте и записываются одним batch-коммитом в конце хода.
+
+session_id последнего хода отправителя запоминается, поэтому обычно
+хватает одного обращения к Firestore; если сессия сменилась (истекла,
+/newses на другом инстансе), документы сессии и заказа дочитываются
+вторым get_all.
+"""
+
+import asyncio
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, Optional, List
+from google.cloud import firestore
+from src.config.settings import HISTORY_CACHE_SESSIONS
+from src.models.order import Order
+from src.models.user import User, UserStatus
+from src.services.order_service import OrderService, changed_fields
+from src.services.session_service import SessionService
+
+
+class TurnContext:
+    """Состояние пользователя, сессии и заказа на время обработки одного хода"""
+
+    def __init__(self, loader: "TurnContextLoader", sender_id: str, session_id: str,
+                 user_data: Optional[Dict[str, Any]], session_data: Optional[Dict[str, Any]],
+                 order_data: Optional[Dict[str, Any]]):
+        self.loader = loader
+        self.sender_id = sender_id
+        self.session_id = session_id
+        self.user_data = user_data
+        self.session_data = session_data or {}
+        self.order = self._parse_order(order_data)
+        self._user_updates: Dict[str, Any] = {}
+        self._session_updates: Dict[str, Any] = {}
+        self._order_updates: Dict[str, Any] = {}
+
+    @staticmethod
+    def _parse_order(order_data: Optional[Dict[str, Any]]) -> Optional[Order]:
+        if not order_data:
+            return None
+        try:
+            return Order.from_dict(order_data)
+        except Exception as e:
+            print(f"[TURN_CONTEXT] Ошибка разбора заказа: {e}")
+            return None
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._user_updates or self._session_updates or self._order_updates)
+
+    @property
+    def session_pending(self) -> bool:
+        """Новая сессия еще не записана в users"""
+        return 'session_id' in self._user_updates
+
+    @property
+    def order_pending(self) -> bool:
+        """Новый заказ (черновик) еще не записан"""
+        return 'created_at' in self._order_updates
+
+    def start_session(self, session_id: str):
+        """
+        Записывает в users новую сессию (вместо SessionService._save_to_users).
+        Несохраненные изменения сессии и заказа предыдущей сессии отбрасываются -
+        перед сменой сессии контекст нужно записать (flush).
+        """
+        self.session_id = session_id
+        self.session_data = {}
+        self.order = None
+        self._session_updates.clear()
+        self._order_updates.clear()
+        self._user_updates['session_id'] = session_id
+        self._user_updates['session_created'] = firestore.SERVER_TIMESTAMP
+
+    def ensure_user(self, sender_name: Optional[str]):
+        """Создает документ пользователя, если его нет (как MessageProcessor._ensure_user_exists)"""
+        if self.user_data and self.user_data.get('sender_id'):
+            return
+        user = User(
+            sender_id=self.sender_id,
+            name=sender_name or "Unknown",
+            language="auto",  # Язык будет определяться в сессии
+            status=UserStatus.ACTIVE,
+            id=self.sender_id
+        )
+        # Поля, уже записанные в users (имя, сессия), не перезаписываются
+        missing = {name: value for name, value in user.to_dict().items() if name not in (self.user_data or {})}
+        self.user_data = {**(self.user_data or {}), **missing}
+        self._user_updates.update(missing)
+
+    def set_user_name(self, name: str):
+        if (self.user_data or {}).get('name') == name:
+            return
+        self.user_data = {**(self.user_data or {}), 'name': name}
+        self._user_updates['name'] = name
+
+    def record_inbound(self, message_ts: Optional[int], wamid: Optional[str]):
+        """Обновляет индекс последней активности (last_message_ts, last_wamid) в users"""
+        if message_ts is None:
+            return
+        if self.loader.activity_index is not None:
+            self.loader.activity_index.observe(self.sender_id, message_ts, wamid)
+        if message_ts <= (self.user_data or {}).get('last_message_ts', 0):
+            return
+        self.user_data = {**(self.user_data or {}), 'last_message_ts': message_ts, 'last_wamid': wamid}
+        # Maximum - значение не уменьшится, если другой инстанс уже записал более позднее сообщение
+        self._user_updates['last_message_ts'] = firestore.Maximum(message_ts)
+        self._user_updates['last_wamid'] = wamid
+
+    @property
+    def user_language(self) -> str:
+        """Язык пользователя из документа сессии ('auto', если не определен)"""
+        return self.session_data.get('user_language') or 'auto'
+
+    def set_user_language(self, user_language: str):
+        if self.session_data.get('user_language') == user_language:
+            return
+        self.session_data['user_language'] = user_language
+        self._session_updates['user_language'] = user_language
+        self._session_updates['last_activity'] = firestore.SERVER_TIMESTAMP
+
+    def update_order(self, fields: Dict[str, Any]):
+        """
+        Обновляет общие поля заказа. Если заказа еще нет, записывается полный
+        черновик (Order.to_dict: статус draft, пустой список товаров, время
+        создания), а изменения применяются поверх него. Новый заказ нужно
+        записать (flush) до выполнения команд AI, которые меняют товары и статус.
+        """
+        changed = changed_fields(self.order, fields)
+        if not changed:
+            self.loader._metrics["order_writes_skipped"] += 1
+            return
+        if self.order is None:
+            self.order = Order(order_id=self.session_id, session_id=self.session_id, sender_id=self.sender_id)
+            self._order_updates.update(self.order.to_dict())
+        for name, value in changed.items():
+            setattr(self.order, name, value)
+        self.order.updated_at = datetime.now()
+        self._order_updates.update(changed)
+        self._order_updates['updated_at'] = self.order.updated_at.isoformat()
+
+    def order_data(self) -> Dict[str, Any]:
+        """Данные заказа в формате OrderService.get_order_data ({} - заказа нет)"""
+        if self.order is None:
+            return {}
+        return OrderService.order_to_data(self.order)
+
+    def summary_state(self) -> Dict[str, Any]:
+        return SessionService.summary_state(self.session_data)
+
+    async def flush(self):
+        """
+        Записывает накопленные изменения одним batch-коммитом.
+        При ошибке изменения сохраняются в контексте, исключение пробрасывается.
+        """
+        await self.loader.flush(self)
+
+    def _take_updates(self):
+        updates = (self._user_updates, self._session_updates, self._order_updates)
+        self._user_updates, self._session_updates, self._order_updates = {}, {}, {}
+        return updates
+
+    def _restore_updates(self, user_updates, session_updates, order_updates):
+        """Возвращает незаписанные изменения после ошибки flush; более новые значения не затираются"""
+        self._user_updates = {**user_updates, **self._user_updates}
+        self._session_updates = {**session_updates, **self._session_updates}
+        self._order_updates = {**order_updates, **self._order_updates}
+
+
+class TurnContextLoader:
+    """Загружает TurnContext одним get_all и записывает его изменения одним batch"""
+
+    def __init__(self, db, session_service: SessionService, max_senders: int = HISTORY_CACHE_SESSIONS,
+                 activity_index=None):
+        self.db = db
+        self.session_service = session_service
+        # LastActivityIndex: заполняется из прочитанного документа users
+        self.activity_index = activity_index
+        self.max_senders = max_senders
+        # sender_id -> session_id последнего хода (подсказка, что читать вместе с users)
+        self._session_hints: "OrderedDict[str, str]" = OrderedDict()
+        self._metrics = {
+            "turns": 0,
+            "get_all_calls": 0,
+            "docs_read": 0,
+            "hint_misses": 0,
+            "flushes": 0,
+            "docs_written": 0,
+            "order_writes_skipped": 0,
+            "flush_errors": 0
+        }
+
+    def _user_ref(self, sender_id: str):
+        return self.db.collection('users').document(sender_id)
+
+    def _session_ref(self, sender_id: str, session_id: str):
+        return self.db.collection('conversations').document(sender_id).collection('sessions').document(session_id)
+
+    def _order_ref(self, sender_id: str, session_id: str):
+        return self.db.collection('orders').document(sender_id).collection('sessions').document(session_id)
+
+    async def _get_all(self, refs: List[Any]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Читает документы одним запросом; возвращает {путь: данные или None}"""
+        loop = asyncio.get_running_loop()
+        snapshots = await loop.run_in_executor(None, lambda: list(self.db.get_all(refs)))
+        self._metrics["get_all_calls"] += 1
+        self._metrics["docs_read"] += len(refs)
+        return {
+            snapshot.reference.path: (snapshot.to_dict() or {}) if snapshot.exists else None
+            for snapshot in snapshots
+        }
+
+    async def load(self, sender_id: str) -> TurnContext:
+        """Читает пользователя, его текущую сессию и заказ"""
+        self._metrics["turns"] += 1
+        if self.db is None:
+            ctx = TurnContext(self, sender_id, "", None, None, None)
+            ctx.start_session(self.session_service.generate_session_id(sender_id))
+            return ctx
+
+        user_ref = self._user_ref(sender_id)
+        refs = [user_ref]
+        hint = self._session_hints.get(sender_id)
+        if hint:
+            refs += [self._session_ref(sender_id, hint), self._order_ref(sender_id, hint)]
+        docs = await self._get_all(refs)
+        user_data = docs.get(user_ref.path)
+        if self.activity_index is not None:
+            self.activity_index.prime(sender_id, user_data)
+
+        session_id = SessionService.active_session_id(user_data)
+        new_session = session_id is None
+        if new_session:
+            session_id = self.session_service.generate_session_id(sender_id)
+            print(f"[TURN_CONTEXT] Новая сессия {session_id} для {sender_id}")
+
+        session_data = order_data = None
+        if not new_session:
+            session_ref = self._session_ref(sender_id, session_id)
+            order_ref = self._order_ref(sender_id, session_id)
+            if session_id != hint:
+                self._metrics["hint_misses"] += 1
+                docs.update(await self._get_all([session_ref, order_ref]))
+            session_data = docs.get(session_ref.path)
+            order_data = docs.get(order_ref.path)
+
+        ctx = TurnContext(self, sender_id, session_id, user_data, session_data, order_data)
+        if new_session:
+            ctx.start_session(session_id)
+        self.remember_session(sender_id, session_id)
+        return ctx
+
+    def remember_session(self, sender_id: str, session_id: str):
+        self._session_hints[sender_id] = session_id
+        self._session_hints.move_to_end(sender_id)
+        while len(self._session_hints) > self.max_senders:
+            self._session_hints.popitem(last=False)
+
+    async def flush(self, ctx: TurnContext):
+        user_updates, session_updates, order_updates = ctx._take_updates()
+        if self.db is None or not (user_updates or session_updates or order_updates):
+            return
+
+        batch = self.db.batch()
+        writes = 0
+        if user_updates:
+            batch.set(self._user_ref(ctx.sender_id), {**user_updates, 'updated_at': firestore.SERVER_TIMESTAMP}, merge=True)
+            writes += 1
+        if session_updates:
+            batch.set(self._session_ref(ctx.sender_id, ctx.session_id), session_updates, merge=True)
+            writes += 1
+        if order_updates:
+            # set(merge), а не update: если заказ удалили параллельно, update упал бы с NotFound
+            # и отменил весь batch вместе с записями users и сессии. Идентификаторы пишутся
+            # всегда, чтобы восстановленный документ оставался опознаваемым заказом.
+            batch.set(self._order_ref(ctx.sender_id, ctx.session_id), {
+                'order_id': ctx.session_id,
+                'session_id': ctx.session_id,
+                'sender_id': ctx.sender_id,
+                **order_updates
+            }, merge=True)
+            writes += 1
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, batch.commit)
+            self._metrics["flushes"] += 1
+            self._metrics["docs_written"] += writes
+        except Exception as e:
+            # Изменения остаются в контексте: следующий flush повторит запись
+            ctx._restore_updates(user_updates, session_updates, order_updates)
+            self._metrics["flush_errors"] += 1
+            print(f"[TURN_CONTEXT] Ошибка записи {ctx.sender_id}/{ctx.session_id}: {e}")
+            raise
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Чтения и записи Firestore на ход диалога"""
+        turns = self._metrics["turns"]
+        return {
+            **self._metrics,
+            "docs_read_per_turn": round(self._metrics["docs_read"] / turns, 2) if turns else 0.0,
+            "cached_senders": len(self._session_hints)
+        }
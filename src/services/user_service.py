@@ -8,8 +8,8 @@ from src.utils.logging_decorator import log_function
 from typing import Optional
 
 class UserService:
-    def __init__(self):
-        self.repo = UserRepository()
+    def __init__(self, db=None):
+        self.repo = UserRepository(db)
 
     @log_function("user_service")
     async def create_user(self, user: User) -> Optional[str]:
@@ -0,0 +1,57 @@
+import pytest
+from unittest.mock import MagicMock
+from google.cloud import firestore
+from src.services.activity_index import LastActivityIndex
+from src.services.turn_context import TurnContext
+
+
+def make_db(user_data):
+    doc = MagicMock()
+    doc.exists = user_data is not None
+    doc.to_dict.return_value = user_data
+    db = MagicMock()
+    db.collection.return_value.document.return_value.get.return_value = doc
+    return db
+
+
+@pytest.mark.asyncio
+async def test_stale_check_reads_users_once_then_serves_from_memory():
+    db = make_db({"sender_id": "7900", "last_message_ts": 1700000100, "last_wamid": "wamid.2"})
+    index = LastActivityIndex(db)
+
+    assert await index.is_superseded("7900", 1700000000) is True
+    assert await index.is_superseded("7900", 1700000200) is False
+    metrics = index.get_metrics()
+    assert metrics["store_reads"] == 1
+    assert metrics["memory_hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_unknown_user_cached_as_no_activity():
+    index = LastActivityIndex(make_db(None))
+    assert await index.get_last("7900") == (0, None)
+    assert await index.get_last("7900") == (0, None)
+    assert index.get_metrics()["store_reads"] == 1
+
+
+@pytest.mark.asyncio
+async def test_observe_keeps_newest_message():
+    index = LastActivityIndex()
+    index.observe("7900", 200, "wamid.new")
+    index.observe("7900", 100, "wamid.old")
+    assert await index.get_last("7900") == (200, "wamid.new")
+
+
+def test_turn_context_writes_index_with_maximum_transform():
+    index = LastActivityIndex()
+    loader = MagicMock(activity_index=index)
+    ctx = TurnContext(loader, "7900", "s1", {"sender_id": "7900", "last_message_ts": 150}, None, None)
+
+    ctx.record_inbound(100, "wamid.old")
+    assert ctx.dirty is False
+
+    ctx.record_inbound(200, "wamid.new")
+    user_updates, _, _ = ctx._take_updates()
+    assert isinstance(user_updates["last_message_ts"], firestore.Maximum)
+    assert user_updates["last_wamid"] == "wamid.new"
+    assert index._entries["7900"] == (200, "wamid.new")
@@ -1,7 +1,7 @@
 import pytest
 from unittest.mock import patch, MagicMock, AsyncMock
 from src.services.ai_service import AIService
-from src.utils.ai_utils import format_conversation_for_ai, parse_ai_response, format_catalog_for_ai, get_fallback_text
+from src.utils.ai_utils import format_conversation_for_ai, parse_ai_response, decode_ai_response, format_catalog_for_ai, get_fallback_text
 from src.tests.utils.test_helpers import show_progress
 
 @pytest.fixture
@@ -9,7 +9,15 @@ def ai_service():
     # Используем тестовый ключ и моки
     with patch('src.services.ai_service.genai.configure'):
         with patch('src.services.ai_service.CatalogService'):
-            return AIService("test_api_key")
+            service = AIService("test_api_key")
+    service.catalog_service.ensure_loaded = AsyncMock(return_value=[])
+    # Модели всех задач подменены - тесты не ходят в Gemini, даже если запрос не замокан
+    for task in service.models.specs:
+        offline_model = MagicMock()
+        offline_model.generate_content_async = AsyncMock(side_effect=ConnectionError("Gemini недоступен в тестах"))
+        service.models.set_model(task, offline_model)
+    service.model = service.models.model("chat")
+    return service
 
 @show_progress("Инициализация AIService")
 def test_init(ai_service):
@@ -17,82 +25,92 @@ def test_init(ai_service):
     assert ai_service.logger is not None
 
 @show_progress("Определение языка - русский")
-def test_detect_language_ru(ai_service):
-    result = ai_service.detect_language("Привет, как дела?")
+@pytest.mark.asyncio
+async def test_detect_language_ru(ai_service):
+    result = await ai_service.detect_language("Привет, как дела?")
     assert result == "ru"
 
 @show_progress("Определение языка - английский")
-def test_detect_language_en(ai_service):
-    result = ai_service.detect_language("Hello, how are you?")
+@pytest.mark.asyncio
+async def test_detect_language_en(ai_service):
+    result = await ai_service.detect_language("Hello, how are you?")
     assert result == "en"
 
 @show_progress("Определение языка - тайский")
-def test_detect_language_th(ai_service):
-    result = ai_service.detect_language("สวัสดีครับ")
+@pytest.mark.asyncio
+async def test_detect_language_th(ai_service):
+    result = await ai_service.detect_language("สวัสดีครับ")
     assert result == "th"
 
 @show_progress("Определение языка - авто")
-def test_detect_language_auto(ai_service):
-    result = ai_service.detect_language("12345")
+@pytest.mark.asyncio
+async def test_detect_language_auto(ai_service):
+    result = await ai_service.detect_language("12345")
     assert result == "auto"
 
-@patch('src.services.ai_service.genai.GenerativeModel')
-def test_translate_text_success(mock_model_class, ai_service):
-    # Мокаем ответ от Gemini
+@pytest.mark.asyncio
+async def test_translate_text_success(ai_service):
+    # Мокаем ответ от Gemini (модель задачи берется из реестра моделей)
     mock_response = MagicMock()
     mock_response.text = "Hello"
     mock_model = MagicMock()
-    mock_model.generate_content.return_value = mock_response
-    mock_model_class.return_value = mock_model
+    mock_model.generate_content_async = AsyncMock(return_value=mock_response)
+    ai_service.models.set_model("translate", mock_model)
     
-    result = ai_service.translate_text("Привет", "ru", "en")
+    result = await ai_service.translate_text("Привет", "ru", "en")
     assert result == "Hello"
 
-def test_translate_text_same_language(ai_service):
-    result = ai_service.translate_text("Hello", "en", "en")
+@pytest.mark.asyncio
+async def test_translate_text_same_language(ai_service):
+    result = await ai_service.translate_text("Hello", "en", "en")
     assert result == "Hello"
 
-def test_translate_text_empty(ai_service):
-    result = ai_service.translate_text("", "ru", "en")
+@pytest.mark.asyncio
+async def test_translate_text_empty(ai_service):
+    result = await ai_service.translate_text("", "ru", "en")
     assert result == ""
 
+@pytest.mark.asyncio
 @patch('src.services.ai_service.genai.GenerativeModel')
-def test_translate_text_error(mock_model_class, ai_service):
+async def test_translate_text_error(mock_model_class, ai_service):
     # Мокаем ошибку
     mock_model = MagicMock()
-    mock_model.generate_content.side_effect = Exception("API Error")
+    mock_model.generate_content_async = AsyncMock(side_effect=Exception("API Error"))
     mock_model_class.return_value = mock_model
     
-    result = ai_service.translate_text("Привет", "ru", "en")
+    result = await ai_service.translate_text("Привет", "ru", "en")
     assert result == "Привет"  # Возвращает исходный текст при ошибке
 
-def test_translate_user_message_ru(ai_service):
-    with patch.object(ai_service, 'translate_text') as mock_translate:
+@pytest.mark.asyncio
+async def test_translate_user_message_ru(ai_service):
+    with patch.object(ai_service, 'translate_text', new_callable=AsyncMock) as mock_translate:
         mock_translate.return_value = "Hello"
         
-        text, text_en, text_thai = ai_service.translate_user_message("Привет", "ru")
+        text, text_en, text_thai = await ai_service.translate_user_message("Привет", "ru")
         
         assert text == "Привет"
         assert text_en == "Hello"
         assert text_thai == "Hello"
 
-def test_translate_user_message_en(ai_service):
-    with patch.object(ai_service, 'translate_text') as mock_translate:
+@pytest.mark.asyncio
+async def test_translate_user_message_en(ai_service):
+    with patch.object(ai_service, 'translate_text', new_callable=AsyncMock) as mock_translate:
         mock_translate.return_value = "Привет"
         
-        text, text_en, text_thai = ai_service.translate_user_message("Hello", "en")
+        text, text_en, text_thai = await ai_service.translate_user_message("Hello", "en")
         
         assert text == "Hello"
         assert text_en == "Hello"
         assert text_thai == "Привет"
 
-def test_translate_user_message_auto(ai_service):
-    with patch.object(ai_service, 'detect_language') as mock_detect:
+@pytest.mark.asyncio
+async def test_translate_user_message_auto(ai_service):
+    with patch.object(ai_service, 'detect_language', new_callable=AsyncMock) as mock_detect:
         mock_detect.return_value = 'ru'
-        with patch.object(ai_service, 'translate_text') as mock_translate:
+        with patch.object(ai_service, 'translate_text', new_callable=AsyncMock) as mock_translate:
             mock_translate.return_value = "Hello"
             
-            text, text_en, text_thai = ai_service.translate_user_message("Привет", "auto")
+            text, text_en, text_thai = await ai_service.translate_user_message("Привет", "auto")
             
             mock_detect.assert_called_once_with("Привет")
             assert text == "Привет"
@@ -220,7 +238,7 @@ async def test_generate_response_success(ai_service):
             mock_response = MagicMock()
             mock_response.text = '{"text": "Здравствуйте!", "text_en": "Hello!", "text_thai": "สวัสดี!", "command": null}'
             mock_model = MagicMock()
-            mock_model.generate_content.return_value = mock_response
+            mock_model.generate_content_async = AsyncMock(return_value=mock_response)
             mock_model_class.return_value = mock_model
             
             text, text_en, text_thai, command = await ai_service.generate_response(messages, "ru")
@@ -236,16 +254,13 @@ async def test_generate_response_empty_history(ai_service):
     with patch.object(ai_service.catalog_service, 'get_products') as mock_get_products:
         mock_get_products.return_value = []
         
-        # Мокаем Gemini
-        with patch('src.services.ai_service.genai.GenerativeModel') as mock_model_class:
-            mock_response = MagicMock()
-            mock_response.text = '{"text": "Конечно! Чем могу помочь?", "text_en": "Of course! How can I help?", "text_thai": "แน่นอน! ฉันสามารถช่วยคุณได้อย่างไร?", "command": null}'
-            mock_model = MagicMock()
-            mock_model.generate_content.return_value = mock_response
-            mock_model_class.return_value = mock_model
+        # Мокаем Gemini (запросы идут через общий шлюз, модель создается при инициализации)
+        with patch.object(ai_service.gemini, 'generate_text', new_callable=AsyncMock) as mock_generate:
+            mock_generate.return_value = '{"text": "Конечно! Чем могу помочь?", "text_en": "Of course! How can I help?", "text_thai": "แน่นอน! ฉันสามารถช่วยคุณได้อย่างไร?", "command": null}'
             
             text, text_en, text_thai, command = await ai_service.generate_response([], "ru")
             
+            mock_generate.assert_awaited_once()
             assert "Конечно" in text or "Of course" in text_en
 
 @pytest.mark.asyncio
@@ -291,4 +306,92 @@ def test_generate_response_sync_error(ai_service):
     with patch.object(ai_service.model, 'generate_content', side_effect=Exception("API Error")):
         result = ai_service.generate_response_sync(messages, "ru")
         
-        assert "Извините" in result or "ошибка" in result 
\ No newline at end of file
+        assert "Извините" in result or "ошибка" in result
+
+
+@pytest.mark.asyncio
+async def test_detect_and_translate_single_call(ai_service):
+    response = '{"language": "ru", "confidence": 0.97, "text_en": "I want roses", "text_thai": "ฉันต้องการดอกกุหลาบ"}'
+    with patch.object(ai_service.gemini, 'generate_text', new_callable=AsyncMock) as mock_generate:
+        mock_generate.return_value = response
+        result = await ai_service.detect_and_translate("Хочу розы", "auto")
+
+    mock_generate.assert_called_once()
+    assert result['language'] == 'ru'
+    assert result['text'] == "Хочу розы"
+    assert result['text_en'] == "I want roses"
+    assert result['text_thai'] == "ฉันต้องการดอกกุหลาบ"
+
+
+@pytest.mark.asyncio
+async def test_detect_and_translate_keeps_known_language(ai_service):
+    response = '{"language": "th", "confidence": 0.5, "text_en": "Hello!", "text_thai": "สวัสดี"}'
+    with patch.object(ai_service.gemini, 'generate_text', new_callable=AsyncMock) as mock_generate:
+        mock_generate.return_value = response
+        result = await ai_service.detect_and_translate("Hello!", "en")
+
+    assert result['language'] == 'en'
+    assert result['text_en'] == "Hello!"
+    assert result['text_thai'] == "สวัสดี"
+
+
+@pytest.mark.asyncio
+async def test_detect_and_translate_error_falls_back(ai_service):
+    with patch.object(ai_service.gemini, 'generate_text', new_callable=AsyncMock) as mock_generate:
+        mock_generate.side_effect = Exception("API Error")
+        result = await ai_service.detect_and_translate("Привет", "auto")
+
+    assert result['text'] == result['text_en'] == result['text_thai'] == "Привет"
+
+
+@pytest.mark.asyncio
+async def test_detect_and_translate_skips_non_text(ai_service):
+    with patch.object(ai_service.gemini, 'generate_text', new_callable=AsyncMock) as mock_generate:
+        result = await ai_service.detect_and_translate("123 👍", "ru")
+
+    mock_generate.assert_not_called()
+    assert result['text_en'] == "123 👍"
+
+
+def test_decode_ai_response_schema_output():
+    text, text_en, text_thai, command, error = decode_ai_response(
+        '{"text": "Вы выбрали букет\\nClouds", "text_en": "You chose Clouds", "text_thai": "",'
+        ' "command": {"type": "save_order_info", "bouquet": "Clouds", "retailer_id": "r1", "address": null}}'
+    )
+    assert error is None
+    assert text == "Вы выбрали букет\\nClouds"
+    assert text_thai == text
+    # null в необязательных полях не должен затирать данные заказа
+    assert command == {"type": "save_order_info", "bouquet": "Clouds", "retailer_id": "r1"}
+
+
+def test_decode_ai_response_rejects_invalid():
+    assert decode_ai_response('{"text": "", "command": null}')[4] == "empty_text"
+    assert decode_ai_response('{"text": "ok", "command": {"type": "drop_tables"}}')[4] == "unknown_command"
+    assert decode_ai_response('{"text": "ok", "command": "send_catalog"}')[4] == "invalid_command"
+    assert decode_ai_response('{"text": "обрыв')[4].startswith("invalid_json")
+
+
+@pytest.mark.asyncio
+async def test_generate_response_retries_are_bounded(ai_service):
+    ai_service.prompt_assembler = MagicMock()
+    ai_service.prompt_assembler.build_prompt.return_value = "prompt"
+    messages = [{"role": "user", "content": "Хочу розы"}]
+    with patch.object(ai_service.gemini, 'generate_text', new_callable=AsyncMock) as mock_generate:
+        # Ответ без команды валиден - повторного запроса нет
+        mock_generate.return_value = '{"text": "Какие розы?", "text_en": "Which roses?", "text_thai": "x", "command": null}'
+        result = await ai_service.generate_response(messages, user_lang='ru')
+        assert result == ("Какие розы?", "Which roses?", "x", None)
+        assert mock_generate.await_count == 1
+
+        mock_generate.reset_mock()
+        mock_generate.return_value = '{"text": "", "text_en": "", "text_thai": "", "command": null}'
+        with patch.object(ai_service, '_log_ai_error', new_callable=AsyncMock):
+            result = await ai_service.generate_response(messages, user_lang='ru')
+        assert result == ("", "", "", None)
+        assert mock_generate.await_count == ai_service.reply_max_attempts
+
+    metrics = ai_service.get_reply_metrics()
+    assert metrics["replies"] == 2
+    assert metrics["failed"] == 1
+    assert metrics["invalid"]["empty_text"] == ai_service.reply_max_attempts
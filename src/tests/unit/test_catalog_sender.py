@@ -8,6 +8,7 @@ def catalog_sender():
     with patch('src.services.catalog_sender.CatalogService') as mock_catalog_service:
         sender = CatalogSender()
         sender.catalog_service = mock_catalog_service
+        sender.catalog_service.ensure_loaded = AsyncMock(return_value=[])
         return sender
 
 
@@ -45,4 +46,87 @@ async def test_get_catalog_messages_error(catalog_sender):
     messages = await catalog_sender.get_catalog_messages("+1234567890", "user_123", "session_456")
     assert len(messages) == 1
     assert messages[0]["type"] == "text"
-    assert "ошибка" in messages[0]["content"] 
\ No newline at end of file
+    assert "ошибка" in messages[0]["content"] 
+
+def make_sender(products, concurrency=3):
+    from unittest.mock import MagicMock
+    from src.utils.rate_limiter import TokenBucket
+
+    catalog_service = MagicMock()
+    catalog_service.get_available_products.return_value = products
+    catalog_service.get_products.return_value = products
+    catalog_service.ensure_loaded = AsyncMock(return_value=products)
+    whatsapp_client = MagicMock()
+    whatsapp_client.send_limiter = TokenBucket(rate=1000, capacity=1000)
+    message_service = MagicMock()
+    message_service.add_messages_to_conversation = AsyncMock(return_value=True)
+    message_service.add_message_to_conversation = AsyncMock()
+    sender = CatalogSender(catalog_service=catalog_service, whatsapp_client=whatsapp_client, message_service=message_service)
+    sender.concurrency = concurrency
+    return sender
+
+
+@pytest.mark.asyncio
+async def test_send_catalog_fan_out_keeps_order_and_batches_writes():
+    import asyncio
+
+    products = [{"name": f"Bouquet {i}", "price": "1000", "image_url": f"https://img/{i}.jpg"} for i in range(6)]
+    sender = make_sender(products)
+    start_order = []
+    in_flight = 0
+    max_in_flight = 0
+
+    async def send_image(to_number, image_url, caption, session_id):
+        nonlocal in_flight, max_in_flight
+        start_order.append(image_url)
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        # Более ранние товары отвечают дольше, чтобы проверить порядок сохранения
+        await asyncio.sleep(0.01 * (6 - len(start_order)))
+        in_flight -= 1
+        return f"wamid.{image_url[-5]}"
+
+    sender.whatsapp_client.send_image_with_caption = AsyncMock(side_effect=send_image)
+
+    result = await sender.send_catalog("user_123", "session_456")
+
+    assert result is True
+    assert start_order == [f"https://img/{i}.jpg" for i in range(6)]
+    assert 1 < max_in_flight <= 3
+    sender.message_service.add_message_to_conversation.assert_not_called()
+    sender.message_service.add_messages_to_conversation.assert_awaited_once()
+    saved = sender.message_service.add_messages_to_conversation.call_args[0][0]
+    assert [m.wa_message_id for m in saved] == [f"wamid.{i}" for i in range(6)]
+    assert [m.timestamp for m in saved] == sorted(m.timestamp for m in saved)
+
+
+@pytest.mark.asyncio
+async def test_send_catalog_sequential_when_concurrency_is_one():
+    import asyncio
+
+    products = [{"name": f"Bouquet {i}", "price": "1000", "image_url": f"https://img/{i}.jpg"} for i in range(4)]
+    sender = make_sender(products, concurrency=1)
+    delivered = []
+
+    async def send_image(to_number, image_url, caption, session_id):
+        # Более ранние товары отвечают дольше: при параллельной отправке порядок бы нарушился
+        await asyncio.sleep(0.01 * (4 - len(delivered)))
+        delivered.append(image_url)
+        return f"wamid.{image_url[-5]}"
+
+    sender.whatsapp_client.send_image_with_caption = AsyncMock(side_effect=send_image)
+    await sender.send_catalog("user_123", "session_456")
+
+    assert delivered == [f"https://img/{i}.jpg" for i in range(4)]
+
+
+@pytest.mark.asyncio
+async def test_send_catalog_skips_failed_products_in_batch():
+    products = [{"name": f"Bouquet {i}", "price": "1000", "image_url": f"https://img/{i}.jpg"} for i in range(3)]
+    sender = make_sender(products)
+    sender.whatsapp_client.send_image_with_caption = AsyncMock(side_effect=["wamid.0", None, "wamid.2"])
+
+    await sender.send_catalog("user_123", "session_456")
+
+    saved = sender.message_service.add_messages_to_conversation.call_args[0][0]
+    assert [m.wa_message_id for m in saved] == ["wamid.0", "wamid.2"]
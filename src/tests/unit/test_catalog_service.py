@@ -11,7 +11,7 @@ def catalog_service():
 def test_init(catalog_service):
     assert catalog_service.catalog_id == "test_catalog_id"
     assert catalog_service.access_token == "test_token"
-    assert catalog_service._cache is None
+    assert catalog_service.store is CatalogService("test_catalog_id", "other_token").store
 
 
 @pytest.mark.asyncio
@@ -200,11 +200,10 @@ async def test_search_products_empty_query(catalog_service):
 
 
 def test_clear_cache(catalog_service):
-    # Устанавливаем кэш
-    catalog_service._cache = [{"id": "1", "name": "Test"}]
-    catalog_service._cache_time = "2024-01-01"
-    
+    # Кэш живет в общем CatalogStore: очистка помечает снимок устаревшим
+    catalog_service.store._apply([{"id": "1", "name": "Test"}])
+    assert catalog_service.store.is_stale() is False
+
     catalog_service.clear_cache()
-    
-    assert catalog_service._cache is None
-    assert catalog_service._cache_time is None 
\ No newline at end of file
+
+    assert catalog_service.store.is_stale() is True
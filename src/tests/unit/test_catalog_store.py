@@ -0,0 +1,196 @@
+import asyncio
+import httpx
+import pytest
+from src.services.catalog_store import CatalogStore
+from src.services.catalog_service import CatalogService
+
+
+def make_store(handler, ttl_seconds: float = 300) -> CatalogStore:
+    http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return CatalogStore("catalog_1", "token", ttl_seconds=ttl_seconds, page_limit=2, http_client=http_client)
+
+
+def paged_handler(pages, calls):
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(str(request.url))
+        index = int(request.url.params.get("page", 0))
+        body = {"data": pages[index]}
+        if index + 1 < len(pages):
+            body["paging"] = {"next": f"https://graph.facebook.com/v23.0/catalog_1/products?page={index + 1}"}
+        return httpx.Response(200, json=body)
+    return handler
+
+
+@pytest.mark.asyncio
+async def test_refresh_follows_pagination():
+    calls = []
+    pages = [[{"id": "1", "retailer_id": "r1"}, {"id": "2", "retailer_id": "r2"}], [{"id": "3", "retailer_id": "r3"}]]
+    store = make_store(paged_handler(pages, calls))
+
+    assert await store.refresh() is True
+    assert [p["id"] for p in store.get_products()] == ["1", "2", "3"]
+    assert len(calls) == 2
+    assert "limit=2" in calls[0]
+    metrics = store.get_metrics()
+    assert metrics["version"] == 1
+    assert metrics["last_pages"] == 2
+    assert metrics["refresh_latency"]["count"] == 1
+
+
+@pytest.mark.asyncio
+async def test_stale_read_returns_old_snapshot_and_refreshes_in_background():
+    calls = []
+    pages = [[{"id": "1", "name": "Old"}]]
+    store = make_store(paged_handler(pages, calls), ttl_seconds=0)
+    await store.refresh()
+
+    pages[0] = [{"id": "1", "name": "New"}]
+    products = store.get_products()
+    assert products[0]["name"] == "Old"
+    assert store.get_metrics()["refreshing"] is True
+
+    await store._refresh_task
+    assert store.get_products()[0]["name"] == "New"
+    assert store.version == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_refresh_keeps_previous_version():
+    state = {"fail": False}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if state["fail"]:
+            return httpx.Response(500, json={})
+        return httpx.Response(200, json={"data": [{"id": "1"}]})
+
+    store = make_store(handler)
+    await store.refresh()
+    state["fail"] = True
+
+    assert await store.refresh() is False
+    assert store.get_products() == [{"id": "1"}]
+    assert store.version == 1
+    assert store.get_metrics()["refresh_errors"] == 1
+
+
+@pytest.mark.asyncio
+async def test_version_unchanged_when_catalog_unchanged():
+    store = make_store(lambda request: httpx.Response(200, json={"data": [{"id": "1"}]}))
+    await store.refresh()
+    await store.refresh()
+    assert store.version == 1
+    assert store.get_metrics()["refreshes"] == 2
+
+
+@pytest.mark.asyncio
+async def test_concurrent_stale_reads_start_single_refresh():
+    calls = []
+    store = make_store(paged_handler([[{"id": "1"}]], calls))
+    for _ in range(5):
+        assert store.get_products() == []
+    await store._refresh_task
+    assert len(calls) == 1
+    assert store.get_metrics()["cold_reads"] == 5
+
+
+@pytest.mark.asyncio
+async def test_catalog_services_share_store():
+    store = make_store(lambda request: httpx.Response(200, json={"data": [{"id": "1", "retailer_id": "r1"}]}))
+    await store.refresh()
+    first = CatalogService("catalog_1", "token", store=store)
+    second = CatalogService("catalog_1", "token", store=store)
+
+    assert first.validate_product("r1")["valid"] is True
+    assert second.get_products() is first.get_products()
+    assert first.version == 1
+
+
+@pytest.mark.asyncio
+async def test_indexes_rebuilt_on_refresh():
+    state = {"data": [{"id": "1", "retailer_id": "r1", "name": "Red Roses"}]}
+    store = make_store(lambda request: httpx.Response(200, json={"data": state["data"]}))
+    await store.refresh()
+    assert store.get_by_retailer_id("r1")["id"] == "1"
+    assert store.get_by_id("1")["name"] == "Red Roses"
+
+    state["data"] = [{"id": "2", "retailer_id": "r2", "name": "Tulips", "availability": "out of stock"}]
+    await store.refresh()
+    assert store.get_by_retailer_id("r1") is None
+    assert store.get_by_retailer_id("r2")["id"] == "2"
+    assert store.get_available() == []
+    assert store.get_metrics()["index"]["retailer_ids"] == 1
+
+
+@pytest.mark.asyncio
+async def test_search_by_word_prefix_and_substring():
+    products = [
+        {"id": "1", "name": "Букет «Нежность»", "description": "Розы и эустома"},
+        {"id": "2", "name": "Red Roses", "description": "25 red roses"},
+        {"id": "3", "name": "White Lilies", "description": "Fresh lilies"},
+        {"id": "4", "name": "Ёлочка", "description": ""},
+    ]
+    store = make_store(lambda request: httpx.Response(200, json={"data": products}))
+    await store.refresh()
+
+    assert [p["id"] for p in store.search("нежн")] == ["1"]
+    assert [p["id"] for p in store.search("red ros")] == ["2"]
+    assert [p["id"] for p in store.search("RO")] == ["2"]
+    assert [p["id"] for p in store.search("елочка")] == ["4"]
+    # Совпадение в середине слова, как при прежнем поиске по подстроке
+    assert [p["id"] for p in store.search("лочк")] == ["4"]
+    assert [p["id"] for p in store.search("ilie")] == ["3"]
+    assert [p["id"] for p in store.search("25 red")] == ["2"]
+    assert store.search("orchid") == []
+    assert len(store.search("")) == 4
+
+
+@pytest.mark.asyncio
+async def test_cold_load_waits_for_single_fetch():
+    calls = []
+    store = make_store(paged_handler([[{"id": "1", "name": "Rose"}]], calls))
+
+    results = await asyncio.gather(*(store.load() for _ in range(5)))
+
+    assert all(products == [{"id": "1", "name": "Rose"}] for products in results)
+    assert len(calls) == 1
+    assert store.get_metrics()["cold_reads"] == 5
+
+
+@pytest.mark.asyncio
+async def test_force_refresh_awaits_fetch():
+    calls = []
+    pages = [[{"id": "1", "name": "Old"}]]
+    store = make_store(paged_handler(pages, calls))
+    service = CatalogService("catalog_1", "token", store=store)
+    await service.ensure_loaded()
+
+    pages[0] = [{"id": "1", "name": "New"}]
+    assert (await service.ensure_loaded(force_refresh=True))[0]["name"] == "New"
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_substring_search_checks_only_trigram_candidates():
+    products = [{"id": str(i), "name": f"Bouquet {i}", "description": ""} for i in range(50)]
+    products.append({"id": "lily", "name": "White Lilies", "description": ""})
+    store = make_store(lambda request: httpx.Response(200, json={"data": products}))
+    await store.refresh()
+    index = store._index
+
+    class CountingTexts(list):
+        reads = 0
+
+        def __getitem__(self, item):
+            CountingTexts.reads += 1
+            return list.__getitem__(self, item)
+
+    index.texts = CountingTexts(index.texts)
+    assert [p["id"] for p in store.search("ilie")] == ["lily"]
+    assert CountingTexts.reads == 1
+    assert store.search("xyz") == []
+
+
+def test_filter_available_products():
+    service = CatalogService("catalog_1", "token", store=CatalogStore("catalog_1", "token"))
+    products = [{"id": "1", "availability": "in stock"}, {"id": "2", "availability": "out of stock"}, {"id": "3"}]
+    assert [p["id"] for p in service.filter_available_products(products)] == ["1", "3"]
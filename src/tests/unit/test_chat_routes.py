@@ -0,0 +1,44 @@
+from datetime import datetime
+from unittest.mock import patch, AsyncMock, MagicMock
+from fastapi import FastAPI
+from fastapi.responses import HTMLResponse
+from fastapi.testclient import TestClient
+from src.routes import chat_routes
+from src.repositories.message_repository import HistoryCursor
+
+
+def make_client():
+    app = FastAPI()
+    app.include_router(chat_routes.router)
+    return TestClient(app)
+
+
+def test_chat_history_renders_messages_and_earlier_link():
+    messages = [
+        {"role": "user", "content": "Хочу букет роз", "timestamp": "2026-10-17T10:00:00", "session_id": "s1"},
+        {"role": "assistant", "content": "Вот наш каталог", "timestamp": "2026-10-17T10:00:05", "session_id": "s1"},
+    ]
+    cursor = HistoryCursor(datetime(2026, 10, 17, 9, 0, 0), "msg_1")
+    render = MagicMock(return_value=HTMLResponse("ok"))
+    with patch.object(chat_routes.message_service, "get_history_page",
+                      AsyncMock(return_value=(messages, cursor))) as get_page, \
+         patch.object(chat_routes.session_service, "get_user_info",
+                      AsyncMock(return_value={"name": "Анна", "phone": "7900"})), \
+         patch.object(chat_routes.session_service, "get_user_language", AsyncMock(return_value="ru")), \
+         patch.object(chat_routes.templates, "TemplateResponse", render):
+        response = make_client().get("/chat/history/7900")
+
+    assert response.status_code == 200
+    template, context = render.call_args.args
+    assert template == "chat_history.html"
+    assert "Хочу букет роз" in context["messages_html"]
+    assert "before=2026-10-17T09%3A00%3A00%7Cmsg_1" in context["messages_html"]
+    get_page.assert_awaited_once()
+
+
+def test_history_cursor_round_trip_and_legacy_iso():
+    cursor = HistoryCursor(datetime(2026, 10, 17, 9, 0, 0), "msg_1")
+
+    assert chat_routes.parse_history_cursor(cursor.encode()) == cursor
+    assert chat_routes.parse_history_cursor("2026-10-17T09:00:00") == HistoryCursor(datetime(2026, 10, 17, 9, 0, 0))
+    assert chat_routes.parse_history_cursor("garbage") is None
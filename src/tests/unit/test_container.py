@@ -0,0 +1,59 @@
+import pytest
+from unittest.mock import patch, MagicMock
+from src.services.container import ServiceContainer, get_services
+from src.services.message_processor import MessageProcessor
+
+
+@pytest.fixture
+def services():
+    with patch('src.services.container.firestore.Client') as mock_firestore:
+        mock_firestore.return_value = MagicMock()
+        container = ServiceContainer()
+        yield container
+
+
+def test_single_firestore_client_shared(services):
+    assert services.message_service.db is services.db
+    assert services.message_service.repo.db is services.db
+    assert services.session_service.db is services.db
+    assert services.user_service.repo.db is services.db
+    assert services.order_service.repo.db is services.db
+    assert services.error_service.error_repository.db is services.db
+
+
+def test_catalog_cache_shared(services):
+    assert services.ai_service.catalog_service is services.catalog_service
+    assert services.command_service.catalog_service is services.catalog_service
+    assert services.catalog_sender.catalog_service is services.catalog_service
+    assert services.command_service.catalog_sender is services.catalog_sender
+
+
+def test_message_processor_uses_shared_services(services):
+    processor = services.message_processor
+    assert isinstance(processor, MessageProcessor)
+    assert processor.whatsapp_client is services.whatsapp_client
+    assert processor.ai_service is services.ai_service
+    assert processor.command_service is services.command_service
+    assert processor.order_service is services.order_service
+
+
+def test_get_services_creates_container_once():
+    request = MagicMock()
+    request.app.state = MagicMock(spec=[])
+    with patch('src.services.container.firestore.Client'):
+        first = get_services(request)
+        second = get_services(request)
+    assert first is second
+
+
+def test_webhook_handler_uses_shared_whatsapp_client(services):
+    from src.handlers.webhook_handler import WebhookHandler
+    assert WebhookHandler(services=services).whatsapp_client is services.whatsapp_client
+
+    # Контейнер, заданный после создания обработчика (как в lifespan приложения)
+    handler = WebhookHandler()
+    handler.services = services
+    assert handler.whatsapp_client is services.whatsapp_client
+
+    client = MagicMock()
+    assert WebhookHandler(services=services, whatsapp_client=client).whatsapp_client is client
@@ -0,0 +1,90 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, MagicMock
+from src.services.conversation_summarizer import ConversationSummarizer, history_tokens, _epoch
+
+
+def make_history(count, start=None):
+    start = start or datetime(2026, 1, 1, 10, 0)
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"сообщение {i} " + "слово " * 20,
+         "timestamp": start + timedelta(minutes=i)}
+        for i in range(count)
+    ]
+
+
+def make_summarizer(state=None, summary="Клиент выбирает розы"):
+    ai_service = MagicMock()
+    ai_service.summarize_conversation = AsyncMock(return_value=summary)
+    session_service = MagicMock()
+    session_service.get_conversation_summary = AsyncMock(return_value=state or {})
+    session_service.save_conversation_summary = AsyncMock()
+    return ConversationSummarizer(ai_service, session_service, threshold_tokens=200, keep_messages=4)
+
+
+@pytest.mark.asyncio
+async def test_short_history_goes_to_prompt_unchanged():
+    summarizer = make_summarizer()
+    history = make_history(3)
+
+    summary, recent = await summarizer.prepare("79001234567", "s1", history)
+    summarizer.schedule_compaction("79001234567", "s1", history)
+    await summarizer.flush()
+
+    assert summary is None and recent == history
+    summarizer.ai_service.summarize_conversation.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_long_history_folds_older_messages():
+    summarizer = make_summarizer()
+    history = make_history(20)
+    assert history_tokens(history) > 200
+
+    await summarizer.prepare("79001234567", "s1", history)
+    summarizer.schedule_compaction("79001234567", "s1", history)
+    await summarizer.flush()
+
+    folded = summarizer.ai_service.summarize_conversation.call_args.args[1]
+    assert len(folded) == 16
+    save_args = summarizer.session_service.save_conversation_summary.call_args.args
+    assert save_args[2] == "Клиент выбирает розы"
+    assert save_args[3] == history[15]["timestamp"]
+
+    # Следующий ход: краткое содержание + сообщения после него, без чтения документа сессии
+    history = history + make_history(1, start=datetime(2026, 1, 1, 11, 0))
+    summary, recent = await summarizer.prepare("79001234567", "s1", history)
+    assert summary == "Клиент выбирает розы"
+    assert recent == history[16:]
+    assert summarizer.session_service.get_conversation_summary.await_count == 1
+    assert summarizer.get_metrics()["compactions"] == 1
+
+
+@pytest.mark.asyncio
+async def test_stored_summary_with_aware_timestamp_and_failure():
+    # Сохраненное время с часовым поясом, время сообщений в истории - наивное локальное
+    until = datetime(2026, 1, 1, 10, 9).astimezone(timezone.utc)
+    summarizer = make_summarizer(state={"summary": "Ранее", "until": until, "folded": 10})
+    summarizer.ai_service.summarize_conversation = AsyncMock(side_effect=RuntimeError("timeout"))
+    history = make_history(30)
+
+    summary, recent = await summarizer.prepare("79001234567", "s1", history)
+    assert summary == "Ранее"
+    assert recent == history[10:]
+
+    summarizer.schedule_compaction("79001234567", "s1", history)
+    await summarizer.flush()
+    assert summarizer.get_metrics()["failures"] == 1
+    summarizer.session_service.save_conversation_summary.assert_not_awaited()
+
+
+def test_naive_timestamp_is_local_time(monkeypatch):
+    import time
+    monkeypatch.setenv("TZ", "Asia/Bangkok")
+    time.tzset()
+    try:
+        naive = datetime(2026, 1, 1, 17, 0)
+        assert _epoch(naive) == _epoch(datetime(2026, 1, 1, 10, 0, tzinfo=timezone.utc))
+    finally:
+        monkeypatch.undo()
+        time.tzset()
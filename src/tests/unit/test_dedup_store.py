@@ -0,0 +1,77 @@
+import pytest
+from unittest.mock import patch
+from src.services.dedup_store import DedupStore, RecentIds
+
+
+class FakeRepository:
+    """processed_wamids, общая для нескольких инстансов"""
+
+    def __init__(self, fail=False):
+        self.claimed = set()
+        self.fail = fail
+
+    async def claim(self, wamid, expires_at):
+        if self.fail:
+            raise RuntimeError("Firestore unavailable")
+        if wamid in self.claimed:
+            return False
+        self.claimed.add(wamid)
+        self.expires_at = expires_at
+        return True
+
+    async def release(self, wamid):
+        self.claimed.discard(wamid)
+
+
+def test_recent_ids_memory_bounded_by_two_generations():
+    recent = RecentIds(window_seconds=600, max_ids=3)
+    for i in range(10):
+        recent.add(f"wamid.{i}")
+    assert len(recent) <= 6
+    assert "wamid.9" in recent and "wamid.0" not in recent
+
+
+def test_recent_ids_expire_after_window():
+    with patch("src.services.dedup_store.time.monotonic", return_value=1000.0):
+        recent = RecentIds(window_seconds=10, max_ids=100)
+        recent.add("wamid.old")
+    with patch("src.services.dedup_store.time.monotonic", return_value=1015.0):
+        assert "wamid.old" in recent  # предыдущее поколение еще помнится
+    with patch("src.services.dedup_store.time.monotonic", return_value=1040.0):
+        assert "wamid.old" not in recent
+
+
+@pytest.mark.asyncio
+async def test_duplicate_detected_in_memory_and_across_instances():
+    repository = FakeRepository()
+    first, second = DedupStore(repository), DedupStore(repository)
+
+    assert await first.claim("wamid.1") is True
+    assert await first.claim("wamid.1") is False
+    assert first.get_metrics()["memory_duplicates"] == 1
+
+    # Повтор пришел на другой инстанс - отсекается через processed_wamids
+    assert await second.claim("wamid.1") is False
+    assert second.get_metrics()["store_duplicates"] == 1
+
+
+@pytest.mark.asyncio
+async def test_store_error_does_not_drop_message():
+    store = DedupStore(FakeRepository(fail=True))
+    assert await store.claim("wamid.1") is True
+    assert await store.claim("wamid.1") is False
+    assert store.get_metrics()["store_errors"] == 1
+
+
+@pytest.mark.asyncio
+async def test_released_claim_accepts_redelivery():
+    repository = FakeRepository()
+    first, second = DedupStore(repository), DedupStore(repository)
+    assert await first.claim("wamid.1") is True
+    assert repository.expires_at.tzinfo is not None
+
+    await first.release("wamid.1")
+    assert await second.claim("wamid.1") is True
+    await second.release("wamid.1")
+    assert await first.claim("wamid.1") is True
+    assert first.get_metrics()["released"] == 1
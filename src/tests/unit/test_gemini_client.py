@@ -0,0 +1,72 @@
+import asyncio
+import pytest
+from unittest.mock import MagicMock
+from src.services.gemini_client import GeminiClient, GeminiTimeoutError
+
+
+class SlowModel:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+
+    async def generate_content_async(self, prompt):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.active -= 1
+        response = MagicMock()
+        response.text = f"  ответ на {prompt}  "
+        return response
+
+
+@pytest.mark.asyncio
+async def test_generate_text_records_latency_per_task():
+    client = GeminiClient(max_concurrency=2, timeout=1)
+    text = await client.generate_text(SlowModel(0), "привет", task="translate")
+
+    assert text == "ответ на привет"
+    metrics = client.get_metrics()
+    assert metrics["calls"] == 1
+    assert metrics["latency"]["translate"]["count"] == 1
+    assert metrics["latency"]["translate.wait"]["count"] == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrency_is_limited():
+    client = GeminiClient(max_concurrency=2, timeout=1)
+    model = SlowModel(0.05)
+
+    await asyncio.gather(*(client.generate(model, str(i)) for i in range(6)))
+
+    assert model.max_active == 2
+    assert client.get_metrics()["max_in_flight"] == 2
+    assert client.get_metrics()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_timeout_raises_and_frees_slot():
+    client = GeminiClient(max_concurrency=1, timeout=0.01)
+
+    with pytest.raises(GeminiTimeoutError):
+        await client.generate(SlowModel(1), "долго")
+
+    assert await client.generate_text(SlowModel(0), "быстро", timeout=1) == "ответ на быстро"
+    assert client.get_metrics()["timeouts"] == 1
+
+
+@pytest.mark.asyncio
+async def test_slow_call_does_not_block_event_loop():
+    client = GeminiClient(max_concurrency=1, timeout=1)
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        for _ in range(5):
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    await asyncio.gather(client.generate(SlowModel(0.1), "x"), ticker())
+    assert ticks == 5
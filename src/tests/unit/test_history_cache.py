@@ -0,0 +1,98 @@
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock
+from src.models.message import Message, MessageRole
+from src.services.history_cache import HistoryCache
+from src.services.message_service import MessageService
+
+
+def make_message(content, role=MessageRole.USER, wa_id=None, session_id="s1"):
+    return Message(sender_id="79001234567", session_id=session_id, role=role, content=content, wa_message_id=wa_id)
+
+
+def test_append_only_after_fill_and_dedup():
+    cache = HistoryCache()
+    cache.append(make_message("до заполнения"))
+    assert cache.get("79001234567", "s1", 10) is None
+
+    cache.fill("79001234567", "s1", [{"role": "user", "content": "привет", "wa_message_id": "w1"}], complete=True)
+    cache.append(make_message("привет", wa_id="w1"))
+    cache.append(make_message("Здравствуйте!", role=MessageRole.ASSISTANT, wa_id="w2"))
+
+    history = cache.get("79001234567", "s1", 10)
+    assert [m["content"] for m in history] == ["привет", "Здравствуйте!"]
+    history[0]["content"] = "изменено"
+    assert cache.get("79001234567", "s1", 10)[0]["content"] == "привет"
+
+
+def test_incomplete_history_and_limits():
+    cache = HistoryCache(max_messages=3)
+    cache.fill("79001234567", "s1", [], complete=True)
+    for i in range(5):
+        cache.append(make_message(f"m{i}", wa_id=f"w{i}"))
+
+    # Хранятся последние 3 сообщения - больше кэш ответить не может
+    assert [m["content"] for m in cache.get("79001234567", "s1", 2)] == ["m3", "m4"]
+    assert cache.get("79001234567", "s1", 10) is None
+
+
+def test_lru_ttl_and_invalidate():
+    cache = HistoryCache(max_sessions=1)
+    cache.fill("a", "s1", [], complete=True)
+    cache.fill("b", "s1", [], complete=True)
+    assert cache.get("a", "s1", 10) is None
+    assert cache.get_metrics()["evictions"] == 1
+
+    cache.invalidate("b", "s1")
+    assert cache.get("b", "s1", 10) is None
+
+    expiring = HistoryCache(ttl_seconds=0)
+    expiring.fill("a", "s1", [], complete=True)
+    assert expiring.get("a", "s1", 10) is None
+    assert expiring.get_metrics()["expired"] == 1
+
+
+@pytest.mark.asyncio
+async def test_dialogue_turn_reads_history_once():
+    service = MessageService(db=MagicMock())
+    service.repo = MagicMock()
+    service.repo.get_conversation_history_by_sender = AsyncMock(return_value=[
+        {"role": "user", "content": "привет", "wa_message_id": "w1"}
+    ])
+    service.repo.add_message_with_transaction_sync = MagicMock(return_value=(True, []))
+    service.repo.add_message_to_conversation = AsyncMock(return_value=True)
+
+    await service.get_conversation_history_for_ai_by_sender("79001234567", "s1", limit=100)
+    service.add_message_with_transaction_sync(make_message("хочу розы", wa_id="w3"), limit=0)
+    await service.add_message_to_conversation(make_message("Какие?", role=MessageRole.ASSISTANT, wa_id="w4"))
+    history = await service.get_conversation_history_for_ai_by_sender("79001234567", "s1", limit=100)
+
+    assert [m["content"] for m in history] == ["привет", "хочу розы", "Какие?"]
+    assert service.repo.get_conversation_history_by_sender.await_count == 1
+
+    # Новая сессия после /newses читается без Firestore
+    service.invalidate_history("79001234567", "s1")
+    service.start_empty_history("79001234567", "s2")
+    assert await service.get_conversation_history_for_ai_by_sender("79001234567", "s2") == []
+    assert service.repo.get_conversation_history_by_sender.await_count == 1
+
+
+def test_update_matches_generated_id_and_stores_utc():
+    cache = HistoryCache()
+    cache.fill("79001234567", "s1", [{"id": "w1", "role": "user", "content": "привет", "wa_message_id": "w1"}],
+               complete=True)
+    # Сообщение без wamid: ID документа выдан заранее (uuid)
+    message = make_message("хочу розы")
+    message.id = "3f2a9c"
+    message.timestamp = datetime(2026, 10, 17, 12, 0, 0)
+    cache.append(message)
+
+    cache.update("79001234567", "s1", "3f2a9c", {"translation_status": "done", "content_en": "I want roses"})
+    cache.update("79001234567", "s1", "w1", {"translation_status": "done"})
+
+    history = cache.get("79001234567", "s1", 10)
+    assert history[0]["translation_status"] == "done"
+    assert history[1]["translation_status"] == "done"
+    assert history[1]["content_en"] == "I want roses"
+    assert history[1]["timestamp"].tzinfo == timezone.utc
+    assert cache.get_metrics()["updates"] == 2
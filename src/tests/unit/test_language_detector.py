@@ -0,0 +1,63 @@
+import pytest
+from unittest.mock import patch, AsyncMock
+from src.services.language_detector import LanguageDetector
+from src.services.ai_service import AIService
+
+
+@pytest.mark.parametrize("text, language", [
+    ("Привет, как дела?", "ru"),
+    ("สวัสดีครับ", "th"),
+    ("안녕하세요", "ko"),
+    ("こんにちは", "ja"),
+    ("你好", "zh"),
+    ("مرحبا", "ar"),
+])
+def test_script_detection(text, language):
+    result = LanguageDetector(threshold=0.8).detect(text)
+    assert result.language == language
+    assert result.method == "script"
+    assert not result.escalate
+
+
+@pytest.mark.parametrize("text, language", [
+    ("Hello, how are you?", "en"),
+    ("Can I pay by card?", "en"),
+    ("Quanto costa il mazzo di rose?", "it"),
+    ("Ich möchte Blumen bestellen", "de"),
+    ("Hola, quiero flores para mañana", "es"),
+])
+def test_latin_detection(text, language):
+    result = LanguageDetector(threshold=0.8).detect(text)
+    assert result.language == language
+    assert not result.escalate
+
+
+def test_low_confidence_escalates_and_counts():
+    detector = LanguageDetector(threshold=0.8)
+    assert detector.detect("ok").escalate
+    # Украинские буквы в кириллице - не уверены, что это русский
+    assert detector.detect("Привіт, як справи?").escalate
+    assert detector.detect("12345").language == "auto"
+    detector.detect("Привет")
+
+    metrics = detector.get_metrics()
+    assert metrics["detections"] == 4
+    assert metrics["escalated"] == 2
+    assert metrics["resolved_locally"] == 1
+    assert metrics["no_letters"] == 1
+    assert metrics["escalation_rate"] == 0.5
+
+
+@pytest.mark.asyncio
+async def test_ai_service_calls_gemini_only_on_escalation():
+    with patch('src.services.ai_service.genai.configure'):
+        ai_service = AIService("test_api_key", catalog_service=AsyncMock(),
+                               language_detector=LanguageDetector(threshold=0.8))
+    with patch.object(ai_service.gemini, 'generate_text', new_callable=AsyncMock) as mock_generate:
+        mock_generate.return_value = '{"language": "en", "confidence": 0.9, "should_ask_confirmation": false}'
+        local = await ai_service.detect_language_with_confidence("สวัสดีครับ")
+        remote = await ai_service.detect_language_with_confidence("ok")
+
+    assert local == {'language': 'th', 'confidence': 0.99, 'should_ask': False}
+    assert remote['language'] == 'en'
+    mock_generate.assert_called_once()
@@ -19,6 +19,8 @@ def message_service():
         mock_repo.get_conversation_history_by_sender = AsyncMock()
         mock_repo.update = AsyncMock()
         mock_repo.get_message_by_wa_id = AsyncMock()
+        mock_repo.get_message_by_wa_id_indexed = AsyncMock(return_value=None)
+        mock_repo.backfill_wamid_index = AsyncMock()
         mock_repo_class.return_value = mock_repo
         service = MessageService()
         yield service
@@ -301,4 +303,139 @@ async def test_get_message_by_wa_id_error(message_service):
     with patch.object(message_service.repo, 'get_message_by_wa_id', side_effect=Exception("DB Error")):
         result = await message_service.get_message_by_wa_id("user_123", "session_456", "wa_msg_123")
         
-        assert result is None 
\ No newline at end of file
+        assert result is None 
+
+class FakeDoc:
+    def __init__(self, data):
+        self._data = data
+        self.id = data['id']
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class FakeMessagesQuery:
+    """Коллекция messages: order_by(timestamp, ID документа DESC) / start_after / limit / stream"""
+
+    def __init__(self, docs, descending=False, after=None, limit=None):
+        self.docs, self.descending, self.after, self.limit_value = docs, descending, after, limit
+
+    def order_by(self, field, direction=None):
+        return FakeMessagesQuery(self.docs, descending=direction == "DESCENDING", after=self.after)
+
+    def start_after(self, values):
+        return FakeMessagesQuery(self.docs, self.descending, values, self.limit_value)
+
+    def limit(self, count):
+        return FakeMessagesQuery(self.docs, self.descending, self.after, count)
+
+    def stream(self, transaction=None):
+        key = lambda d: (d['timestamp'], d['id'])
+        docs = sorted(self.docs, key=key, reverse=self.descending)
+        if self.after is not None:
+            if '__name__' in self.after:
+                bound = (self.after['timestamp'], self.after['__name__'])
+                docs = [d for d in docs if key(d) < bound]
+            else:
+                docs = [d for d in docs if d['timestamp'] < self.after['timestamp']]
+        return [FakeDoc(d) for d in docs[:self.limit_value]]
+
+
+def make_history_repo(docs):
+    from src.repositories.message_repository import MessageRepository
+
+    repo = MessageRepository(db=MagicMock())
+    repo.db.collection.return_value.document.return_value.collection.return_value \
+        .document.return_value.collection.return_value = FakeMessagesQuery(docs)
+    return repo
+
+
+@pytest.mark.asyncio
+async def test_history_window_reads_tail_and_pages_back():
+    from src.repositories.message_repository import HistoryCursor
+
+    repo = make_history_repo([{"id": f"id{i}", "role": "user", "content": f"m{i}", "timestamp": i} for i in range(7)])
+
+    with patch('src.repositories.message_repository.firestore.Query.DESCENDING', "DESCENDING"):
+        page, cursor = await repo.get_history_window("user_123", "session_456", limit=3)
+        assert [m["content"] for m in page] == ["m4", "m5", "m6"]
+        assert cursor == HistoryCursor(4, "id4")
+
+        page, cursor = await repo.get_history_window("user_123", "session_456", limit=3, before=cursor)
+        assert [m["content"] for m in page] == ["m1", "m2", "m3"]
+
+        page, cursor = await repo.get_history_window("user_123", "session_456", limit=3, before=cursor)
+        assert [m["content"] for m in page] == ["m0"]
+        assert cursor is None
+
+
+@pytest.mark.asyncio
+async def test_history_window_keeps_messages_with_same_timestamp_across_pages():
+    # Ответы бота из одного батча записаны с одинаковым временем
+    repo = make_history_repo([{"id": f"id{i}", "role": "assistant", "content": f"m{i}", "timestamp": 5}
+                              for i in range(5)])
+
+    with patch('src.repositories.message_repository.firestore.Query.DESCENDING', "DESCENDING"):
+        seen = []
+        page, cursor = await repo.get_history_window("user_123", "session_456", limit=2)
+        seen = [m["content"] for m in page] + seen
+        while cursor is not None:
+            page, cursor = await repo.get_history_window("user_123", "session_456", limit=2, before=cursor)
+            seen = [m["content"] for m in page] + seen
+
+    assert seen == ["m0", "m1", "m2", "m3", "m4"]
+
+
+@pytest.mark.asyncio
+async def test_reply_lookup_uses_history_cache(message_service):
+    message_service.history_cache.fill("user_123", "session_456", [
+        {"role": "assistant", "content": "Букет роз - 1500", "wa_message_id": "wa_msg_1"}
+    ], complete=True)
+
+    result = await message_service.get_message_by_wa_id("user_123", None, "wa_msg_1")
+
+    assert result["content"] == "Букет роз - 1500"
+    assert result["session_id"] == "session_456"
+    message_service.repo.get_message_by_wa_id.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_get_message_by_wa_id_uses_index_before_session_scan(message_service):
+    indexed = {"session_id": "s1", "role": "assistant", "content": "Букет роз", "wa_message_id": "wa_msg_1"}
+    message_service.repo.get_message_by_wa_id_indexed.return_value = indexed
+
+    result = await message_service.get_message_by_wa_id("user_123", None, "wa_msg_1")
+
+    assert result == indexed
+    message_service.repo.get_message_by_wa_id.assert_not_called()
+    assert message_service.get_wamid_metrics()["index_hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_get_message_by_wa_id_backfills_index_after_scan(message_service):
+    found = {"session_id": "s1", "role": "user", "content": "Старое", "wa_message_id": "wa_old"}
+    message_service.repo.get_message_by_wa_id.return_value = found
+
+    result = await message_service.get_message_by_wa_id("user_123", None, "wa_old")
+
+    assert result == found
+    message_service.repo.backfill_wamid_index.assert_awaited_once_with("user_123", found)
+    assert message_service.get_wamid_metrics()["session_scans"] == 1
+
+
+@pytest.mark.asyncio
+async def test_batch_write_adds_wamid_index_entry():
+    from src.repositories.message_repository import MessageRepository, WAMID_INDEX_COLLECTION
+    db = MagicMock()
+    repo = MessageRepository(db)
+    message = Message(sender_id="user_123", session_id="s1", role=MessageRole.ASSISTANT,
+                      content="Ваш заказ принят", wa_message_id="wamid.out")
+
+    assert await repo.add_messages_batch([message]) is True
+
+    db.collection.assert_any_call(WAMID_INDEX_COLLECTION)
+    entries = [c.args[1] for c in db.batch.return_value.set.call_args_list
+               if isinstance(c.args[1], dict) and 'message_path' in c.args[1]]
+    assert len(entries) == 1
+    assert entries[0]['session_id'] == "s1" and entries[0]['content'] == "Ваш заказ принят"
+    db.batch.return_value.commit.assert_called_once()
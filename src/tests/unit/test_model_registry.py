@@ -0,0 +1,81 @@
+import asyncio
+import pytest
+from unittest.mock import patch, MagicMock, AsyncMock
+from src.config.settings import TRANSLATION_MODEL, CHAT_MODEL
+from src.services.model_registry import ModelRegistry, ModelSpec
+from src.services.gemini_client import GeminiClient
+from src.services.ai_service import AIService
+
+
+class SlowModel:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+
+    async def generate_content_async(self, prompt):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.active -= 1
+        response = MagicMock()
+        response.text = "ok"
+        return response
+
+
+def test_models_built_once_per_task():
+    registry = ModelRegistry()
+    with patch('src.services.model_registry.genai.GenerativeModel') as mock_model_class:
+        first = registry.model("translate")
+        second = registry.model("translate")
+        registry.model("chat")
+
+    assert first is second
+    assert mock_model_class.call_count == 2
+    names = [call.kwargs["model_name"] for call in mock_model_class.call_args_list]
+    assert names == [TRANSLATION_MODEL, CHAT_MODEL]
+
+
+def test_pool_limits_and_unknown_task():
+    registry = ModelRegistry({
+        "chat": ModelSpec("chat-model", {}, timeout=30, max_concurrency=8),
+        "translate": ModelSpec("fast-model", {}, timeout=5, max_concurrency=4, pool="aux"),
+        "detect": ModelSpec("fast-model", {}, timeout=5, max_concurrency=2, pool="aux"),
+    })
+    assert registry.pool_limits() == {"chat": 8, "aux": 2}
+    assert registry.pool("detect") == "aux"
+    with pytest.raises(KeyError):
+        registry.spec("unknown")
+
+
+@pytest.mark.asyncio
+async def test_aux_pool_does_not_take_chat_slots():
+    client = GeminiClient(max_concurrency=4, timeout=1, pool_limits={"chat": 2, "aux": 1})
+    chat_model, aux_model = SlowModel(0.05), SlowModel(0.05)
+
+    await asyncio.gather(
+        *(client.generate(chat_model, str(i), task="chat", pool="chat") for i in range(4)),
+        *(client.generate(aux_model, str(i), task="translate", pool="aux") for i in range(3))
+    )
+
+    assert chat_model.max_active == 2
+    assert aux_model.max_active == 1
+    pools = client.get_metrics()["pools"]
+    assert pools["aux"] == {"limit": 1, "in_flight": 0}
+
+
+@pytest.mark.asyncio
+async def test_ai_service_uses_task_timeout_and_pool():
+    with patch('src.services.ai_service.genai.configure'):
+        ai_service = AIService("test_api_key", catalog_service=AsyncMock())
+    with patch.object(ai_service.gemini, 'generate_text', new_callable=AsyncMock) as mock_generate:
+        mock_generate.return_value = "Hello"
+        await ai_service.translate_text("Привет, как дела у вас сегодня?", "ru", "en")
+
+    kwargs = mock_generate.call_args.kwargs
+    assert kwargs["task"] == "translate"
+    assert kwargs["pool"] == "aux"
+    assert kwargs["timeout"] == ai_service.models.spec("translate").timeout
+    assert mock_generate.call_args.args[0] is ai_service.models.model("translate")
@@ -185,4 +185,42 @@ async def test_process_order_for_operator_incomplete(order_service):
         assert "summary_for_ai" in result
         assert "order_data" in result
         assert "validation" in result
-        assert not result["validation"]["is_complete"] 
\ No newline at end of file
+        assert not result["validation"]["is_complete"] 
+
+@pytest.mark.asyncio
+async def test_update_order_data_skips_unchanged_fields(order_service):
+    existing_order = Order(order_id="s1", sender_id="user_123", session_id="s1",
+                           customer_name="Анна", customer_phone="user_123")
+    order_service.repo.get_order_by_session = AsyncMock(return_value=existing_order)
+    order_service.repo.update_order_fields = AsyncMock(return_value=True)
+    order_service.repo.update_order_by_session = AsyncMock()
+
+    await order_service.update_order_data("s1", "user_123", {"customer_name": "Анна", "customer_phone": "user_123"})
+    order_service.repo.update_order_fields.assert_not_called()
+    assert order_service.get_metrics()["skipped_writes"] == 1
+
+    await order_service.update_order_data("s1", "user_123", {"customer_name": "Анна", "address": "Патонг"})
+    fields = order_service.repo.update_order_fields.call_args[0][2]
+    assert set(fields) == {"address", "updated_at"}
+    order_service.repo.update_order_by_session.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_add_item_uses_array_union_and_remove_item_checks_result(order_service):
+    from google.cloud import firestore
+    existing_order = Order(order_id="s1", sender_id="user_123", session_id="s1",
+                           items=[OrderItem(product_id="prod_1", bouquet="Розы")])
+    order_service.repo.get_order_by_session = AsyncMock(return_value=existing_order)
+    order_service.repo.update_order_fields = AsyncMock(return_value=True)
+
+    await order_service.add_item("s1", "user_123", {"bouquet": "Тюльпаны", "product_id": "prod_2"})
+    assert isinstance(order_service.repo.update_order_fields.call_args[0][2]["items"], firestore.ArrayUnion)
+
+    order_service.repo.remove_items_by_product_id = AsyncMock(return_value=1)
+    assert await order_service.remove_item("s1", "user_123", "prod_1") is True
+    assert order_service.repo.remove_items_by_product_id.call_args[0][:3] == ("user_123", "s1", "prod_1")
+
+    # Товар уже удален другим запросом - успех не сообщаем
+    existing_order.items = [OrderItem(product_id="prod_1", bouquet="Розы")]
+    order_service.repo.remove_items_by_product_id = AsyncMock(return_value=0)
+    assert await order_service.remove_item("s1", "user_123", "prod_1") is False
@@ -0,0 +1,120 @@
+import os
+import pytest
+from src.services.prompt_assembler import PromptAssembler, DEFAULT_PROMPT_PATH
+
+
+class FakeCatalog:
+    def __init__(self, products):
+        self.products = products
+        self.version = 1
+
+    def get_products(self):
+        return self.products
+
+
+@pytest.fixture
+def template_file(tmp_path):
+    path = tmp_path / "prompt.prompt"
+    path.write_text("Lang: {language_instruction}\n{name_context}\nTime: {phuket_time_str}\nJSON {{\"text\": \"...\"}}", encoding="utf-8")
+    return path
+
+
+def test_template_loaded_once_and_rendered(template_file):
+    assembler = PromptAssembler(FakeCatalog([]), template_path=str(template_file))
+    first = assembler.render_system_prompt("ru", "Анна")
+    second = assembler.render_system_prompt("en")
+
+    assert "User name: Анна" in first
+    assert "User name unknown" in second
+    assert 'JSON {"text": "..."}' in second
+    assert assembler.template.loads == 1
+
+
+def test_template_reloaded_when_file_changes(template_file):
+    assembler = PromptAssembler(FakeCatalog([]), template_path=str(template_file))
+    assembler.template.reload_check_seconds = 0
+    assembler.render_system_prompt("ru")
+
+    template_file.write_text("Updated {user_lang}", encoding="utf-8")
+    stat = os.stat(template_file)
+    os.utime(template_file, (stat.st_atime, stat.st_mtime + 10))
+
+    assert assembler.render_system_prompt("th") == "Updated th"
+    assert assembler.template.loads == 2
+
+
+def test_catalog_block_memoized_by_version(template_file):
+    catalog = FakeCatalog([{"name": "Розы", "price": "1000", "retailer_id": "r1"}])
+    assembler = PromptAssembler(catalog, template_path=str(template_file))
+
+    first = assembler.build_prompt([{"role": "user", "content": "Привет"}], "ru")
+    assembler.build_prompt([{"role": "user", "content": "Ещё"}], "ru")
+    assert "Розы (ID: r1)" in first
+    assert assembler.get_metrics()["catalog_renders"] == 1
+    assert assembler.get_metrics()["catalog_cache_hits"] == 1
+
+    catalog.products = [{"name": "Тюльпаны", "price": "900", "retailer_id": "r2"}]
+    catalog.version = 2
+    third = assembler.build_prompt([], "ru")
+    assert "Тюльпаны" in third and "Розы" not in third
+    assert assembler.get_metrics()["catalog_renders"] == 2
+
+
+def test_section_sizes_reported(template_file):
+    assembler = PromptAssembler(FakeCatalog([]), template_path=str(template_file))
+    prompt = assembler.build_prompt([{"role": "user", "content": "Привет"}], "ru")
+
+    sections = assembler.get_metrics()["last_sections"]
+    assert sections["total"]["bytes"] == len(prompt.encode("utf-8"))
+    assert set(sections) == {"template", "dynamic", "catalog", "order", "summary", "history", "total"}
+    assert prompt.endswith("\n\nJSON RESPONSE:")
+
+
+def test_compact_history_with_order_section(template_file):
+    assembler = PromptAssembler(FakeCatalog([]), template_path=str(template_file))
+    prompt = assembler.build_prompt([
+        {"role": "system", "content": "[СОХРАНЕННЫЕ ДАННЫЕ ЗАКАЗА]\nАдрес: Патонг"},
+        {"role": "user", "content": "Привет\nхочу розы"},
+        {"role": "assistant", "content": "Какие розы?"}
+    ], "ru", summary="Клиент из Патонга", session_key="7900/s1")
+
+    assert "user: Привет\\nхочу розы\nassistant: Какие розы?" in prompt
+    assert prompt.index("Адрес: Патонг") < prompt.index("EARLIER CONVERSATION SUMMARY")
+    assert "system:" not in prompt
+    assert assembler.session_tokens("7900/s1")["prompts"] == 1
+
+
+def test_budget_trims_old_history_then_summary(template_file):
+    history = [{"role": "user", "content": f"сообщение номер {i} " + "текст " * 30} for i in range(40)]
+    assembler = PromptAssembler(FakeCatalog([]), template_path=str(template_file),
+                                token_budget=600, min_history_messages=3)
+
+    prompt = assembler.build_prompt(history, "ru", summary="Краткое содержание " * 10)
+    metrics = assembler.get_metrics()
+
+    assert "сообщение номер 39 " in prompt and "сообщение номер 0 " not in prompt
+    assert metrics["last_trimmed_messages"] > 0
+    assert metrics["last_sections"]["total"]["tokens_est"] <= 600
+
+    # Даже минимум истории не влезает - краткое содержание отбрасывается, последние сообщения остаются
+    tight = PromptAssembler(FakeCatalog([]), template_path=str(template_file),
+                            token_budget=100, min_history_messages=3)
+    prompt = tight.build_prompt(history, "ru", summary="Краткое содержание")
+    assert "сообщение номер 37 " in prompt and "Краткое содержание" not in prompt
+    assert tight.get_metrics()["summary_dropped"] == 1
+    assert tight.get_metrics()["over_budget"] == 1
+
+
+def test_real_template_matches_str_format():
+    assembler = PromptAssembler(FakeCatalog([]), template_path=DEFAULT_PROMPT_PATH)
+    values = {
+        "user_lang": "ru",
+        "sender_name": "Анна",
+        "phuket_time_str": assembler._phuket_time_str(),
+        "name_context": "User name: Анна",
+        "name_instruction": "",
+        "language_instruction": "IMPORTANT: Respond in user's language! User writes in language code 'ru'. Respond in the same language."
+    }
+    with open(DEFAULT_PROMPT_PATH, encoding="utf-8") as f:
+        expected = f.read().format(**values)
+    assert assembler.render_system_prompt("ru", "Анна") == expected
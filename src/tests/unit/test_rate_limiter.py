@@ -0,0 +1,27 @@
+import time
+import pytest
+from src.utils.rate_limiter import TokenBucket
+
+
+@pytest.mark.asyncio
+async def test_burst_within_capacity_is_not_throttled():
+    bucket = TokenBucket(rate=10, capacity=5)
+    for _ in range(5):
+        await bucket.acquire()
+
+    metrics = bucket.get_metrics()
+    assert metrics["acquired"] == 5
+    assert metrics["throttled"] == 0
+
+
+@pytest.mark.asyncio
+async def test_acquire_waits_when_bucket_is_empty():
+    bucket = TokenBucket(rate=50, capacity=1)
+    started = time.monotonic()
+    for _ in range(3):
+        await bucket.acquire()
+    elapsed = time.monotonic() - started
+
+    # Первый токен есть сразу, еще два пополняются со скоростью 50/с
+    assert elapsed >= 0.035
+    assert bucket.get_metrics()["throttled"] == 2
@@ -0,0 +1,95 @@
+import asyncio
+import pytest
+from unittest.mock import MagicMock, patch
+from src.utils.resilience import CircuitBreaker, CircuitOpenError, RetryBudget, backoff_delay
+from src.services.gemini_client import GeminiClient
+
+
+class FailingModel:
+    def __init__(self):
+        self.calls = 0
+
+    async def generate_content_async(self, prompt):
+        self.calls += 1
+        raise RuntimeError("503 Service Unavailable")
+
+
+def test_backoff_grows_and_is_capped():
+    with patch('src.utils.resilience.random.uniform', side_effect=lambda low, high: high):
+        assert [backoff_delay(n, base=0.5, cap=3) for n in (1, 2, 3, 4)] == [0.5, 1.0, 2.0, 3]
+
+
+def test_retry_budget_limits_retries_to_ratio():
+    budget = RetryBudget(ratio=0.2, min_retries=1)
+    for _ in range(10):
+        budget.record_call()
+
+    allowed = [budget.try_retry() for _ in range(5)]
+    assert allowed == [True, True, True, False, False]
+    assert budget.get_metrics()["denied"] == 2
+
+
+def test_breaker_opens_on_error_rate_and_recovers():
+    breaker = CircuitBreaker("chat", error_rate_threshold=0.5, min_calls=4, open_seconds=0)
+    breaker.record_success()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.get_metrics()["opened"] == 1
+
+    # open_seconds=0: сразу полуоткрыт, пропускается один пробный вызов
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_gemini_client_fails_fast_when_open():
+    client = GeminiClient(max_concurrency=2, timeout=1)
+    breaker = client.breaker("chat")
+    breaker.min_calls = 3
+    model = FailingModel()
+
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            await client.generate(model, "prompt", task="chat", pool="chat")
+    with pytest.raises(CircuitOpenError):
+        await client.generate(model, "prompt", task="chat", pool="chat")
+
+    assert model.calls == 3
+    assert client.breaker_states() == {"default": "open"}
+    assert await client.before_retry(1, "chat") is False
+    assert client.get_metrics()["circuit_breakers"]["default"]["rejected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_probe_cancelled_while_waiting_for_slot_is_released():
+    class HangingModel:
+        async def generate_content_async(self, prompt):
+            await asyncio.sleep(10)
+
+    client = GeminiClient(max_concurrency=1, timeout=5)
+    breaker = client.breaker()
+    breaker.open_seconds = 0
+
+    # Единственный слот занят обычным вызовом, затем предохранитель размыкается
+    holder = asyncio.create_task(client.generate(HangingModel(), "held"))
+    await asyncio.sleep(0)
+    breaker._open()
+
+    # Пробный вызов ждет семафор и отменяется, так и не начав вызов
+    probe = asyncio.create_task(client.generate(HangingModel(), "probe"))
+    await asyncio.sleep(0)
+    assert breaker._probe_in_flight is True
+    probe.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await probe
+
+    assert breaker.state == "half_open"
+    assert breaker.before_call() is True
+    holder.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await holder
@@ -0,0 +1,168 @@
+import asyncio
+import pytest
+from src.services.sender_lanes import SenderLaneScheduler
+
+
+def make_message(sender_id: str, text: str) -> dict:
+    return {"sender_id": sender_id, "message_text": text}
+
+
+@pytest.mark.asyncio
+async def test_messages_of_one_sender_are_processed_in_arrival_order():
+    batches = []
+
+    async def processor(messages):
+        batches.append([m["message_text"] for m in messages])
+        return True
+
+    scheduler = SenderLaneScheduler(processor, coalesce_window_ms=0, max_batch_size=1)
+    tickets = [scheduler.reserve("user_1") for _ in range(3)]
+
+    # Извлечение завершается в обратном порядке, обработка - в порядке поступления
+    results = await asyncio.gather(
+        scheduler.submit(tickets[2], make_message("user_1", "третье")),
+        scheduler.submit(tickets[1], make_message("user_1", "второе")),
+        scheduler.submit(tickets[0], make_message("user_1", "первое")),
+    )
+
+    assert results == [True, True, True]
+    assert batches == [["первое"], ["второе"], ["третье"]]
+    assert scheduler.get_metrics()["active_lanes"] == 0
+
+
+@pytest.mark.asyncio
+async def test_burst_is_coalesced_into_one_batch():
+    batches = []
+
+    async def processor(messages):
+        batches.append([m["message_text"] for m in messages])
+        return True
+
+    scheduler = SenderLaneScheduler(processor, coalesce_window_ms=20)
+    tickets = [scheduler.reserve("user_1") for _ in range(3)]
+    await asyncio.gather(*[
+        scheduler.submit(ticket, make_message("user_1", f"msg{i}"))
+        for i, ticket in enumerate(tickets)
+    ])
+
+    assert batches == [["msg0", "msg1", "msg2"]]
+    metrics = scheduler.get_metrics()
+    assert metrics["batches"] == 1
+    assert metrics["coalesced_messages"] == 2
+    assert metrics["max_batch_size"] == 3
+
+
+@pytest.mark.asyncio
+async def test_different_senders_run_in_parallel():
+    running = set()
+    max_parallel = 0
+
+    async def processor(messages):
+        nonlocal max_parallel
+        running.add(messages[0]["sender_id"])
+        max_parallel = max(max_parallel, len(running))
+        await asyncio.sleep(0.01)
+        running.discard(messages[0]["sender_id"])
+        return True
+
+    scheduler = SenderLaneScheduler(processor, coalesce_window_ms=0)
+    ticket_a = scheduler.reserve("user_a")
+    ticket_b = scheduler.reserve("user_b")
+    await asyncio.gather(
+        scheduler.submit(ticket_a, make_message("user_a", "a")),
+        scheduler.submit(ticket_b, make_message("user_b", "b")),
+    )
+
+    assert max_parallel == 2
+
+
+@pytest.mark.asyncio
+async def test_cancelled_ticket_does_not_block_lane():
+    processed = []
+
+    async def processor(messages):
+        processed.extend(m["message_text"] for m in messages)
+        return True
+
+    scheduler = SenderLaneScheduler(processor, coalesce_window_ms=0)
+    first = scheduler.reserve("user_1")
+    second = scheduler.reserve("user_1")
+
+    scheduler.cancel(first)
+    result = await asyncio.wait_for(scheduler.submit(second, make_message("user_1", "второе")), timeout=1)
+
+    assert result is True
+    assert processed == ["второе"]
+    assert scheduler.get_metrics()["cancelled_tickets"] == 1
+
+
+@pytest.mark.asyncio
+async def test_processor_error_resolves_tickets():
+    async def processor(messages):
+        raise RuntimeError("boom")
+
+    scheduler = SenderLaneScheduler(processor, coalesce_window_ms=0)
+    ticket = scheduler.reserve("user_1")
+    result = await scheduler.submit(ticket, make_message("user_1", "текст"))
+
+    assert result is False
+    assert scheduler.get_metrics()["failed_batches"] == 1
+
+
+@pytest.mark.asyncio
+async def test_single_message_is_not_delayed_by_coalesce_window():
+    async def processor(messages):
+        return True
+
+    scheduler = SenderLaneScheduler(processor, coalesce_window_ms=5000)
+    ticket = scheduler.reserve("user_1")
+
+    assert await asyncio.wait_for(scheduler.submit(ticket, make_message("user_1", "привет")), timeout=1) is True
+    assert scheduler.get_metrics()["burst_waits"] == 0
+
+
+@pytest.mark.asyncio
+async def test_dispatch_does_not_wait_for_processing():
+    release = asyncio.Event()
+    processed = []
+
+    async def processor(messages):
+        await release.wait()
+        processed.extend(m["message_text"] for m in messages)
+        return False
+
+    scheduler = SenderLaneScheduler(processor, coalesce_window_ms=0)
+    scheduler.dispatch(scheduler.reserve("user_1"), make_message("user_1", "текст"))
+    await asyncio.sleep(0)
+    assert processed == []
+
+    release.set()
+    await scheduler.wait_idle(timeout=1)
+    assert processed == ["текст"]
+    assert scheduler.get_metrics()["failed_batches"] == 1
+
+
+@pytest.mark.asyncio
+async def test_dispatched_batches_share_global_limit():
+    running = 0
+    max_running = 0
+
+    async def processor(messages):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return True
+
+    scheduler = SenderLaneScheduler(processor, coalesce_window_ms=0, max_concurrent_batches=2)
+    for i in range(6):
+        sender_id = f"user_{i}"
+        scheduler.dispatch(scheduler.reserve(sender_id), make_message(sender_id, "привет"))
+    await scheduler.wait_idle(timeout=1)
+
+    assert max_running == 2
+    metrics = scheduler.get_metrics()
+    assert metrics["batches"] == 6
+    assert metrics["slot_waits"] >= 1
+    assert metrics["running_batches"] == 0
@@ -0,0 +1,117 @@
+import pytest
+from unittest.mock import patch, AsyncMock
+from src.services.translation_cache import TranslationCache, make_key
+from src.services.ai_service import AIService
+
+
+class FakeRepository:
+    def __init__(self):
+        self.docs = {}
+        self.reads = 0
+
+    async def get_translation(self, key):
+        self.reads += 1
+        return self.docs.get(key)
+
+    async def save_translation(self, key, data):
+        self.docs[key] = data
+        return True
+
+
+@pytest.mark.asyncio
+async def test_memory_hit_with_normalized_key():
+    cache = TranslationCache()
+    cache.put("Thank you", "en", "th", "ขอบคุณ")
+
+    assert await cache.get("  thank   YOU ", "en", "th") == "ขอบคุณ"
+    assert await cache.get("thank you", "en", "ru") is None
+    metrics = cache.get_metrics()
+    assert metrics["memory_hits"] == 1
+    assert metrics["misses"] == 1
+    assert metrics["hit_ratio"] == 0.5
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction_and_ttl():
+    cache = TranslationCache(max_size=2)
+    cache.put("a1", "ru", "en", "1")
+    cache.put("a2", "ru", "en", "2")
+    await cache.get("a1", "ru", "en")
+    cache.put("a3", "ru", "en", "3")
+
+    assert await cache.get("a2", "ru", "en") is None
+    assert await cache.get("a1", "ru", "en") == "1"
+    assert cache.get_metrics()["evictions"] == 1
+
+    expiring = TranslationCache(ttl_seconds=0)
+    expiring.put("ok", "en", "th", "โอเค")
+    assert await expiring.get("ok", "en", "th") is None
+    assert expiring.get_metrics()["expired"] == 1
+
+
+@pytest.mark.asyncio
+async def test_persistent_tier_shared_between_instances():
+    repository = FakeRepository()
+    writer = TranslationCache(repository)
+    writer.put("Сколько стоит?", "ru", "en", "How much is it?")
+    await writer.flush()
+    assert make_key("сколько стоит?", "ru", "en") in repository.docs
+
+    reader = TranslationCache(repository)
+    assert await reader.get("Сколько стоит?", "ru", "en") == "How much is it?"
+    assert await reader.get("Сколько стоит?", "ru", "en") == "How much is it?"
+    assert repository.reads == 1
+    metrics = reader.get_metrics()
+    assert metrics["store_hits"] == 1
+    assert metrics["memory_hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_long_texts_not_cached():
+    cache = TranslationCache(FakeRepository(), max_text_length=10)
+    cache.put("очень длинное сообщение", "ru", "en", "a very long message")
+    assert await cache.get("очень длинное сообщение", "ru", "en") is None
+    assert cache.get_metrics()["skipped"] == 1
+
+
+@pytest.mark.asyncio
+async def test_repeated_phrase_translated_once():
+    with patch('src.services.ai_service.genai.configure'):
+        ai_service = AIService("test_api_key", catalog_service=AsyncMock())
+    response = '{"language": "ru", "confidence": 0.99, "text_en": "Thank you", "text_thai": "ขอบคุณ"}'
+    with patch.object(ai_service.gemini, 'generate_text', new_callable=AsyncMock) as mock_generate:
+        mock_generate.return_value = response
+        first = await ai_service.detect_and_translate("Спасибо", "auto")
+        second = await ai_service.detect_and_translate("спасибо", "auto")
+        third = await ai_service.translate_text("Спасибо", "ru", "en")
+
+    assert mock_generate.call_count == 1
+    assert second['language'] == 'ru'
+    assert second['text_en'] == first['text_en'] == third == "Thank you"
+    assert second['text_thai'] == "ขอบคุณ"
+
+
+@pytest.mark.asyncio
+async def test_detected_language_kept_only_in_memory():
+    repository = FakeRepository()
+    cache = TranslationCache(repository)
+    cache.put("ok ok", "auto", "lang", "en", persist=False)
+    await cache.flush()
+
+    assert repository.docs == {}
+    assert await cache.get("ok ok", "auto", "lang", persist=False) == "en"
+    assert await cache.get("ok ok", "auto", "xx", persist=False) is None
+    assert repository.reads == 0
+
+
+@pytest.mark.asyncio
+async def test_local_detection_does_not_touch_language_cache():
+    with patch('src.services.ai_service.genai.configure'):
+        ai_service = AIService("test_api_key", catalog_service=AsyncMock())
+    response = '{"language": "ru", "confidence": 0.99, "text_en": "Roses", "text_thai": "กุหลาบ"}'
+    with patch.object(ai_service.gemini, 'generate_text', new_callable=AsyncMock) as mock_generate, \
+         patch.object(ai_service.translation_cache, 'put', wraps=ai_service.translation_cache.put) as mock_put:
+        mock_generate.return_value = response
+        await ai_service.detect_and_translate("Хочу розы", "auto")
+
+    assert all(call.args[1:3] != ("auto", "lang") for call in mock_put.call_args_list)
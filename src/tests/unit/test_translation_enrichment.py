@@ -0,0 +1,113 @@
+import pytest
+from src.services.translation_enrichment import (
+    TranslationEnrichmentWorker, TranslationJob, TRANSLATION_DONE, TRANSLATION_FAILED
+)
+from src.routes.chat_routes import format_messages_for_language
+
+
+class FakeAIService:
+    def __init__(self, fail_times=0):
+        self.fail_times = fail_times
+        self.calls = 0
+
+    async def detect_and_translate(self, text, user_lang='auto'):
+        self.calls += 1
+        if self.calls <= self.fail_times:
+            raise RuntimeError("gemini unavailable")
+        return {"language": "ru", "confidence": 0.99, "text": text,
+                "text_en": "Hello", "text_thai": "สวัสดี"}
+
+
+class FakeMessageRepository:
+    def __init__(self):
+        self.updates = []
+
+    async def update_message_translations(self, sender_id, session_id, message_id, content_en, content_thai, status):
+        self.updates.append((message_id, content_en, content_thai, status))
+        return True
+
+
+def make_job():
+    return TranslationJob(sender_id="79001234567", session_id="s1", message_id="wamid.1", text="Привет")
+
+
+@pytest.mark.asyncio
+async def test_job_updates_message_translations():
+    repo = FakeMessageRepository()
+    worker = TranslationEnrichmentWorker(FakeAIService(), repo, workers=1)
+    await worker.start()
+    assert worker.submit(make_job())
+    await worker.stop()
+
+    assert repo.updates == [("wamid.1", "Hello", "สวัสดี", TRANSLATION_DONE)]
+    metrics = worker.get_metrics()
+    assert metrics["processed"] == 1
+    assert metrics["stages"]["lag"]["count"] == 1
+    assert not metrics["running"]
+
+
+@pytest.mark.asyncio
+async def test_retry_then_failed_status():
+    repo = FakeMessageRepository()
+    ai_service = FakeAIService(fail_times=5)
+    worker = TranslationEnrichmentWorker(ai_service, repo, workers=1)
+    await worker.start()
+    worker.submit(make_job())
+    await worker.stop()
+
+    assert ai_service.calls == TranslationEnrichmentWorker.MAX_ATTEMPTS
+    assert repo.updates == [("wamid.1", None, None, TRANSLATION_FAILED)]
+    metrics = worker.get_metrics()
+    assert metrics["retried"] == 1
+    assert metrics["failed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_submit_rejected_when_not_running_or_full():
+    worker = TranslationEnrichmentWorker(FakeAIService(), FakeMessageRepository(), workers=1, maxsize=1)
+    assert not worker.submit(make_job())
+
+    await worker.start()
+    # Воркер еще не успел забрать задачу - вторая не помещается
+    assert worker.submit(make_job())
+    assert not worker.submit(make_job())
+    assert worker.get_metrics()["dropped"] == 1
+    await worker.stop()
+
+
+def test_pending_translation_rendered_with_original():
+    messages = [{"role": "user", "timestamp": "", "content": "Привет",
+                 "content_en": "", "content_thai": "", "translation_status": "pending"}]
+    html_en = format_messages_for_language(messages, 'en')
+    assert "Привет" in html_en
+    assert "перевод готовится" in html_en
+    assert "перевод готовится" not in format_messages_for_language(messages, 'ru')
+
+
+@pytest.mark.asyncio
+async def test_dropped_and_abandoned_jobs_marked_failed():
+    import asyncio
+    release = asyncio.Event()
+
+    class HangingAIService(FakeAIService):
+        async def detect_and_translate(self, text, user_lang='auto'):
+            await release.wait()
+
+    repo = FakeMessageRepository()
+    worker = TranslationEnrichmentWorker(HangingAIService(), repo, workers=1, maxsize=1)
+    await worker.start()
+    jobs = [TranslationJob(sender_id="79001234567", session_id="s1", message_id=f"wamid.{i}", text="Привет")
+            for i in range(3)]
+    assert worker.submit(jobs[0])
+    await asyncio.sleep(0)
+    # Первая задача в работе, вторая ждет в очереди, третья не помещается
+    assert worker.submit(jobs[1])
+    assert not worker.submit(jobs[2])
+    await worker.stop(timeout=0.01)
+
+    assert sorted(repo.updates) == [
+        (f"wamid.{i}", None, None, TRANSLATION_FAILED) for i in range(3)
+    ]
+    metrics = worker.get_metrics()
+    assert metrics["dropped"] == 1
+    assert metrics["abandoned"] == 2
@@ -0,0 +1,185 @@
+import pytest
+from datetime import datetime, timezone
+from src.services.turn_context import TurnContextLoader
+
+
+class FakeRef:
+    def __init__(self, path):
+        self.path = path
+
+    def collection(self, name):
+        return FakeCollection(f"{self.path}/{name}")
+
+
+class FakeCollection:
+    def __init__(self, path):
+        self.path = path
+
+    def document(self, doc_id):
+        return FakeRef(f"{self.path}/{doc_id}")
+
+
+class FakeSnapshot:
+    def __init__(self, ref, data):
+        self.reference = ref
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, ref, data, merge=False):
+        self.writes.append((ref.path, data, merge))
+
+    def update(self, ref, data):
+        self.writes.append((ref.path, data, "update"))
+
+    def commit(self):
+        self.db.commits.append(self.writes)
+        for path, data, _ in self.writes:
+            self.db.docs.setdefault(path, {}).update(data)
+
+
+class FakeDb:
+    def __init__(self, docs=None):
+        self.docs = docs or {}
+        self.get_all_calls = []
+        self.commits = []
+
+    def collection(self, name):
+        return FakeCollection(name)
+
+    def get_all(self, refs):
+        self.get_all_calls.append([ref.path for ref in refs])
+        return [FakeSnapshot(ref, self.docs.get(ref.path)) for ref in refs]
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+class FakeSessionService:
+    def generate_session_id(self, sender_id):
+        return "20250101_120000_1_123"
+
+
+def active_user(session_id="s1"):
+    return {"sender_id": "7900", "name": "Анна", "session_id": session_id,
+            "session_created": datetime.now(timezone.utc)}
+
+
+@pytest.mark.asyncio
+async def test_second_turn_reads_everything_with_one_get_all():
+    db = FakeDb({
+        "users/7900": active_user(),
+        "conversations/7900/sessions/s1": {"user_language": "ru", "summary": "Клиент хочет розы"},
+        "orders/7900/sessions/s1": {"order_id": "s1", "session_id": "s1", "sender_id": "7900",
+                                    "address": "Патонг", "customer_name": "Анна", "customer_phone": "7900"},
+    })
+    loader = TurnContextLoader(db, FakeSessionService())
+
+    first = await loader.load("7900")
+    assert len(db.get_all_calls) == 2  # подсказки сессии еще нет
+    second = await loader.load("7900")
+    assert len(db.get_all_calls) == 3
+    assert db.get_all_calls[-1] == ["users/7900", "conversations/7900/sessions/s1", "orders/7900/sessions/s1"]
+
+    assert second.session_id == "s1" and first.session_id == "s1"
+    assert second.user_language == "ru"
+    assert second.order_data()["address"] == "Патонг"
+    assert second.summary_state()["summary"] == "Клиент хочет розы"
+
+    # Ничего не изменилось - ничего не пишется
+    second.ensure_user("Анна")
+    second.update_order({"customer_name": "Анна", "customer_phone": "7900"})
+    await second.flush()
+    assert db.commits == []
+    assert loader.get_metrics()["hint_misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_new_user_changes_flushed_in_one_batch():
+    db = FakeDb()
+    loader = TurnContextLoader(db, FakeSessionService())
+
+    ctx = await loader.load("7900")
+    ctx.ensure_user("Анна")
+    ctx.update_order({"customer_name": "Анна", "customer_phone": "7900"})
+    ctx.set_user_language("ru")
+    assert ctx.order_data()["customer_name"] == "Анна"
+    await ctx.flush()
+
+    assert len(db.get_all_calls) == 1  # сессии нет - читать документы сессии и заказа незачем
+    assert len(db.commits) == 1
+    paths = {path for path, _, merge in db.commits[0] if merge}
+    assert paths == {"users/7900", "conversations/7900/sessions/20250101_120000_1_123",
+                     "orders/7900/sessions/20250101_120000_1_123"}
+    assert db.docs["users/7900"]["session_id"] == "20250101_120000_1_123"
+    assert db.docs["users/7900"]["name"] == "Анна"
+    # Новый заказ записывается полным черновиком, как в OrderService
+    order = db.docs["orders/7900/sessions/20250101_120000_1_123"]
+    assert order["status"] == "draft" and order["items"] == []
+    assert order["created_at"] and order["updated_at"]
+    assert order["customer_phone"] == "7900"
+    assert not ctx.order_pending
+
+
+@pytest.mark.asyncio
+async def test_expired_session_starts_new_one():
+    user = active_user("old")
+    user["session_created"] = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    db = FakeDb({"users/7900": user})
+    loader = TurnContextLoader(db, FakeSessionService())
+
+    ctx = await loader.load("7900")
+    assert ctx.session_id == "20250101_120000_1_123"
+    ctx.ensure_user("Анна")  # пользователь уже есть
+    await ctx.flush()
+    written = db.commits[0][0][1]
+    assert set(written) == {"session_id", "session_created", "updated_at"}
+
+
+@pytest.mark.asyncio
+async def test_existing_order_writes_only_changed_fields_with_merge():
+    db = FakeDb({
+        "users/7900": active_user(),
+        "orders/7900/sessions/s1": {"order_id": "s1", "session_id": "s1", "sender_id": "7900",
+                                    "customer_name": "Анна", "customer_phone": "7900"},
+    })
+    loader = TurnContextLoader(db, FakeSessionService())
+
+    ctx = await loader.load("7900")
+    ctx.update_order({"customer_name": "Анна Петрова", "customer_phone": "7900"})
+    await ctx.flush()
+
+    path, data, mode = db.commits[0][0]
+    assert path == "orders/7900/sessions/s1" and mode is True
+    assert set(data) == {"order_id", "session_id", "sender_id", "customer_name", "updated_at"}
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_new_session_for_retry():
+    user = active_user("old")
+    user["session_created"] = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    db = FakeDb({"users/7900": user})
+    loader = TurnContextLoader(db, FakeSessionService())
+    ctx = await loader.load("7900")
+    assert ctx.session_pending is True
+
+    failing_batch = FakeBatch(db)
+    failing_batch.commit = lambda: (_ for _ in ()).throw(RuntimeError("deadline exceeded"))
+    db.batch = lambda: failing_batch
+    with pytest.raises(RuntimeError):
+        await ctx.flush()
+    assert ctx.session_pending is True
+    assert loader.get_metrics()["flush_errors"] == 1
+
+    db.batch = lambda: FakeBatch(db)
+    await ctx.flush()
+    assert ctx.session_pending is False
+    assert db.docs["users/7900"]["session_id"] == "20250101_120000_1_123"
@@ -0,0 +1,161 @@
+import asyncio
+import pytest
+from unittest.mock import patch, AsyncMock, MagicMock
+from src.handlers.webhook_queue import WebhookQueue, WebhookJob
+from src.handlers.webhook_handler import WebhookHandler
+from src.utils.metrics import LatencyHistogram
+
+
+def make_text_webhook(message_id: str, sender_id: str = "user_123") -> dict:
+    return {
+        "entry": [{
+            "changes": [{
+                "value": {
+                    "contacts": [{"profile": {"name": "Test"}, "wa_id": sender_id}],
+                    "messages": [{
+                        "from": sender_id,
+                        "id": message_id,
+                        "timestamp": "1700000000",
+                        "type": "text",
+                        "text": {"body": "Привет"}
+                    }]
+                }
+            }]
+        }]
+    }
+
+
+def test_latency_histogram_snapshot():
+    histogram = LatencyHistogram(buckets_ms=(10, 100))
+    for value in (5, 50, 500):
+        histogram.record(value)
+
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 3
+    assert snapshot["max_ms"] == 500
+    assert snapshot["p50_ms"] == 50
+    assert snapshot["buckets"] == {"le_10ms": 1, "le_100ms": 1, "gt_max": 1}
+
+
+@pytest.mark.asyncio
+async def test_queue_processes_jobs_and_reports_metrics():
+    handled = []
+
+    async def handler(job):
+        handled.append(job.wa_message_id)
+
+    queue = WebhookQueue(handler, maxsize=10, workers=2)
+    await queue.start()
+    for i in range(5):
+        await queue.enqueue(WebhookJob(body={}, wa_message_id=f"wamid.{i}"))
+    await queue.stop()
+
+    assert sorted(handled) == [f"wamid.{i}" for i in range(5)]
+    metrics = queue.get_metrics()
+    assert metrics["enqueued"] == 5
+    assert metrics["processed"] == 5
+    assert metrics["depth"] == 0
+    assert metrics["running"] is False
+    assert metrics["stages"]["queue_wait"]["count"] == 5
+
+
+@pytest.mark.asyncio
+async def test_queue_worker_survives_handler_error():
+    async def handler(job):
+        if job.wa_message_id == "bad":
+            raise ValueError("boom")
+
+    queue = WebhookQueue(handler, maxsize=10, workers=1)
+    await queue.start()
+    await queue.enqueue(WebhookJob(body={}, wa_message_id="bad"))
+    await queue.enqueue(WebhookJob(body={}, wa_message_id="good"))
+    await queue.stop()
+
+    metrics = queue.get_metrics()
+    assert metrics["failed"] == 1
+    assert metrics["processed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_queue_backpressure_when_full():
+    release = asyncio.Event()
+
+    async def handler(job):
+        await release.wait()
+
+    queue = WebhookQueue(handler, maxsize=1, workers=1)
+    await queue.start()
+    await queue.enqueue(WebhookJob(body={}, wa_message_id="1"))
+    await asyncio.sleep(0)  # воркер забирает первую задачу
+    await queue.enqueue(WebhookJob(body={}, wa_message_id="2"))
+
+    pending = asyncio.create_task(queue.enqueue(WebhookJob(body={}, wa_message_id="3")))
+    await asyncio.sleep(0.01)
+    assert not pending.done()
+
+    release.set()
+    await pending
+    await queue.stop()
+    assert queue.get_metrics()["backpressure_waits"] == 1
+    assert queue.get_metrics()["processed"] == 3
+
+
+@pytest.mark.asyncio
+async def test_process_webhook_returns_before_processing():
+    handler = WebhookHandler()
+    release = asyncio.Event()
+
+    handler.sender_lanes.coalesce_window = 0
+
+    async def slow_processing(messages):
+        await release.wait()
+        return True
+
+    with patch.object(handler, 'extract_and_process_message', new_callable=AsyncMock) as mock_extract, \
+         patch.object(handler.sender_lanes, 'processor', side_effect=slow_processing):
+        mock_extract.return_value = {"sender_id": "user_123", "message_text": "Привет"}
+        await handler.queue.start()
+
+        result = await asyncio.wait_for(handler.process_webhook(make_text_webhook("wamid.queue_test")), timeout=1)
+        assert result == {"status": "ok", "message": "queued"}
+
+        # Воркер освобождается, не дожидаясь обработки сообщения в очереди отправителя
+        await asyncio.wait_for(handler.queue.stop(), timeout=1)
+        assert handler.sender_lanes.get_metrics()["active_lanes"] == 1
+
+        release.set()
+        await handler.sender_lanes.wait_idle(timeout=1)
+
+    metrics = handler.queue.get_metrics()
+    assert metrics["processed"] == 1
+    assert metrics["stages"]["extract"]["count"] == 1
+    assert metrics["stages"]["dispatch"]["count"] == 1
+    assert handler.sender_lanes.get_metrics()["batches"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_turn_releases_wamid_for_redelivery():
+    handler = WebhookHandler()
+    handler.sender_lanes.coalesce_window = 0
+    processor = MagicMock()
+    processor.process_user_messages = AsyncMock(side_effect=[False, True])
+
+    with patch('src.services.message_processor.MessageProcessor', return_value=processor), \
+         patch.object(handler.activity_index, 'observe'):
+        await handler.queue.start()
+        assert (await handler.process_webhook(make_text_webhook("wamid.retry")))["message"] == "queued"
+        await handler.queue.stop()
+        await handler.sender_lanes.wait_idle(timeout=1)
+
+        # Ход не удался - повтор от Meta не считается дублем и обрабатывается
+        await handler.queue.start()
+        assert (await handler.process_webhook(make_text_webhook("wamid.retry")))["message"] == "queued"
+        await handler.queue.stop()
+        await handler.sender_lanes.wait_idle(timeout=1)
+
+    assert processor.process_user_messages.await_count == 2
+    # После успешного хода повтор отсекается как дубль
+    await handler.process_webhook(make_text_webhook("wamid.retry"))
+    metrics = handler.dedup.get_metrics()
+    assert metrics["memory_duplicates"] == 1
+    assert metrics["released"] == 1
@@ -0,0 +1,91 @@
+import httpx
+import pytest
+from src.utils.whatsapp_client import WhatsAppClient
+
+
+def make_client(handler) -> WhatsAppClient:
+    http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return WhatsAppClient(http_client=http_client)
+
+
+@pytest.mark.asyncio
+async def test_requests_reuse_single_http_client():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json={"messages": [{"id": f"wamid.{len(requests)}"}]})
+
+    client = make_client(handler)
+    http_client = client._client
+
+    for i in range(3):
+        message_id = await client.send_image_with_caption("user_123", f"https://img/{i}.jpg", "Букет")
+        assert message_id == f"wamid.{i + 1}"
+    assert await client.mark_message_as_read("wamid.in") is True
+
+    assert client._client is http_client
+    assert len(requests) == 4
+    await client.aclose()
+    assert http_client.is_closed
+
+
+@pytest.mark.asyncio
+async def test_latency_metrics_per_endpoint():
+    def handler(request: httpx.Request) -> httpx.Response:
+        if b'"status"' in request.content:
+            return httpx.Response(400, json={})
+        return httpx.Response(200, json={"messages": [{"id": "wamid.1"}]})
+
+    client = make_client(handler)
+    await client.send_text_message("user_123", "Привет")
+    await client.send_typing_indicator("wamid.in")
+
+    metrics = client.get_metrics()
+    assert metrics["client_open"] is True
+    assert metrics["endpoints"]["send_text"]["count"] == 1
+    assert metrics["endpoints"]["send_text"]["statuses"] == {"200": 1}
+    assert metrics["endpoints"]["typing_indicator"]["statuses"] == {"400": 1}
+    await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_transport_error_is_recorded():
+    def handler(request: httpx.Request) -> httpx.Response:
+        raise httpx.ConnectError("connection refused")
+
+    client = make_client(handler)
+    assert await client.send_text_message("user_123", "Привет") is None
+    assert client.get_metrics()["endpoints"]["send_text"]["statuses"] == {"error": 1}
+    await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_client_created_lazily_and_reopened_after_close():
+    client = WhatsAppClient()
+    assert client.get_metrics()["client_open"] is False
+
+    await client.start()
+    first = client._client
+    assert client.get_metrics()["client_open"] is True
+
+    await client.aclose()
+    await client.start()
+    assert client._client is not first
+    await client.aclose()
+
+
+def test_client_from_previous_event_loop_is_closed():
+    import asyncio
+
+    client = WhatsAppClient()
+    asyncio.run(client.start())
+    first = client._client
+
+    async def second_loop():
+        await client.start()
+        await client.aclose()
+
+    asyncio.run(second_loop())
+    assert first.is_closed
+    assert client._client is None
@@ -3,22 +3,64 @@ import json
 from typing import List, Optional, Dict, Any, Tuple
 from src.models.message import Message
 
-async def format_conversation_for_ai(messages: List, session_id: str = None, sender_id: str = None) -> List[Dict[str, str]]:
+# Команды, которые AI может вернуть в поле command
+AI_COMMAND_TYPES = ('send_catalog', 'save_order_info', 'add_order_item', 'remove_order_item', 'confirm_order')
+
+_STRING = {"type": "string", "nullable": True}
+_BOOLEAN = {"type": "boolean", "nullable": True}
+
+# Схема ответа для JSON-режима Gemini (response_schema): модель не может вернуть
+# обрезанный JSON, строку вместо команды или неизвестный тип команды
+AI_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "text": {"type": "string"},
+        "text_en": {"type": "string"},
+        "text_thai": {"type": "string"},
+        "command": {
+            "type": "object",
+            "nullable": True,
+            "properties": {
+                "type": {"type": "string", "enum": list(AI_COMMAND_TYPES)},
+                "bouquet": _STRING,
+                "retailer_id": _STRING,
+                "product_id": _STRING,
+                "quantity": {"type": "integer", "nullable": True},
+                "notes": _STRING,
+                "date": _STRING,
+                "time": _STRING,
+                "delivery_needed": _BOOLEAN,
+                "address": _STRING,
+                "card_needed": _BOOLEAN,
+                "card_text": _STRING,
+                "recipient_name": _STRING,
+                "recipient_phone": _STRING
+            },
+            "required": ["type"]
+        }
+    },
+    "required": ["text", "text_en", "text_thai", "command"]
+}
+
+async def format_conversation_for_ai(messages: List, session_id: str = None, sender_id: str = None,
+                                    order_data: Optional[Dict[str, Any]] = None) -> List[Dict[str, str]]:
     """
     Форматирует историю диалога для AI в формат с ролями для Gemini.
     Возвращает список словарей с полями 'role' и 'content'.
     Поддерживает как объекты Message, так и dict.
-    Включает информацию о сохраненных данных заказа.
+    Включает информацию о сохраненных данных заказа
+    (order_data - уже прочитанный заказ; None - прочитать из БД).
     """
     formatted = []
     
     # Добавляем информацию о сохраненных данных заказа в начало истории
-    if session_id and sender_id:
+    if order_data is not None or (session_id and sender_id):
         try:
-            from src.services.order_service import OrderService
-            
-            order_service = OrderService()
-            order_data = await order_service.get_order_data(session_id, sender_id)
+            if order_data is None:
+                from src.services.order_service import OrderService
+                
+                order_service = OrderService()
+                order_data = await order_service.get_order_data(session_id, sender_id)
             
             if order_data and (order_data.get('items') or order_data.get('delivery_needed') or order_data.get('address')):
                 # Формируем сводку сохраненных данных
@@ -109,6 +151,49 @@ def validate_ai_response(response_data: Dict[str, Any]) -> Tuple[bool, str]:
     
     return True, ""
 
+def escape_newlines(s: str) -> str:
+    """Заменяет реальные переносы строк на \\n (формат текста ответа AI)"""
+    if not s:
+        return ''
+    s = s.replace('\r\n', '\\n').replace('\r', '\\n')
+    s = s.replace('\n', '\\n')
+    s = s.replace('\u2028', '\\n').replace('\u2029', '\\n')
+    return s
+
+def decode_ai_response(response_text: str) -> Tuple[str, str, str, Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Быстрый разбор ответа в JSON-режиме (AI_RESPONSE_SCHEMA): один json.loads и
+    проверка типов, без регулярных выражений.
+    Returns:
+        Tuple: (text, text_en, text_thai, command, error) - error равен None, если ответ валиден
+    """
+    try:
+        data = json.loads(response_text)
+    except (TypeError, ValueError) as e:
+        return '', '', '', None, f"invalid_json: {e}"
+    if not isinstance(data, dict):
+        return '', '', '', None, "invalid_json: not an object"
+
+    text = data.get('text')
+    if not isinstance(text, str) or not text.strip():
+        return '', '', '', None, "empty_text"
+    text = escape_newlines(text)
+    text_en = data.get('text_en')
+    text_thai = data.get('text_thai')
+    text_en = escape_newlines(text_en) if isinstance(text_en, str) and text_en else text
+    text_thai = escape_newlines(text_thai) if isinstance(text_thai, str) and text_thai else text
+
+    command = data.get('command')
+    if command is None:
+        return text, text_en, text_thai, None, None
+    if not isinstance(command, dict):
+        return text, text_en, text_thai, None, "invalid_command"
+    if command.get('type') not in AI_COMMAND_TYPES:
+        return text, text_en, text_thai, None, "unknown_command"
+    # null в необязательных полях схемы означает "поле не задано"
+    command = {key: value for key, value in command.items() if value is not None}
+    return text, text_en, text_thai, command, None
+
 def parse_ai_response(response_text: str) -> Tuple[str, str, str, Optional[Dict[str, Any]]]:
     """
     Парсит ответ AI и извлекает текст на трех языках и команду.
@@ -116,14 +201,7 @@ def parse_ai_response(response_text: str) -> Tuple[str, str, str, Optional[Dict[
     Returns:
         Tuple[str, str, str, Optional[Dict]]: (text, text_en, text_thai, command)
     """
-    def fix_newlines(s: str) -> str:
-        if not s:
-            return ''
-        # Заменяем все реальные переносы на \\n
-        s = s.replace('\r\n', '\\n').replace('\r', '\\n')
-        s = s.replace('\n', '\\n')
-        s = s.replace('\u2028', '\\n').replace('\u2029', '\\n')
-        return s
+    fix_newlines = escape_newlines
     
     def preprocess_json_string(json_str: str) -> str:
         """
@@ -0,0 +1,99 @@
+"""
+Простые in-process метрики латентности для мониторинга
+"""
+
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, Optional, Sequence
+
+# Границы корзин гистограммы в миллисекундах
+DEFAULT_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class LatencyHistogram:
+    """
+    Гистограмма латентности с фиксированными корзинами.
+
+    Хранит счетчики по корзинам, сумму и максимум, а также окно последних
+    значений для расчета перцентилей.
+    """
+
+    def __init__(self, buckets_ms: Sequence[float] = DEFAULT_BUCKETS_MS, window: int = 500):
+        self.buckets_ms = tuple(buckets_ms)
+        self.bucket_counts = [0] * (len(self.buckets_ms) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last_ms: Optional[float] = None
+        self._recent = deque(maxlen=window)
+
+    def record(self, value_ms: float):
+        """Добавляет значение в гистограмму"""
+        self.bucket_counts[bisect_left(self.buckets_ms, value_ms)] += 1
+        self.count += 1
+        self.total_ms += value_ms
+        self.last_ms = value_ms
+        if value_ms > self.max_ms:
+            self.max_ms = value_ms
+        self._recent.append(value_ms)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Возвращает перцентиль по окну последних значений"""
+        if not self._recent:
+            return None
+        values = sorted(self._recent)
+        index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+        return values[index]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Возвращает текущее состояние гистограммы в виде словаря"""
+        buckets = {}
+        for bound, bucket_count in zip(self.buckets_ms, self.bucket_counts):
+            buckets[f"le_{bound}ms"] = bucket_count
+        buckets["gt_max"] = self.bucket_counts[-1]
+
+        p50 = self.percentile(50)
+        p95 = self.percentile(95)
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 2),
+            "last_ms": round(self.last_ms, 2) if self.last_ms is not None else None,
+            "p50_ms": round(p50, 2) if p50 is not None else None,
+            "p95_ms": round(p95, 2) if p95 is not None else None,
+            "buckets": buckets
+        }
+
+
+class LatencyRegistry:
+    """Набор именованных гистограмм (по этапам, эндпоинтам и т.д.)"""
+
+    def __init__(self):
+        self._histograms: Dict[str, LatencyHistogram] = {}
+
+    def get(self, name: str) -> LatencyHistogram:
+        """Возвращает гистограмму по имени, создавая ее при необходимости"""
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = LatencyHistogram()
+            self._histograms[name] = histogram
+        return histogram
+
+    def record(self, name: str, value_ms: float):
+        """Записывает значение в гистограмму с указанным именем"""
+        self.get(name).record(value_ms)
+
+    @contextmanager
+    def time(self, name: str) -> Iterator[None]:
+        """Замеряет время выполнения блока и записывает его в гистограмму"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - started) * 1000)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Возвращает состояние всех гистограмм"""
+        return {name: histogram.snapshot() for name, histogram in self._histograms.items()}
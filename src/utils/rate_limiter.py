@@ -0,0 +1,54 @@
+"""
+Ограничение скорости исходящих запросов (token bucket)
+"""
+
+import asyncio
+import time
+from typing import Dict, Any
+
+
+class TokenBucket:
+    """
+    Token bucket: пополняется со скоростью rate токенов в секунду,
+    допускает всплеск до capacity запросов. Ожидающие обслуживаются по порядку.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = max(rate, 0.001)
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._metrics = {
+            "acquired": 0,
+            "throttled": 0,
+            "total_wait_ms": 0.0
+        }
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0):
+        """Ждет, пока в корзине появится нужное количество токенов, и забирает их"""
+        async with self._lock:
+            self._refill()
+            if self._tokens < tokens:
+                wait = (tokens - self._tokens) / self.rate
+                self._metrics["throttled"] += 1
+                self._metrics["total_wait_ms"] += wait * 1000
+                await asyncio.sleep(wait)
+                self._refill()
+            self._tokens -= tokens
+            self._metrics["acquired"] += 1
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Возвращает параметры и статистику ограничителя"""
+        return {
+            "rate_per_sec": self.rate,
+            "capacity": self.capacity,
+            "acquired": self._metrics["acquired"],
+            "throttled": self._metrics["throttled"],
+            "total_wait_ms": round(self._metrics["total_wait_ms"], 2)
+        }
@@ -0,0 +1,180 @@
+"""
+Устойчивость вызовов внешних API: бюджет повторов, задержка с джиттером и
+предохранитель (circuit breaker).
+
+Повтор разрешен, только пока повторов не больше заданной доли от обычных
+вызовов за последнее окно, поэтому при сбое на стороне провайдера повторы
+не умножают нагрузку. Предохранитель размыкается, когда доля ошибок за окно
+превышает порог, и сразу отклоняет вызовы; через open_seconds пропускает
+пробный вызов и замыкается, если тот прошел успешно.
+"""
+
+import random
+import time
+from collections import deque
+from typing import Deque, Dict, Any, Optional, Tuple
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Предохранитель разомкнут - вызов отклонен без обращения к API"""
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 8.0) -> float:
+    """Задержка перед повтором номер attempt (с 1): экспонента с полным джиттером"""
+    return random.uniform(0, min(cap, base * (2 ** max(0, attempt - 1))))
+
+
+class RetryBudget:
+    """
+    Общий бюджет повторов: не больше ratio повторов на один обычный вызов
+    за окно window_seconds, плюс min_retries повторов в окне на случай малой нагрузки.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_retries: int = 3, window_seconds: float = 10.0):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window_seconds = window_seconds
+        self._calls: Deque[float] = deque()
+        self._retries: Deque[float] = deque()
+        self._metrics = {"calls": 0, "retries": 0, "denied": 0}
+
+    def _trim(self, now: float):
+        edge = now - self.window_seconds
+        for events in (self._calls, self._retries):
+            while events and events[0] < edge:
+                events.popleft()
+
+    def record_call(self):
+        """Учитывает обычный (первый) вызов"""
+        now = time.monotonic()
+        self._trim(now)
+        self._calls.append(now)
+        self._metrics["calls"] += 1
+
+    def try_retry(self) -> bool:
+        """Забирает повтор из бюджета; False - бюджет исчерпан, повторять нельзя"""
+        now = time.monotonic()
+        self._trim(now)
+        if len(self._retries) >= self.min_retries + len(self._calls) * self.ratio:
+            self._metrics["denied"] += 1
+            return False
+        self._retries.append(now)
+        self._metrics["retries"] += 1
+        return True
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Возвращает параметры бюджета и число повторов в текущем окне"""
+        self._trim(time.monotonic())
+        return {
+            "ratio": self.ratio,
+            "min_retries": self.min_retries,
+            "window_sec": self.window_seconds,
+            "window_calls": len(self._calls),
+            "window_retries": len(self._retries),
+            **self._metrics
+        }
+
+
+class CircuitBreaker:
+    """Предохранитель по доле ошибок за скользящее окно"""
+
+    def __init__(self, name: str, error_rate_threshold: float = 0.5, min_calls: int = 10,
+                 window_seconds: float = 30.0, open_seconds: float = 20.0):
+        self.name = name
+        self.error_rate_threshold = error_rate_threshold
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._metrics = {"opened": 0, "rejected": 0, "successes": 0, "failures": 0}
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def before_call(self) -> bool:
+        """
+        Проверяет, можно ли вызывать API; иначе бросает CircuitOpenError.
+        Возвращает True, если вызов пробный: его результат нужно записать
+        (record_success/record_failure) или вернуть слот через release_probe.
+        """
+        state = self.state
+        if state == CLOSED:
+            return False
+        if state == HALF_OPEN and not self._probe_in_flight:
+            # Пробный вызов: по его результату предохранитель замкнется или снова разомкнется
+            self._probe_in_flight = True
+            return True
+        self._metrics["rejected"] += 1
+        raise CircuitOpenError(f"Circuit '{self.name}' is open")
+
+    def release_probe(self):
+        """Пробный вызов отменен, не дав результата - следующий вызов станет пробным"""
+        if self._state == HALF_OPEN:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        self._metrics["successes"] += 1
+        if self._state == HALF_OPEN:
+            print(f"[CIRCUIT] {self.name}: пробный вызов успешен, предохранитель замкнут")
+            self._state = CLOSED
+            self._outcomes.clear()
+            self._probe_in_flight = False
+            return
+        self._add_outcome(True)
+
+    def record_failure(self):
+        self._metrics["failures"] += 1
+        if self._state == HALF_OPEN:
+            self._open()
+            return
+        self._add_outcome(False)
+        calls = len(self._outcomes)
+        if self._state == CLOSED and calls >= self.min_calls and self._error_rate() >= self.error_rate_threshold:
+            self._open()
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+        self._metrics["opened"] += 1
+        print(f"[CIRCUIT] {self.name}: предохранитель разомкнут на {self.open_seconds}s "
+              f"(ошибок {self._error_rate():.0%})")
+
+    def _add_outcome(self, ok: bool):
+        now = time.monotonic()
+        self._outcomes.append((now, ok))
+        edge = now - self.window_seconds
+        while self._outcomes and self._outcomes[0][0] < edge:
+            self._outcomes.popleft()
+
+    def _error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return sum(1 for _, ok in self._outcomes if not ok) / len(self._outcomes)
+
+    def retry_after(self) -> Optional[float]:
+        """Сколько секунд до пробного вызова (для разомкнутого предохранителя)"""
+        if self.state != OPEN:
+            return None
+        return round(max(0.0, self.open_seconds - (time.monotonic() - self._opened_at)), 1)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Возвращает состояние предохранителя и долю ошибок в окне"""
+        return {
+            "state": self.state,
+            "error_rate": round(self._error_rate(), 3),
+            "window_calls": len(self._outcomes),
+            "retry_after_sec": self.retry_after(),
+            **self._metrics
+        }
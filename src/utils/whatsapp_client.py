@@ -2,16 +2,128 @@
 Клиент для WhatsApp Business API
 """
 
+import asyncio
+import time
 import httpx
 import json
-from typing import Optional, Dict, Any
-from src.config.settings import WHATSAPP_TOKEN, WHATSAPP_PHONE_ID
+from typing import Optional, Dict, Any, Set
+from src.config.settings import (
+    WHATSAPP_TOKEN, WHATSAPP_PHONE_ID, WHATSAPP_HTTP2, WHATSAPP_MAX_CONNECTIONS,
+    WHATSAPP_MAX_KEEPALIVE_CONNECTIONS, WHATSAPP_KEEPALIVE_EXPIRY, WHATSAPP_TIMEOUT, WHATSAPP_CONNECT_TIMEOUT,
+    WHATSAPP_SEND_RATE_PER_SEC, WHATSAPP_SEND_BURST
+)
+from src.utils.metrics import LatencyRegistry
+from src.utils.rate_limiter import TokenBucket
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
 class WhatsAppClient:
-    def __init__(self):
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None):
         self.token = WHATSAPP_TOKEN
         self.phone_id = WHATSAPP_PHONE_ID
         self.base_url = f"https://graph.facebook.com/v23.0/{self.phone_id}/messages"
+        # Долгоживущий HTTP-клиент с пулом соединений (создается при старте или при первом запросе)
+        self._client = http_client
+        self._client_loop = None
+        # Задачи закрытия клиентов, оставшихся от другого event loop
+        self._closing: Set[asyncio.Task] = set()
+        self.http2 = WHATSAPP_HTTP2 and HTTP2_AVAILABLE
+        # Лимит пропускной способности номера для массовых отправок (каталог)
+        self.send_limiter = TokenBucket(WHATSAPP_SEND_RATE_PER_SEC, WHATSAPP_SEND_BURST)
+        self.latency = LatencyRegistry()
+        self._status_counts: Dict[str, Dict[str, int]] = {}
+
+    def _create_http_client(self) -> httpx.AsyncClient:
+        """Создает HTTP-клиент с пулом keep-alive соединений"""
+        if WHATSAPP_HTTP2 and not HTTP2_AVAILABLE:
+            print("[WHATSAPP] Пакет h2 не установлен, используется HTTP/1.1")
+        return httpx.AsyncClient(
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=WHATSAPP_MAX_CONNECTIONS,
+                max_keepalive_connections=WHATSAPP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=WHATSAPP_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(WHATSAPP_TIMEOUT, connect=WHATSAPP_CONNECT_TIMEOUT)
+        )
+
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """Возвращает общий HTTP-клиент, создавая его при необходимости"""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed:
+            self._client = self._create_http_client()
+            self._client_loop = loop
+        elif self._client_loop is not None and self._client_loop is not loop:
+            # Соединения пула привязаны к event loop - в другом loop создаем новый клиент,
+            # а старый закрываем, чтобы не оставлять открытые сокеты
+            self._discard_client(self._client, self._client_loop)
+            self._client = self._create_http_client()
+            self._client_loop = loop
+        return self._client
+
+    def _discard_client(self, client: httpx.AsyncClient, client_loop: asyncio.AbstractEventLoop):
+        """Закрывает клиент, созданный в другом event loop"""
+        if client.is_closed:
+            return
+        if client_loop.is_running() and not client_loop.is_closed():
+            # Старый loop еще работает (другой поток) - закрываем в нем
+            asyncio.run_coroutine_threadsafe(self._aclose_quietly(client), client_loop)
+            return
+        # Старый loop остановлен: закрываем из текущего, ошибки закрытия его сокетов не важны
+        task = asyncio.get_running_loop().create_task(self._aclose_quietly(client))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    @staticmethod
+    async def _aclose_quietly(client: httpx.AsyncClient):
+        try:
+            await client.aclose()
+        except Exception as e:
+            print(f"[WHATSAPP] Ошибка закрытия HTTP-клиента прежнего event loop: {e!r}")
+
+    async def start(self):
+        """Открывает HTTP-клиент (вызывается при старте приложения)"""
+        self._get_http_client()
+        print(f"[WHATSAPP] HTTP-клиент открыт (http2={self.http2})")
+
+    async def aclose(self):
+        """Закрывает HTTP-клиент и его соединения (вызывается при остановке приложения)"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
+        self._client = None
+        self._client_loop = None
+
+    async def _post(self, endpoint: str, payload: Dict[str, Any]) -> httpx.Response:
+        """Отправляет POST в Graph API через общий клиент с замером латентности"""
+        client = self._get_http_client()
+        started = time.perf_counter()
+        status = "error"
+        try:
+            response = await client.post(self.base_url, headers=self._get_headers(), json=payload)
+            status = str(response.status_code)
+            return response
+        finally:
+            self.latency.record(endpoint, (time.perf_counter() - started) * 1000)
+            endpoint_statuses = self._status_counts.setdefault(endpoint, {})
+            endpoint_statuses[status] = endpoint_statuses.get(status, 0) + 1
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Возвращает латентность и коды ответов по эндпоинтам"""
+        return {
+            "http2": self.http2,
+            "client_open": self._client is not None and not self._client.is_closed,
+            "send_limiter": self.send_limiter.get_metrics(),
+            "endpoints": {
+                endpoint: {**snapshot, "statuses": self._status_counts.get(endpoint, {})}
+                for endpoint, snapshot in self.latency.snapshot().items()
+            }
+        }
 
     def _get_headers(self) -> Dict[str, str]:
         """Получает заголовки для запросов"""
@@ -52,8 +164,6 @@ class WhatsAppClient:
         print(f"[WHATSAPP] Отправка текста: {fixed_text[:50]}... (session_id={session_id})")
         
         try:
-            url = f"https://graph.facebook.com/v23.0/{self.phone_id}/messages"
-            headers = self._get_headers()
             payload = {
                 "messaging_product": "whatsapp",
                 "to": to_number,
@@ -61,22 +171,21 @@ class WhatsAppClient:
                 "text": {"body": fixed_text}
             }
             
-            async with httpx.AsyncClient() as client:
-                response = await client.post(url, headers=headers, json=payload)
-                print(f"[WHATSAPP] Статус ответа: {response.status_code}")
-                
-                if response.status_code == 200:
-                    response_data = response.json()
-                    if 'messages' in response_data and len(response_data['messages']) > 0:
-                        message_id = response_data['messages'][0]['id']
-                        print(f"[WHATSAPP] Сообщение отправлено, ID: {message_id}")
-                        return message_id
-                    else:
-                        print(f"[WHATSAPP] Неожиданный формат ответа: {response_data}")
-                        return None
+            response = await self._post("send_text", payload)
+            print(f"[WHATSAPP] Статус ответа: {response.status_code}")
+            
+            if response.status_code == 200:
+                response_data = response.json()
+                if 'messages' in response_data and len(response_data['messages']) > 0:
+                    message_id = response_data['messages'][0]['id']
+                    print(f"[WHATSAPP] Сообщение отправлено, ID: {message_id}")
+                    return message_id
                 else:
-                    print(f"[WHATSAPP] Ошибка отправки: {response.status_code} - {response.text}")
+                    print(f"[WHATSAPP] Неожиданный формат ответа: {response_data}")
                     return None
+            else:
+                print(f"[WHATSAPP] Ошибка отправки: {response.status_code} - {response.text}")
+                return None
                     
         except Exception as e:
             print(f"[WHATSAPP] Исключение при отправке: {e}")
@@ -109,21 +218,16 @@ class WhatsAppClient:
                 }
             }
 
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    self.base_url, 
-                    headers=self._get_headers(), 
-                    json=payload
-                )
-                response.raise_for_status()
-                
-                response_data = response.json()
-                if 'messages' in response_data and len(response_data['messages']) > 0:
-                    message_id = response_data['messages'][0]['id']
-                    print(f"Image sent successfully to {to_number}, ID: {message_id} (session_id={session_id})")
-                    return message_id
-                
-                return None
+            response = await self._post("send_image", payload)
+            response.raise_for_status()
+            
+            response_data = response.json()
+            if 'messages' in response_data and len(response_data['messages']) > 0:
+                message_id = response_data['messages'][0]['id']
+                print(f"Image sent successfully to {to_number}, ID: {message_id} (session_id={session_id})")
+                return message_id
+            
+            return None
 
         except Exception as e:
             print(f"Error sending image to {to_number}: {e}")
@@ -144,8 +248,6 @@ class WhatsAppClient:
             bool: True если успешно, False если ошибка
         """
         try:
-            url = f"https://graph.facebook.com/v23.0/{self.phone_id}/messages"
-            headers = self._get_headers()
             payload = {
                 "messaging_product": "whatsapp",
                 "status": "read",
@@ -155,16 +257,15 @@ class WhatsAppClient:
                 }
             }
             
-            async with httpx.AsyncClient() as client:
-                response = await client.post(url, headers=headers, json=payload)
-                # print(f"[WHATSAPP_TYPING] Статус: {response.status_code}")
-                
-                if response.status_code == 200:
-                    # print(f"[WHATSAPP_TYPING] Индикатор печати отправлен для сообщения {message_id}")
-                    return True
-                else:
-                    # print(f"[WHATSAPP_TYPING] Ошибка: {response.status_code} - {response.text}")
-                    return False
+            response = await self._post("typing_indicator", payload)
+            # print(f"[WHATSAPP_TYPING] Статус: {response.status_code}")
+            
+            if response.status_code == 200:
+                # print(f"[WHATSAPP_TYPING] Индикатор печати отправлен для сообщения {message_id}")
+                return True
+            else:
+                # print(f"[WHATSAPP_TYPING] Ошибка: {response.status_code} - {response.text}")
+                return False
                     
         except Exception as e:
             # print(f"[WHATSAPP_TYPING] Исключение: {e}")
@@ -181,24 +282,21 @@ class WhatsAppClient:
             bool: True если успешно, False если ошибка
         """
         try:
-            url = f"https://graph.facebook.com/v23.0/{self.phone_id}/messages"
-            headers = self._get_headers()
             payload = {
                 "messaging_product": "whatsapp",
                 "status": "read",
                 "message_id": message_id
             }
             
-            async with httpx.AsyncClient() as client:
-                response = await client.post(url, headers=headers, json=payload)
-                # print(f"[WHATSAPP_READ] Статус: {response.status_code}")
-                
-                if response.status_code == 200:
-                    # print(f"[WHATSAPP_READ] Сообщение {message_id} отмечено как прочитанное")
-                    return True
-                else:
-                    # print(f"[WHATSAPP_READ] Ошибка: {response.status_code} - {response.text}")
-                    return False
+            response = await self._post("mark_read", payload)
+            # print(f"[WHATSAPP_READ] Статус: {response.status_code}")
+            
+            if response.status_code == 200:
+                # print(f"[WHATSAPP_READ] Сообщение {message_id} отмечено как прочитанное")
+                return True
+            else:
+                # print(f"[WHATSAPP_READ] Ошибка: {response.status_code} - {response.text}")
+                return False
                     
         except Exception as e:
             # print(f"[WHATSAPP_READ] Исключение: {e}")